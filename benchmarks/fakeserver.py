@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Local SSH/SFTP server standing in for a cluster login node in the
+# benchmarks. Commands run for real in a scratch home directory whose bin/
+# holds fake squeue, sacct and scancel and whose jobManager/ holds a fake
+# calculationFlow squeuePy.py and sremove.py, all answering from a generated
+# job list. Everything else (ls -p, sha256sum, the remote helper) runs as it
+# would on a login node. Latency is injected when a command starts, on every
+# chunk sent to a running command's stdin and on every SFTP metadata
+# request; file reads can be throttled to a given bandwidth.
+#
+#   python benchmarks/fakeserver.py --jobs 5000 --port 2222
+#
+# serves until interrupted and prints the account to add in the plugin.
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from os.path import join, isabs, isdir, normpath
+
+import paramiko
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+SLURM_SCRIPT = r'''
+import json
+import os
+import sys
+
+root = os.environ["FAKE_CLUSTER_ROOT"]
+
+
+def readIds(name):
+    try:
+        with open(os.path.join(root, name)) as fp:
+            return set(fp.read().split())
+    except IOError:
+        return set()
+
+
+def jobs():
+    with open(os.path.join(root, "jobs.json")) as fp:
+        rows = json.load(fp)
+    cancelled = readIds("cancelled")
+    removed = readIds("removed")
+    for row in rows:
+        if row["jobID"] in removed:
+            continue
+        if row["jobID"] in cancelled:
+            row["Status"] = "CANCELLED"
+        yield row
+
+
+def active(row):
+    return row["Status"] in ("RUNNING", "PENDING")
+
+
+def pipeLine(row):
+    return "|".join((row["jobID"], row["Status"], row["Time"], row["RunningDir"], row["Script file"],
+                     row["Comment"]))
+
+
+def main():
+    command = os.path.basename(sys.argv[0])
+    if command == "fake_slurm.py":
+        command = sys.argv.pop(1)
+    write = sys.stdout.write
+    if command == "squeuePy.py":
+        groups = {}
+        for row in jobs():
+            groups.setdefault(row["Status"], []).append(row)
+        write(json.dumps(groups) if "-json" in sys.argv else repr(groups))
+    elif command == "squeue":
+        for row in jobs():
+            if active(row):
+                write(pipeLine(row) + "\n")
+    elif command == "sacct":
+        for row in jobs():
+            if not active(row):
+                write(pipeLine(row) + "\n")
+    elif command in ("scancel", "sremove.py"):
+        name = "cancelled" if command == "scancel" else "removed"
+        with open(os.path.join(root, name), "a") as fp:
+            fp.write(" ".join(sys.argv[1:]) + "\n")
+
+
+main()
+'''
+
+
+class FakeCluster(object):
+    # The scratch home of the fake login node: job list, job directories,
+    # the file used for download benchmarks and the fake Slurm tools.
+    statuses = ("RUNNING", "PENDING", "COMPLETED", "FAILED", "TIMEOUT")
+
+    def __init__(self, root, jobsNo=1000, commentSize=24, dirsNo=50, filesPerDir=20, downloadSize=8 * 1024 * 1024,
+                 latency=0.0, bandwidth=None, seed=0):
+        self.root = root
+        self.jobsNo = jobsNo
+        self.commentSize = commentSize
+        self.dirsNo = dirsNo
+        self.filesPerDir = filesPerDir
+        self.downloadSize = downloadSize
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.random = random.Random(seed)
+        self.binDir = join(root, "bin")
+        self.jobManagerDir = join(root, "jobManager") + "/"
+        self.scratchDir = join(root, "scratch")
+        self.downloadPath = join(root, "download.pdb")
+
+    def prepare(self):
+        for path in (self.binDir, self.jobManagerDir, self.scratchDir):
+            if not isdir(path):
+                os.makedirs(path)
+        self.writeTools()
+        self.writeJobs()
+        self.writeDirectories()
+        self.writeDownload()
+        return self
+
+    def writeTools(self):
+        script = join(self.binDir, "fake_slurm.py")
+        with open(script, "w") as fp:
+            fp.write(SLURM_SCRIPT)
+
+        # the backends call "python", which need not exist on this machine
+        wrappers = {"python": 'exec "' + sys.executable + '" "$@"\n'}
+        for name in ("squeue", "sacct", "scancel"):
+            wrappers[name] = 'exec "' + sys.executable + '" "' + script + '" ' + name + ' "$@"\n'
+        for name, body in wrappers.items():
+            self.writeExecutable(join(self.binDir, name), "#!/bin/sh\n" + body)
+
+        # run as "python squeuePy.py", the script dispatches on its file name
+        for name in ("squeuePy.py", "sremove.py"):
+            self.writeExecutable(join(self.jobManagerDir, name),
+                                 "import sys\nsys.argv[0] = __file__\nexec(open(" + repr(script) + ").read())\n")
+
+    @staticmethod
+    def writeExecutable(path, text):
+        with open(path, "w") as fp:
+            fp.write(text)
+        os.chmod(path, 0o755)
+
+    def jobDir(self, index):
+        return join(self.scratchDir, "run_%03d" % (index % self.dirsNo))
+
+    def writeJobs(self):
+        comment = ("comment " * (self.commentSize // 8 + 1))[:self.commentSize]
+        rows = []
+        for index in range(self.jobsNo):
+            seconds = self.random.randint(0, 3 * 24 * 3600)
+            rows.append({"jobID": str(1000000 + index), "RunningDir": self.jobDir(index),
+                         "Script file": "run_%d.sh" % (index % 7), "Status": self.random.choice(self.statuses),
+                         "Time": "%d-%02d:%02d:%02d" % (seconds // 86400, seconds // 3600 % 24, seconds // 60 % 60,
+                                                        seconds % 60),
+                         "Comment": comment})
+        with open(join(self.root, "jobs.json"), "w") as fp:
+            json.dump(rows, fp)
+        for name in ("cancelled", "removed"):
+            with open(join(self.root, name), "w"):
+                pass
+
+    def writeDirectories(self):
+        for index in range(min(self.dirsNo, self.jobsNo)):
+            path = self.jobDir(index)
+            if not isdir(path):
+                os.makedirs(path)
+            for fileIndex in range(self.filesPerDir):
+                with open(join(path, "frame_%03d.pdb" % fileIndex), "w") as fp:
+                    fp.write("HETATM    1  C   LIG A   1       0.000   0.000   0.000  1.00  0.00           C\n")
+            if not isdir(join(path, "results")):
+                os.mkdir(join(path, "results"))
+
+    def writeDownload(self):
+        line = b"ATOM      1  CA  ALA A   1      11.104   6.134  -6.504  1.00  0.00           C\n"
+        with open(self.downloadPath, "wb") as fp:
+            written = 0
+            while written < self.downloadSize:
+                block = line * min(4096, (self.downloadSize - written) // len(line) + 1)
+                block = block[:self.downloadSize - written]
+                fp.write(block)
+                written += len(block)
+
+    def account(self, port, backend="calculationFlow", login="bench"):
+        return {"login": login, "password": "bench", "port": port, "host": "127.0.0.1",
+                "jobManagerDir": self.jobManagerDir, "backend": backend}
+
+    def environment(self, login):
+        env = dict(os.environ)
+        env["PATH"] = self.binDir + os.pathsep + env.get("PATH", "/usr/bin:/bin")
+        env["HOME"] = self.root
+        env["USER"] = login
+        env["FAKE_CLUSTER_ROOT"] = self.root
+        return env
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def localPath(self, path):
+        # relative remote paths start in the fake home, absolute ones are local
+        if not isabs(path):
+            path = join(self.root, path)
+        return normpath(path)
+
+
+class CommandRunner(object):
+    # One exec request: the command runs in a shell, its output goes to the
+    # channel, the channel's input to its stdin after the injected latency.
+    def __init__(self, cluster, channel, command, login):
+        self.cluster = cluster
+        self.channel = channel
+        self.command = command
+        self.login = login
+        self.proc = None
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        try:
+            self.cluster.delay()
+            self.proc = subprocess.Popen(self.command, shell=True, cwd=self.cluster.root,
+                                         env=self.cluster.environment(self.login), stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=os.setsid)
+            threads = [threading.Thread(target=self.forward, args=(self.proc.stdout, self.channel.sendall)),
+                       threading.Thread(target=self.forward, args=(self.proc.stderr, self.channel.sendall_stderr)),
+                       threading.Thread(target=self.feed)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            code = self.proc.wait()
+            threads[0].join()
+            threads[1].join()
+            self.channel.send_exit_status(code)
+        except Exception:
+            self.kill()
+        finally:
+            self.channel.close()
+
+    def forward(self, pipe, send):
+        try:
+            while True:
+                data = os.read(pipe.fileno(), 65536)
+                if not data:
+                    break
+                send(data)
+        except Exception:
+            # the client closed the channel, e.g. a cancelled task
+            self.kill()
+
+    def feed(self):
+        delayed = queue.Queue()
+
+        def deliver():
+            while True:
+                deadline, data = delayed.get()
+                wait = deadline - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    if not data:
+                        self.proc.stdin.close()
+                        return
+                    self.proc.stdin.write(data)
+                    self.proc.stdin.flush()
+                except (IOError, OSError, ValueError):
+                    return
+
+        deliverer = threading.Thread(target=deliver)
+        deliverer.daemon = True
+        deliverer.start()
+        while True:
+            try:
+                data = self.channel.recv(65536)
+            except Exception:
+                data = b""
+            delayed.put((time.time() + self.cluster.latency, data))
+            if not data:
+                break
+
+    def kill(self):
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+
+class StubServer(paramiko.ServerInterface):
+    # any password is accepted, keys are not offered
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.login = None
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        self.login = username
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        if not isinstance(command, str):
+            command = command.decode("utf-8")
+        CommandRunner(self.cluster, channel, command, self.login).start()
+        return True
+
+
+class StubSftpHandle(paramiko.SFTPHandle):
+    def __init__(self, cluster, flags=0):
+        paramiko.SFTPHandle.__init__(self, flags)
+        self.cluster = cluster
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+    def read(self, offset, length):
+        data = paramiko.SFTPHandle.read(self, offset, length)
+        if self.cluster.bandwidth and isinstance(data, bytes):
+            time.sleep(len(data) / float(self.cluster.bandwidth))
+        return data
+
+
+class StubSftpServer(paramiko.SFTPServerInterface):
+    # serves the local file system, relative paths from the fake home
+    def __init__(self, server, *args, **kwargs):
+        paramiko.SFTPServerInterface.__init__(self, server, *args, **kwargs)
+        self.cluster = server.cluster
+
+    def call(self, func, *args):
+        self.cluster.delay()
+        try:
+            return func(*args)
+        except (IOError, OSError) as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def canonicalize(self, path):
+        return self.cluster.localPath(path)
+
+    def list_folder(self, path):
+        def listFolder(path):
+            entries = []
+            for name in os.listdir(path):
+                attributes = paramiko.SFTPAttributes.from_stat(os.stat(join(path, name)))
+                attributes.filename = name
+                entries.append(attributes)
+            return entries
+
+        return self.call(listFolder, self.cluster.localPath(path))
+
+    def stat(self, path):
+        return self.call(lambda path: paramiko.SFTPAttributes.from_stat(os.stat(path)), self.cluster.localPath(path))
+
+    def lstat(self, path):
+        return self.call(lambda path: paramiko.SFTPAttributes.from_stat(os.lstat(path)), self.cluster.localPath(path))
+
+    def open(self, path, flags, attr):
+        def openFile(path):
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o644)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            handle = StubSftpHandle(self.cluster, flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        return self.call(openFile, self.cluster.localPath(path))
+
+    def remove(self, path):
+        return self.call(lambda path: os.remove(path) or paramiko.SFTP_OK, self.cluster.localPath(path))
+
+    def rename(self, oldpath, newpath):
+        return self.call(lambda old, new: os.rename(old, new) or paramiko.SFTP_OK,
+                         self.cluster.localPath(oldpath), self.cluster.localPath(newpath))
+
+    def mkdir(self, path, attr):
+        return self.call(lambda path: os.mkdir(path) or paramiko.SFTP_OK, self.cluster.localPath(path))
+
+    def rmdir(self, path):
+        return self.call(lambda path: os.rmdir(path) or paramiko.SFTP_OK, self.cluster.localPath(path))
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+class FakeServer(object):
+    # Accepts SSH connections on localhost in a background thread, every
+    # connection gets its own paramiko transport.
+    def __init__(self, cluster, host="127.0.0.1", port=0):
+        self.cluster = cluster
+        # clients closing their connections are not worth a traceback
+        logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+        self.hostKey = paramiko.RSAKey.generate(2048)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.port = self.socket.getsockname()[1]
+        self.transports = []
+        self.running = False
+
+    def start(self):
+        self.socket.listen(100)
+        self.running = True
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def serve(self):
+        while self.running:
+            try:
+                client, address = self.socket.accept()
+            except (socket.error, OSError):
+                break
+            transport = paramiko.Transport(client)
+            transport.use_compression(True)
+            transport.add_server_key(self.hostKey)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StubSftpServer)
+            try:
+                transport.start_server(server=StubServer(self.cluster))
+            except (paramiko.SSHException, EOFError):
+                continue
+            self.transports.append(transport)
+
+    def stop(self):
+        self.running = False
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+        self.socket.close()
+        for transport in self.transports:
+            transport.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake cluster login node for the slurm_watcher benchmarks")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--root", help="scratch home, a temporary directory by default")
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--comment-size", type=int, default=24)
+    parser.add_argument("--files-per-dir", type=int, default=20)
+    parser.add_argument("--download-mb", type=float, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added per request")
+    parser.add_argument("--bandwidth-mb", type=float, help="limit file reads to this many MB/s")
+    args = parser.parse_args(argv)
+
+    root = args.root or tempfile.mkdtemp(prefix="fake_cluster_")
+    cluster = FakeCluster(os.path.abspath(root), args.jobs, args.comment_size, filesPerDir=args.files_per_dir,
+                          downloadSize=int(args.download_mb * 1024 * 1024), latency=args.latency,
+                          bandwidth=args.bandwidth_mb and args.bandwidth_mb * 1024 * 1024).prepare()
+    server = FakeServer(cluster, port=args.port).start()
+    print("Serving " + cluster.root + " on port " + str(server.port) + ", account:")
+    print(json.dumps(cluster.account(server.port)))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
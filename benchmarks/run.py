@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Benchmarks of slurm_watcher against the fake login node of fakeserver.py.
+# Every combination of job count, latency and status backend gets its own
+# server; each mode runs in a separate process with a scratch HOME, so the
+# real ~/.slurm_watcher and ~/.ssh are never touched.
+#
+#   headless  SlurmWatcher API: connect, status, row model, filter keystrokes,
+#             directory listings, download
+#   tk        the plugin window: start, connect, status until rendered, table
+#             population, filterJobs, filter keystrokes, directory navigation,
+#             download; needs a display, Xvfb is started when there is none
+#
+#   python benchmarks/run.py --jobs 1000 20000 --latency 0 0.05 -o new.json
+#   python benchmarks/run.py --latency 0.05 --compression off gzip ssh
+#   python benchmarks/run.py --compare old.json new.json
+#
+# Results are written as JSON with the git revision of the tree, summaries
+# are in seconds except the MB/s of downloads. Headless runs also note the
+# bytes received on the wire against the decoded bytes.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+benchmarkDir = dirname(abspath(__file__))
+repoDir = dirname(benchmarkDir)
+resultMarker = "BENCHMARK_RESULT "
+
+FILTER_QUERIES = ("run_01", "status:running", "-status:failed id:100", "~\"run_0[0-4]\"")
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {"samples": 0}
+    middle = len(ordered) // 2
+    median = ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2.0
+    return {"samples": len(ordered), "min": ordered[0], "median": median, "mean": sum(ordered) / len(ordered),
+            "max": ordered[-1]}
+
+
+class Metrics(object):
+    def __init__(self):
+        self.samples = {}
+        self.info = {}
+
+    def add(self, name, value):
+        self.samples.setdefault(name, []).append(value)
+
+    @staticmethod
+    def timed(func, *args):
+        start = time.time()
+        result = func(*args)
+        return time.time() - start, result
+
+    def measure(self, name, func, *args):
+        elapsed, result = self.timed(func, *args)
+        self.add(name, elapsed)
+        return result
+
+    def result(self):
+        summary = dict((name, summarize(samples)) for name, samples in self.samples.items())
+        return {"metrics": summary, "info": self.info}
+
+
+def keystrokes(queries):
+    # every query typed one character at a time, starting from an empty entry
+    for query in queries:
+        for length in range(len(query) + 1):
+            yield query[:length]
+
+
+def jobDirs(rows, limit):
+    paths = []
+    for row in rows:
+        if row["RunningDir"] not in paths:
+            paths.append(row["RunningDir"])
+    return paths[:limit]
+
+
+def benchmarkHeadless(settings, metrics):
+    import slurm_watcher as sw
+
+    watcher = sw.SlurmWatcher(settings["configDir"])
+    failed = metrics.measure("connect", watcher.connect, watcher.accounts())
+    if failed:
+        raise RuntimeError("Cannot connect: " + repr(failed))
+
+    try:
+        for index in range(settings["repeat"]):
+            rows, failed = metrics.measure("status", watcher.status)
+            if failed:
+                raise RuntimeError("Status failed: " + repr(failed))
+        metrics.info["rows"] = len(rows)
+
+        jobFilter = sw.JobFilter()
+        for index in range(settings["repeat"]):
+            start = time.time()
+            keyedRows = [(sw.JobTable.rowKey(row), sw.JobTable.tableRow(row)) for row in rows]
+            jobFilter.setRows(sw.JobSorter().sort(keyedRows))
+            metrics.add("rows model", time.time() - start)
+
+        for query in keystrokes(FILTER_QUERIES):
+            metrics.measure("filter keystroke", jobFilter.filter, query)
+
+        session = watcher.session()
+        for path in jobDirs(rows, settings["dirs"]):
+            metrics.measure("list dir cold", session.listDir, path, None, True)
+            metrics.measure("list dir cached", session.listDir, path)
+
+        localPath = join(settings["workDir"], "download.pdb")
+        for index in range(settings["repeat"]):
+            elapsed, path = metrics.timed(watcher.download, settings["downloadPath"], localPath)
+            metrics.add("download", elapsed)
+            metrics.add("download MB/s", os.path.getsize(path) / 1048576.0 / elapsed)
+            os.remove(path)
+
+        traffic = session.traffic
+        metrics.info.update({"wireBytes": traffic.wire, "decodedBytes": traffic.decoded, "rtt": traffic.rtt,
+                             "bandwidth": traffic.bandwidth, "compressPayloads": session.compressPayloads()})
+    finally:
+        watcher.close()
+
+
+def benchmarkTk(settings, metrics):
+    import slurm_watcher as sw
+
+    def pump(done, timeout=300):
+        deadline = time.time() + timeout
+        while not done():
+            if time.time() > deadline:
+                raise RuntimeError("Timed out waiting for the GUI")
+            root.update()
+            time.sleep(0.001)
+
+    root = sw.Tkinter.Tk()
+    startupTimer = sw.PhaseTimer()
+    window = sw.Tkinter.Toplevel(root)
+    nb = sw.ttk.Notebook(window, height=780, width=1390)
+    startupTimer.mark("window")
+    gui = sw.JobStatusGUI(nb, startupTimer)
+    root.update()
+    metrics.add("startup", startupTimer.total())
+    metrics.info["startup phases"] = startupTimer.phases
+
+    try:
+        account = settings["account"]
+        nb.select(gui.loginData)
+        gui.buildSelectedTab()
+        for entry, value in ((gui.loginEntry, account["login"]), (gui.hostEntry, account["host"]),
+                             (gui.portEntry, account["port"]), (gui.passwordEntry, account["password"]),
+                             (gui.jobManagerDirEntry, account["jobManagerDir"])):
+            entry.delete(0, "end")
+            entry.insert(0, str(value))
+        gui.statusBackend.set(account["backend"])
+        nb.select(gui.jobMonitor)
+        start = time.time()
+        gui.connect()
+        pump(lambda: gui.connected and not gui.connecting and gui.incomingStatus is None)
+        metrics.add("connect", time.time() - start)
+
+        for index in range(settings["repeat"]):
+            start = time.time()
+            gui.requestStatus(False)
+            pump(lambda: gui.incomingStatus is None)
+            root.update_idletasks()
+            metrics.add("status", time.time() - start)
+        rows = list(gui.statusRows())
+        metrics.info["rows"] = len(rows)
+
+        keyedRows = gui.jobFilter.filter("")
+        for index in range(settings["repeat"]):
+            gui.jobTable.update([])
+            root.update_idletasks()
+            start = time.time()
+            gui.jobTable.update(keyedRows)
+            root.update_idletasks()
+            metrics.add("table population", time.time() - start)
+
+        for index in range(settings["repeat"]):
+            start = time.time()
+            gui.filterJobs()
+            root.update_idletasks()
+            metrics.add("filterJobs", time.time() - start)
+
+        for query in keystrokes(FILTER_QUERIES):
+            gui.filterEntry.delete(0, "end")
+            gui.filterEntry.insert(0, query)
+            start = time.time()
+            gui.applyFilter()
+            root.update_idletasks()
+            metrics.add("filter keystroke", time.time() - start)
+        gui.filterEntry.delete(0, "end")
+        gui.applyFilter()
+
+        for path in jobDirs(rows, settings["dirs"]):
+            for name, refresh in (("list dir cold", True), ("list dir cached", False)):
+                gui.setCurrentDir(path)
+                gui.directoryViewList.delete(0, "end")
+                start = time.time()
+                gui.listRemoteDir(path, None, refresh)
+                pump(lambda: gui.directoryViewList.size() > 0)
+                root.update_idletasks()
+                metrics.add(name, time.time() - start)
+
+        localPath = join(settings["workDir"], "download.pdb")
+        for index in range(settings["repeat"]):
+            done = []
+            start = time.time()
+            gui.executor.submit("download", gui.downloadRunner(settings["downloadPath"], localPath), done.append,
+                                lambda error: done.append(error))
+            pump(lambda: done)
+            elapsed = time.time() - start
+            if isinstance(done[0], Exception):
+                raise done[0]
+            metrics.add("download", elapsed)
+            metrics.add("download MB/s", os.path.getsize(localPath) / 1048576.0 / elapsed)
+            os.remove(localPath)
+    finally:
+        gui.statusPoller.stop()
+        gui.executor.shutdown()
+        for session in gui.connections.values():
+            session.close()
+        root.destroy()
+
+
+def runChild(args):
+    with open(args.child) as fp:
+        settings = json.load(fp)
+    sys.path.insert(0, repoDir)
+    metrics = Metrics()
+    {"headless": benchmarkHeadless, "tk": benchmarkTk}[settings["mode"]](settings, metrics)
+    sys.stdout.write(resultMarker + json.dumps(metrics.result()) + "\n")
+
+
+def startDisplay():
+    # an Xvfb display for the Tk runs when there is no display
+    if os.environ.get("DISPLAY"):
+        return None, os.environ["DISPLAY"]
+    if not shutil.which("Xvfb"):
+        return None, None
+    for number in range(99, 120):
+        if os.path.exists("/tmp/.X11-unix/X%d" % number) or os.path.exists("/tmp/.X%d-lock" % number):
+            continue
+        proc = subprocess.Popen(["Xvfb", ":%d" % number, "-screen", "0", "1600x1000x24", "-nolisten", "tcp"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 10
+        while time.time() < deadline and proc.poll() is None:
+            if os.path.exists("/tmp/.X11-unix/X%d" % number):
+                return proc, ":%d" % number
+            time.sleep(0.05)
+        proc.kill()
+    return None, None
+
+
+def runMode(mode, account, cluster, args, workDir, display):
+    home = tempfile.mkdtemp(prefix="home_", dir=workDir)
+    configDir = join(home, ".slurm_watcher")
+    os.mkdir(configDir)
+    with open(join(configDir, "config.json"), "w") as fp:
+        json.dump({"accounts": [account], "useRemoteHelper": 0 if args.no_helper else 1}, fp)
+
+    settings = {"mode": mode, "account": account, "configDir": configDir, "workDir": home, "repeat": args.repeat,
+                "dirs": args.dirs, "downloadPath": cluster.downloadPath}
+    settingsPath = join(home, "settings.json")
+    with open(settingsPath, "w") as fp:
+        json.dump(settings, fp)
+
+    env = dict(os.environ)
+    env["HOME"] = home
+    env.pop("SSH_AUTH_SOCK", None)
+    if display:
+        env["DISPLAY"] = display
+    proc = subprocess.Popen([sys.executable, abspath(__file__), "--child", settingsPath], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    for line in out.decode("utf-8", "replace").splitlines():
+        if line.startswith(resultMarker):
+            return json.loads(line[len(resultMarker):])
+    return {"error": err.decode("utf-8", "replace").strip().splitlines()[-1:] or ["exit code " + str(proc.returncode)]}
+
+
+def revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repoDir, stderr=subprocess.DEVNULL)
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "slurm_watcher.py"], cwd=repoDir)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.decode().strip() + ("-dirty" if dirty else "")
+
+
+def runBenchmarks(args):
+    import paramiko
+    from fakeserver import FakeCluster, FakeServer
+
+    workDir = tempfile.mkdtemp(prefix="slurm_watcher_bench_")
+    displayProc, display = (None, None)
+    if "tk" in args.modes:
+        displayProc, display = startDisplay()
+
+    report = {"revision": revision(), "label": args.label, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "paramiko": paramiko.__version__, "platform": platform.platform(),
+              "runs": []}
+    try:
+        for jobsNo in args.jobs:
+            for latency in args.latency:
+                root = tempfile.mkdtemp(prefix="cluster_", dir=workDir)
+                cluster = FakeCluster(root, jobsNo, args.comment_size, filesPerDir=args.files_per_dir,
+                                      downloadSize=int(args.download_mb * 1048576), latency=latency,
+                                      bandwidth=args.bandwidth_mb and args.bandwidth_mb * 1048576).prepare()
+                server = FakeServer(cluster).start()
+                try:
+                    for backend in args.backends:
+                        for compression in args.compression:
+                            for mode in args.modes:
+                                parameters = {"mode": mode, "backend": backend, "jobs": jobsNo, "latency": latency,
+                                              "commentSize": args.comment_size, "downloadMB": args.download_mb,
+                                              "bandwidthMB": args.bandwidth_mb, "helper": not args.no_helper,
+                                              "compression": compression}
+                                sys.stderr.write("running " + json.dumps(parameters, sort_keys=True) + "\n")
+                                if mode == "tk" and not display:
+                                    result = {"skipped": "no display and no Xvfb"}
+                                else:
+                                    account = cluster.account(server.port, backend)
+                                    account["compression"] = compression
+                                    result = runMode(mode, account, cluster, args, workDir, display)
+                                result["parameters"] = parameters
+                                report["runs"].append(result)
+                finally:
+                    server.stop()
+    finally:
+        if displayProc is not None:
+            displayProc.kill()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=1, sort_keys=True)
+    printReport(report)
+
+
+def runKey(run):
+    parameters = run["parameters"]
+    return tuple(sorted((name, str(value)) for name, value in parameters.items()))
+
+
+def printReport(report):
+    for run in report["runs"]:
+        parameters = run["parameters"]
+        print("%(mode)s %(backend)s, %(jobs)d jobs, %(latency)g s latency, %(compression)s compression" % parameters)
+        if "metrics" not in run:
+            print("  " + str(run.get("skipped") or run.get("error")))
+            continue
+        info = run.get("info", {})
+        if "wireBytes" in info:
+            print("  wire %.1f kB, decoded %.1f kB" % (info["wireBytes"] / 1024.0, info["decodedBytes"] / 1024.0))
+        for name in sorted(run["metrics"]):
+            summary = run["metrics"][name]
+            print("  %-18s median %10.4f  max %10.4f  (%d)" % (name, summary["median"], summary["max"],
+                                                                summary["samples"]))
+
+
+def compareReports(oldPath, newPath):
+    # medians of the runs both files share; for MB/s higher is better
+    with open(oldPath) as fp:
+        old = json.load(fp)
+    with open(newPath) as fp:
+        new = json.load(fp)
+    oldRuns = dict((runKey(run), run) for run in old["runs"] if "metrics" in run)
+
+    print(str(old.get("label") or old.get("revision")) + " -> " + str(new.get("label") or new.get("revision")))
+    for run in new["runs"]:
+        oldRun = oldRuns.get(runKey(run))
+        if oldRun is None or "metrics" not in run:
+            continue
+        print("%(mode)s %(backend)s, %(jobs)d jobs, %(latency)g s latency, %(compression)s compression" %
+              run["parameters"])
+        for name in sorted(run["metrics"]):
+            if name not in oldRun["metrics"]:
+                continue
+            before = oldRun["metrics"][name]["median"]
+            after = run["metrics"][name]["median"]
+            change = (after - before) / before * 100 if before else 0.0
+            print("  %-18s %10.4f -> %10.4f  %+7.1f%%" % (name, before, after, change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="slurm_watcher benchmarks against a local fake cluster")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0, 0.05],
+                        help="seconds added per request on the fake server")
+    parser.add_argument("--backends", nargs="+", default=["calculationFlow", "slurm"])
+    parser.add_argument("--modes", nargs="+", default=["headless", "tk"], choices=["headless", "tk"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dirs", type=int, default=10, help="job directories listed")
+    parser.add_argument("--comment-size", type=int, default=24)
+    parser.add_argument("--files-per-dir", type=int, default=20)
+    parser.add_argument("--download-mb", type=float, default=16)
+    parser.add_argument("--bandwidth-mb", type=float, help="limit file reads to this many MB/s")
+    parser.add_argument("--no-helper", action="store_true", help="run every command with its own exec_command")
+    parser.add_argument("--compression", nargs="+", default=["auto"],
+                        choices=["auto", "off", "ssh", "gzip", "both"])
+    parser.add_argument("--label", help="name of this run in comparisons")
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        runChild(args)
+    elif args.compare:
+        compareReports(*args.compare)
+    else:
+        runBenchmarks(args)
+
+
+if __name__ == "__main__":
+    main()
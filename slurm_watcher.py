@@ -3,75 +3,3267 @@
 import os
 import sys
 import json
+import marshal
+import itertools
+import math
+import operator
+import ast
+import base64
+import codecs
+import hashlib
+import re
+import socket
+import zlib
 from os.path import expanduser, join, isdir, isfile, normpath
 from os import mkdir, listdir, getcwd, chdir, getenv
 from copy import copy
+from contextlib import contextmanager
+from collections import OrderedDict, deque
 import platform
+import posixpath
+import stat
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
 
 try:
-    from pymol import cmd, plugins
-except Exception:
-    pass
+    import queue
+except ImportError:
+    import Queue as queue
 
 try:
-    import paramiko
-except Exception:
+    from shlex import quote as shellQuote
+except ImportError:
+    from pipes import quote as shellQuote
+
+# the command line interface (python slurm_watcher.py <command>) and the
+# SlurmWatcher API run without Tk and PyMOL, e.g. from cron on a machine
+# without a display or python3-tk
+HEADLESS = __name__ == "__main__" and len(sys.argv) > 1
+
+# PyMOL is only imported when the plugin is loaded into it
+if not HEADLESS and "pymol" in sys.modules:
+    try:
+        from pymol import cmd, plugins
+    except Exception:
+        pass
+
+# imported by loadParamiko() on the first connection
+paramiko = None
+
+Tkinter = None
+simpledialog = None
+
+if not HEADLESS:
+    try:
+        if sys.version_info[0] < 3:
+            import Tkinter
+            import tkMessageBox
+            import tkFileDialog
+            import tkSimpleDialog as simpledialog
+            import ttk
+        else:
+            import tkinter as Tkinter
+            import tkinter.ttk as ttk
+            from tkinter import simpledialog
+            from tkinter import filedialog as tkFileDialog
+            from tkinter import messagebox as tkMessageBox
+    except ImportError:
+        Tkinter = None
+        simpledialog = None
+
+
+if simpledialog is not None:
+    class CommandDialog(simpledialog.Dialog):
+
+        def __init__(self, parent, initialName, initialCommand):
+            self.initialName = initialName
+            self.initialCommand = initialCommand
+            self.results = (initialName, initialCommand)
+            simpledialog.Dialog.__init__(self, parent)
+
+        def buttonbox(self):
+            simpledialog.Dialog.buttonbox(self)
+            self.unbind("<Return>")
+
+        def body(self, master):
+            Tkinter.Label(master, text="Name:").grid(row=0, column=0)
+            Tkinter.Label(master, text="Command:").grid(row=1, column=0, columnspan=2)
+
+            self.e1 = Tkinter.Entry(master, width=50)
+            self.e2 = Tkinter.Text(master)
+
+            self.e1.grid(row=0, column=1)
+            self.e2.grid(row=2, column=0, columnspan=2)
+
+            self.e1.insert("end", self.initialName)
+            self.e2.insert("end", self.initialCommand)
+
+            #        self.e2.tag_configure("import_tag", foreground = "blue")
+            #        self.e2.highlight_pattern("import", "import_tag")
+            # initial focus
+            return self.e1
+
+        def apply(self):
+            name = self.e1.get()
+            command = self.e2.get("1.0", "end")
+
+            self.results = (name, command)
+
+
+class TaskCancelled(Exception):
     pass
 
-if sys.version_info[0] < 3:
-    import Tkinter
-    import tkMessageBox
-    import tkFileDialog
-    import tkSimpleDialog as simpledialog
-    import ttk
 
-else:
-    import tkinter as Tkinter
-    import tkinter.ttk as ttk
-    from tkinter import simpledialog
-    from tkinter import filedialog as tkFileDialog
-    from tkinter import messagebox as tkMessageBox
+class RemoteTask(object):
+    def __init__(self, executor, name, func, onDone, onError, key, span=None):
+        self.executor = executor
+        self.name = name
+        self.func = func
+        self.onDone = onDone
+        self.onError = onError
+        self.key = key
+        self.span = span or NULL_SPAN
+        self.cancelled = False
+        self.running = False
+        self.detail = ""
+        self.cancelHooks = []
+        self.lock = threading.Lock()
+
+    def addCancelHook(self, hook):
+        with self.lock:
+            if not self.cancelled:
+                self.cancelHooks.append(hook)
+                return
+        hook()
+
+    def cancel(self):
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            hooks = self.cancelHooks
+            self.cancelHooks = []
+
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                pass
+
+    def checkCancelled(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+    def post(self, callback, *args):
+        # schedule callback on the Tk thread unless the task was cancelled meanwhile
+        self.executor.post(self._guarded, callback, args)
+
+    def _guarded(self, callback, args):
+        if not self.cancelled:
+            start = time.time()
+            callback(*args)
+            self.span.add("render", time.time() - start)
+
+
+class RemoteExecutor(object):
+    # Runs blocking (network) work on worker threads. Results are handed back
+    # to the Tk thread through a queue drained by an after() loop, so widget
+    # code never touches the network and never waits for it.
+    def __init__(self, widget, workersNo=4, pumpInterval=30):
+        self.widget = widget
+        self.pumpInterval = pumpInterval
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.active = []
+        self.keyed = {}
+        self.activityListeners = []
+        self.stopped = False
+
+        for i in range(workersNo):
+            worker = threading.Thread(target=self._work, name="slurm_watcher-worker-%d" % i)
+            worker.daemon = True
+            worker.start()
+
+        self.widget.after(self.pumpInterval, self._pump)
+
+    def submit(self, name, func, onDone=None, onError=None, key=None, span=None):
+        # span (see PerfRecorder) is finished when the result or error is delivered
+        task = RemoteTask(self, name, func, onDone, onError, key, span)
+
+        with self.lock:
+            if key is not None:
+                previous = self.keyed.get(key)
+                if previous is not None:
+                    previous.cancel()
+                self.keyed[key] = task
+            self.active.append(task)
+
+        self.tasks.put(task)
+        self._notifyActivity()
+        return task
+
+    def post(self, callback, *args):
+        self.results.put((callback, args))
+
+    def cancelKeyed(self, key):
+        with self.lock:
+            task = self.keyed.get(key)
+        if task is not None:
+            task.cancel()
+            self._notifyActivity()
+
+    def cancelAll(self):
+        with self.lock:
+            tasks = list(self.active)
+
+        for task in tasks:
+            task.cancel()
+
+        self._notifyActivity()
+
+    def activeTasks(self):
+        with self.lock:
+            return [task for task in self.active if not task.cancelled]
+
+    def addActivityListener(self, listener):
+        self.activityListeners.append(listener)
+
+    def shutdown(self):
+        self.stopped = True
+        self.cancelAll()
+        for i in range(32):
+            self.tasks.put(None)
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None or self.stopped:
+                return
+
+            if task.cancelled:
+                self._finish(task)
+                continue
+
+            task.running = True
+            task.span.mark("queue")
+            try:
+                result = task.func(task)
+            except TaskCancelled:
+                pass
+            except Exception as e:
+                if not task.cancelled:
+                    self.post(self._deliverError, task, e, traceback.format_exc())
+            else:
+                if not task.cancelled:
+                    self.post(self._deliverResult, task, result)
+            self._finish(task)
+
+    def _finish(self, task):
+        task.running = False
+        with self.lock:
+            if task in self.active:
+                self.active.remove(task)
+            if task.key is not None and self.keyed.get(task.key) is task:
+                del self.keyed[task.key]
+        self.post(self._notifyActivity)
+
+    def _deliverResult(self, task, result):
+        if task.cancelled:
+            return
+        if task.onDone is not None:
+            task.span.mark("deliver")
+            task.onDone(result)
+            task.span.mark("render")
+        task.span.finish()
+
+    def _deliverError(self, task, error, details):
+        if task.cancelled:
+            return
+        task.span.finish(error)
+        if task.onError is not None:
+            task.onError(error)
+        else:
+            tkMessageBox.showwarning(title="Operation failed",
+                                     message=task.name + " failed:\n" + str(error))
+
+    def _notifyActivity(self):
+        for listener in self.activityListeners:
+            listener()
+
+    def _pump(self):
+        if self.stopped:
+            return
+
+        while True:
+            try:
+                callback, args = self.results.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+
+        self.widget.after(self.pumpInterval, self._pump)
 
 
-class CommandDialog(simpledialog.Dialog):
+AGENT_SCRIPT = r'''
+import ast
+import base64
+import codecs
+import hashlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import zlib
+
+lock = threading.Lock()
+processes = {}
+statusLock = threading.Lock()
+statusVersions = {}
+keptVersions = 4
+statusBatch = 2000
+packedFields = ("data", "stderr", "output", "upserts", "removed", "order")
+packMinimum = 2048
+
+
+def pack(message):
+    # large payload fields travel zlib compressed and base64 encoded in "gz"
+    payload = dict((key, message.pop(key)) for key in packedFields if key in message)
+    text = json.dumps(payload)
+    if len(text) < packMinimum:
+        message.update(payload)
+    else:
+        message["gz"] = base64.b64encode(zlib.compress(text.encode("utf-8"), 1)).decode("ascii")
+    return message
+
+
+def send(message, compress=False):
+    if compress:
+        message = pack(message)
+    data = json.dumps(message)
+    with lock:
+        sys.stdout.write(data + "\n")
+        sys.stdout.flush()
+
+
+def run(requestId, args, cwd=None, shell=False):
+    proc = subprocess.Popen(args, cwd=cwd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            preexec_fn=os.setsid)
+    processes[requestId] = proc
+    try:
+        out, err = proc.communicate()
+    finally:
+        processes.pop(requestId, None)
+    return out.decode("utf-8", "replace"), err.decode("utf-8", "replace"), proc.returncode
+
+
+def forward(requestId, pipe, key, compress=False):
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    while True:
+        data = os.read(pipe.fileno(), 65536)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            send({"id": requestId, "partial": True, key: text}, compress)
+
+
+def stream(requestId, command, cwd=None, compress=False):
+    proc = subprocess.Popen(command, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            preexec_fn=os.setsid)
+    processes[requestId] = proc
+    errorReader = threading.Thread(target=forward, args=(requestId, proc.stderr, "stderr", compress))
+    errorReader.start()
+    try:
+        forward(requestId, proc.stdout, "data", compress)
+        proc.wait()
+        errorReader.join()
+    finally:
+        processes.pop(requestId, None)
+    return proc.returncode
+
+
+def statusRecords(output, format):
+    # (key, text) of every job in a status output: a row of a squeuePy dump
+    # ("json") or a line keyed by its first "|" field ("lines"); repeated
+    # keys are numbered so every key is unique
+    if format == "json":
+        try:
+            data = json.loads(output)
+        except ValueError:
+            data = ast.literal_eval(output)
+        items = [(json.dumps([group, row.get("jobID")]), json.dumps([group, row]))
+                 for group in data for row in data[group]]
+    else:
+        lines = output.split("\n")
+        if lines and not lines[-1]:
+            lines.pop()
+        items = [(line.split("|", 1)[0], line) for line in lines]
+
+    seen = {}
+    records = []
+    for key, text in items:
+        seen[key] = seen.get(key, -1) + 1
+        records.append((key + "#" + str(seen[key]), text))
+    return records
+
+
+def status(requestId, command, format, since, compress=False):
+    # runs the status command and sends only what changed since the version
+    # the client holds: upserted records in partial messages, then the
+    # removed keys and, when it cannot be derived, the new key order
+    out, err, code = run(requestId, command, shell=True)
+    if code != 0 and not out.strip():
+        raise RuntimeError(err.strip() or "status command failed with code " + str(code))
+
+    records = statusRecords(out, format)
+    digest = hashlib.sha1()
+    for key, text in records:
+        digest.update((key + "\t" + text + "\n").encode("utf-8"))
+    version = digest.hexdigest()
+    keys = [key for key, text in records]
+    texts = dict(records)
+
+    with statusLock:
+        versions = statusVersions.setdefault(command, [])
+        previous = None
+        for oldVersion, oldKeys, oldTexts in versions:
+            if oldVersion == since:
+                previous = (oldKeys, oldTexts)
+        versions[:] = [item for item in versions if item[0] != version][-(keptVersions - 1):]
+        versions.append((version, keys, texts))
+
+    if since == version:
+        return {"version": version, "notModified": True}
+
+    full = previous is None
+    if full:
+        upserts = records
+        removed = []
+        order = None
+    else:
+        oldKeys, oldTexts = previous
+        upserts = [(key, text) for key, text in records if oldTexts.get(key) != text]
+        removed = [key for key in oldKeys if key not in texts]
+        expected = [key for key in oldKeys if key in texts] + [key for key in keys if key not in oldTexts]
+        order = None if expected == keys else keys
+
+    for start in range(0, len(upserts), statusBatch):
+        send({"id": requestId, "partial": True, "full": full, "upserts": upserts[start:start + statusBatch]},
+             compress)
+    return {"version": version, "full": full, "removed": removed, "order": order}
+
+
+def handle(request):
+    requestId = request.get("id")
+    op = request.get("op")
+    compress = request.get("compress", False)
+    response = {"id": requestId, "ok": True}
+    try:
+        if op == "ping":
+            pass
+        elif op == "exec":
+            response["code"] = stream(requestId, request["command"], request.get("dir"), compress)
+        elif op == "cancel":
+            response["output"], response["stderr"], response["code"] = run(requestId, ["scancel", request["jobID"]])
+        elif op == "status":
+            response.update(status(requestId, request["command"], request.get("format"), request.get("since"),
+                                   compress))
+        elif op == "run":
+            response["output"], response["stderr"], response["code"] = run(requestId, request["command"],
+                                                                           cwd=request["dir"], shell=True)
+        elif op == "abort":
+            proc = processes.get(request["target"])
+            if proc is not None:
+                os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            raise ValueError("unknown operation: " + str(op))
+    except Exception as e:
+        response = {"id": requestId, "ok": False, "error": str(e)}
+    send(response, compress)
 
-    def __init__(self, parent, initialName, initialCommand):
-        self.initialName = initialName
-        self.initialCommand = initialCommand
-        self.results = (initialName, initialCommand)
-        simpledialog.Dialog.__init__(self, parent)
 
-    def buttonbox(self):
-        simpledialog.Dialog.buttonbox(self)
-        self.unbind("<Return>")
+def main():
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        threading.Thread(target=handle, args=(json.loads(line),)).start()
 
-    def body(self, master):
-        Tkinter.Label(master, text="Name:").grid(row=0, column=0)
-        Tkinter.Label(master, text="Command:").grid(row=1, column=0, columnspan=2)
 
-        self.e1 = Tkinter.Entry(master, width=50)
-        self.e2 = Tkinter.Text(master)
+if __name__ == "__main__":
+    main()
+'''
+
+
+class StatusStreamParser(object):
+    # Incremental reader for the squeuePy.py dump: a dict of lists of flat row
+    # dicts, written either as JSON or as a Python repr. A row is decoded as
+    # soon as its closing brace arrives and only the unfinished tail of the
+    # input is buffered, so the full payload is never held as one string.
+    tokenRegex = re.compile(r"[{}\[\]'\"]")
+    stringRegex = {"'": re.compile(r"'[^'\\]*(?:\\.[^'\\]*)*'", re.S),
+                   '"': re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)}
+    rowTokenRegex = re.compile(r"'[^'\\]*(?:\\.[^'\\]*)*'|\"[^\"\\]*(?:\\.[^\"\\]*)*\"|[{}'\"]", re.S)
+
+    def __init__(self):
+        self.buffer = ""
+        self.stack = []
+        self.mainKey = None
+
+    def feed(self, text):
+        buffer = self.buffer + text
+        length = len(buffer)
+        rows = []
+        pos = 0
+
+        while pos < length:
+            match = self.tokenRegex.search(buffer, pos)
+            if match is None:
+                pos = length
+                break
+
+            char = match.group()
+            start = match.start()
+            if char in "'\"":
+                stringMatch = self.stringRegex[char].match(buffer, start)
+                if stringMatch is None:
+                    pos = start
+                    break
+                if self.stack == ["{"]:
+                    self.mainKey = self.decodeString(stringMatch.group())
+                pos = stringMatch.end()
+            elif char == "{" and self.stack and self.stack[-1] == "[":
+                # a fragment up to the first closing brace that decodes is
+                # the whole row; otherwise scan the row token by token
+                end = buffer.find("}", start) + 1
+                if end == 0:
+                    pos = start
+                    break
+                row = self.decodeRow(buffer[start:end], False)
+                if row is None:
+                    end = self.rowEnd(buffer, start)
+                    if end < 0:
+                        pos = start
+                        break
+                    row = self.decodeRow(buffer[start:end])
+                    if row is None:
+                        raise ValueError("Cannot decode status row: " + buffer[start:end][:200])
+                rows.append((self.mainKey, row))
+                pos = end
+            elif char in "{[":
+                self.stack.append(char)
+                pos = start + 1
+            else:
+                if self.stack:
+                    self.stack.pop()
+                pos = start + 1
+
+        self.buffer = buffer[pos:]
+        return rows
+
+    def rowEnd(self, buffer, start):
+        depth = 0
+        for token in self.rowTokenRegex.finditer(buffer, start):
+            value = token.group()
+            if value == "{":
+                depth += 1
+            elif value == "}":
+                depth -= 1
+                if depth == 0:
+                    return token.end()
+            elif len(value) == 1:
+                # opening quote without its closing one yet
+                return -1
+        return -1
+
+    def close(self):
+        if self.stack:
+            raise ValueError("Incomplete status output")
+
+    @staticmethod
+    def decodeRow(fragment, allowRepr=True):
+        if '"' not in fragment:
+            # plain Python repr without quotes inside values: cheap path
+            try:
+                return json.loads(fragment.replace("'", '"'))
+            except ValueError:
+                pass
 
-        self.e1.grid(row=0, column=1)
-        self.e2.grid(row=2, column=0, columnspan=2)
+        try:
+            return json.loads(fragment)
+        except ValueError:
+            if not allowRepr:
+                return None
 
-        self.e1.insert("end", self.initialName)
-        self.e2.insert("end", self.initialCommand)
+        try:
+            row = ast.literal_eval(fragment)
+        except (ValueError, SyntaxError):
+            return None
+        if isinstance(row, dict):
+            return row
+        return None
+
+    @staticmethod
+    def decodeString(token):
+        if token[0] == '"':
+            try:
+                return json.loads(token)
+            except ValueError:
+                pass
+        return ast.literal_eval(token)
+
+
+class StatusNotModified(Exception):
+    pass
+
+
+class StatusBackend(object):
+    # Source of job rows. iterStatus yields (group, row) pairs where row has the
+    # jobID, RunningDir, Script file, Status, Time and Comment keys. It raises
+    # StatusNotModified, before yielding anything, when the rows are still
+    # those of knownVersion (see RemoteSession.statusVersion).
+    name = None
+
+    def iterStatus(self, session, task=None, knownVersion=None):
+        raise NotImplementedError
+
+    def forgetJob(self, session, jobID, task=None):
+        raise NotImplementedError
 
-        #        self.e2.tag_configure("import_tag", foreground = "blue")
-        #        self.e2.highlight_pattern("import", "import_tag")
-        # initial focus
-        return self.e1
 
-    def apply(self):
-        name = self.e1.get()
-        command = self.e2.get("1.0", "end")
+class CalculationFlowBackend(StatusBackend):
+    name = "calculationFlow"
 
-        self.results = (name, command)
+    def __init__(self, jobManagerDir):
+        if jobManagerDir and jobManagerDir[-1] != "/":
+            jobManagerDir += "/"
+        self.jobManagerDir = jobManagerDir
+
+    def command(self):
+        return " python " + self.jobManagerDir + "squeuePy.py -json"
+
+    def iterStatus(self, session, task=None, knownVersion=None):
+        span = taskSpan(task)
+        batches = session.statusRecords(self.command(), "json", task, knownVersion)
+        if batches is not None:
+            for batch in batches:
+                with span.measure("parse"):
+                    items = [tuple(json.loads(text)) for text in batch]
+                for item in items:
+                    yield item
+            return
+
+        parser = StatusStreamParser()
+        for chunk in session.commandChunks(self.command(), task):
+            with span.measure("parse"):
+                items = parser.feed(chunk)
+            for item in items:
+                yield item
+        parser.close()
+
+    def forgetJob(self, session, jobID, task=None):
+        session.runAndWait(" python " + self.jobManagerDir + "sremove.py " + str(jobID), task)
+
+
+class SlurmBackend(StatusBackend):
+    # Reads squeue for active jobs and sacct for recently finished ones in a
+    # single remote command and parses the pipe-delimited text locally.
+    # Free-text fields go last so a stray "|" only lands in the comment.
+    name = "slurm"
+    separator = "@@slurm_watcher_sacct@@"
+    activeGroup = "Active"
+    finishedGroup = "Finished"
+
+    def __init__(self, historyDays=7, forgotten=None):
+        self.historyDays = historyDays
+        self.forgotten = set(forgotten or [])
+
+    def command(self):
+        return ("squeue --noheader -u \"$USER\" --format='%i|%T|%M|%Z|%o|%k' ; echo " + self.separator +
+                " ; sacct --noheader --parsable2 -X -u \"$USER\" -S now-" + str(self.historyDays) +
+                "days --format=JobID,State,Elapsed,WorkDir,JobName,Comment")
+
+    def iterStatus(self, session, task=None, knownVersion=None):
+        active = set()
+        group = self.activeGroup
+        span = taskSpan(task)
+
+        batches = session.statusRecords(self.command(), "lines", task, knownVersion)
+        if batches is None:
+            batches = self.outputLines(session, task)
+
+        for lines in batches:
+            with span.measure("parse"):
+                items = []
+                for line in lines:
+                    if line.strip() == self.separator:
+                        group = self.finishedGroup
+                        continue
+                    row = self.parseLine(line, group, active)
+                    if row is not None:
+                        items.append((group, row))
+            for item in items:
+                yield item
+
+    def outputLines(self, session, task=None):
+        # the command output as lists of complete lines
+        tail = ""
+        for chunk in session.commandChunks(self.command(), task):
+            lines = (tail + chunk).split("\n")
+            tail = lines.pop()
+            yield lines
+        yield [tail]
+
+    def parseLine(self, line, group, active):
+        fields = line.rstrip("\r").split("|", 5)
+        if len(fields) < 6:
+            return None
+
+        fields = [self.cleanField(field) for field in fields]
+        jobID = fields[0]
+        if jobID in self.forgotten:
+            return None
+
+        if group == self.activeGroup:
+            active.add(jobID)
+        elif jobID in active:
+            return None
+
+        status = fields[1].split(" ")[0]
+        return {"jobID": jobID, "RunningDir": fields[3], "Script file": posixpath.basename(fields[4]),
+                "Status": status, "Time": fields[2], "Comment": fields[5]}
+
+    @staticmethod
+    def cleanField(field):
+        field = field.strip()
+        if field == "(null)":
+            return ""
+        return field
+
+    def forgetJob(self, session, jobID, task=None):
+        self.forgotten.add(str(jobID))
+
+
+STATUS_BACKENDS = (CalculationFlowBackend.name, SlurmBackend.name)
+
+
+def createStatusBackend(name, jobManagerDir, forgotten=None):
+    if name == SlurmBackend.name:
+        return SlurmBackend(forgotten=forgotten)
+    return CalculationFlowBackend(jobManagerDir)
+
+
+class SftpPool(object):
+    # SFTP sessions of one connection, opened on first use and kept for later
+    # transfers and listings. At most maxSessions exist at a time; a session
+    # whose channel died is dropped and replaced, reconnecting the SSH client
+    # first when the whole transport is gone. Bulk transfers hold at most
+    # bulkLimit() sessions, so listings and stats never wait for a download.
+    def __init__(self, session, maxSessions=4):
+        self.session = session
+        self.maxSessions = maxSessions
+        self.idle = []
+        self.created = 0
+        self.bulk = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def sftp(self, task=None, bulk=False):
+        sftp = self.acquire(task, bulk)
+        held = [True]
+        if task is not None:
+            task.addCancelHook(lambda: held[0] and sftp.close())
+        try:
+            yield sftp
+        finally:
+            held[0] = False
+            self.release(sftp, bulk)
+
+    def bulkLimit(self):
+        # one session stays free for everything that is not a transfer
+        return max(1, self.maxSessions - 1)
+
+    def acquire(self, task=None, bulk=False):
+        sftp = None
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise IOError("Connection is closed")
+                if task is not None:
+                    task.checkCancelled()
+                if bulk and self.bulk >= self.bulkLimit():
+                    self.condition.wait(0.5)
+                    continue
+                if self.idle:
+                    sftp = self.idle.pop()
+                    break
+                if self.created < self.maxSessions:
+                    self.created += 1
+                    break
+                self.condition.wait(0.5)
+            if bulk:
+                self.bulk += 1
+
+        if sftp is not None and not self.healthy(sftp):
+            self.discard(sftp)
+            with self.condition:
+                self.created += 1
+            sftp = None
+
+        if sftp is None:
+            try:
+                sftp = self.open()
+            except Exception:
+                with self.condition:
+                    self.created -= 1
+                    if bulk:
+                        self.bulk -= 1
+                    self.condition.notify_all()
+                raise
+        return sftp
+
+    def open(self):
+        transport = self.session.client.get_transport()
+        if transport is None or not transport.is_active():
+            self.session.reconnect()
+        return openSftp(self.session.client, self.session.traffic)
+
+    def release(self, sftp, bulk=False):
+        if bulk:
+            with self.condition:
+                self.bulk -= 1
+                self.condition.notify_all()
+
+        if self.closed or not self.healthy(sftp):
+            self.discard(sftp)
+            return
+
+        with self.condition:
+            self.idle.append(sftp)
+            # a bulk waiter woken alone may not be allowed to take it
+            self.condition.notify_all()
+
+    def discard(self, sftp):
+        try:
+            sftp.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.created -= 1
+            self.condition.notify_all()
+
+    @staticmethod
+    def healthy(sftp):
+        channel = sftp.get_channel()
+        if channel is None or channel.closed:
+            return False
+        transport = channel.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle = self.idle
+            self.idle = []
+            self.condition.notify_all()
+        for sftp in idle:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+
+class ParallelDownload(object):
+    # Downloads one remote file in fixed-size ranges fetched by several SFTP
+    # sessions at once into a preallocated .part file. Finished ranges are
+    # recorded in a sidecar manifest so an interrupted transfer resumes
+    # where it stopped. The result is checked against the remote size and,
+    # when sha256sum is available remotely, its checksum.
+    chunkSize = 8 * 1024 * 1024
+    streamsNo = 4
+    progressInterval = 0.5
+
+    def __init__(self, session, remotePath, localPath, onProgress=None, verifyChecksum=True):
+        self.session = session
+        self.remotePath = remotePath
+        self.localPath = localPath
+        self.partPath = localPath + ".part"
+        self.manifestPath = localPath + ".part.json"
+        self.onProgress = onProgress
+        self.verifyChecksum = verifyChecksum
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.error = None
+        self.transferred = 0
+        self.lastProgress = 0
+
+    def run(self, task=None):
+        span = taskSpan(task)
+        with self.session.sftp(task) as sftp:
+            attributes = sftp.stat(self.remotePath)
+        span.mark("channel open")
+        size = attributes.st_size
+        mtime = attributes.st_mtime
+
+        checksum = {}
+        checksumThread = None
+        if self.verifyChecksum and size > 0:
+            # hashing on the remote side overlaps with the transfer
+            checksumThread = threading.Thread(target=self.remoteChecksum, args=(checksum,))
+            checksumThread.daemon = True
+            checksumThread.start()
+
+        self.prepare(size, mtime)
+        chunks = queue.Queue()
+        for index in range(self.chunksNo(size)):
+            if index not in self.manifest["done"]:
+                chunks.put(index)
+
+        self.startTime = time.time()
+        self.total = size
+        self.completed = self.completedBytes(size)
+        traffic = self.session.traffic
+        wire = traffic.wire
+        streamsNo = min(self.streamsNo, self.session.sftpPool.bulkLimit(), chunks.qsize())
+        streams = [threading.Thread(target=self.fetchChunks, args=(chunks, size, task)) for i in range(streamsNo)]
+        for stream in streams:
+            stream.start()
+        for stream in streams:
+            stream.join()
+        span.addBytes(self.transferred)
+        span.mark("transfer")
+        traffic.measureTransfer(traffic.wire - wire, time.time() - self.startTime)
+
+        if task is not None:
+            task.checkCancelled()
+        if self.error is not None:
+            raise self.error
+
+        if os.path.getsize(self.partPath) != size:
+            self.discardPartial()
+            raise IOError("Downloaded size does not match " + self.remotePath)
+
+        if checksumThread is not None:
+            checksumThread.join()
+            if checksum.get("remote") and checksum["remote"] != self.localChecksum():
+                self.discardPartial()
+                raise IOError("Checksum mismatch for " + self.remotePath)
+            span.mark("verify")
+
+        if isfile(self.localPath):
+            os.remove(self.localPath)
+        os.rename(self.partPath, self.localPath)
+        os.remove(self.manifestPath)
+        self.reportProgress(True)
+        return self.localPath
+
+    def chunksNo(self, size):
+        return max(1, (size + self.chunkSize - 1) // self.chunkSize)
+
+    def completedBytes(self, size):
+        completed = 0
+        for index in self.manifest["done"]:
+            completed += min(self.chunkSize, size - index * self.chunkSize)
+        return completed
+
+    def prepare(self, size, mtime):
+        manifest = None
+        if isfile(self.manifestPath) and isfile(self.partPath):
+            try:
+                with open(self.manifestPath, "r") as fp:
+                    manifest = json.load(fp)
+            except ValueError:
+                manifest = None
+
+        if manifest is None or manifest.get("remotePath") != self.remotePath or manifest.get("size") != size or \
+                manifest.get("mtime") != mtime or manifest.get("chunkSize") != self.chunkSize:
+            with open(self.partPath, "wb") as partFile:
+                partFile.truncate(size)
+            manifest = {"remotePath": self.remotePath, "size": size, "mtime": mtime, "chunkSize": self.chunkSize,
+                        "done": []}
+
+        manifest["done"] = set(manifest["done"])
+        self.manifest = manifest
+        self.saveManifest()
+
+    def saveManifest(self):
+        manifest = dict(self.manifest)
+        manifest["done"] = sorted(manifest["done"])
+        with open(self.manifestPath, "w") as fp:
+            json.dump(manifest, fp)
+
+    def fetchChunks(self, chunks, size, task):
+        try:
+            with self.session.sftp(task, bulk=True) as sftp:
+                remoteFile = sftp.open(self.remotePath, "rb")
+                try:
+                    with open(self.partPath, "r+b") as partFile:
+                        while self.error is None and (task is None or not task.cancelled):
+                            try:
+                                index = chunks.get_nowait()
+                            except queue.Empty:
+                                break
+                            offset = index * self.chunkSize
+                            length = min(self.chunkSize, size - offset)
+                            partFile.seek(offset)
+                            if length > 0:
+                                # readv pipelines the 32 KiB SFTP reads of the range
+                                for data in remoteFile.readv([(offset, length)]):
+                                    partFile.write(data)
+                            partFile.flush()
+                            self.chunkDone(index, length)
+                finally:
+                    remoteFile.close()
+        except Exception as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+
+    def chunkDone(self, index, length):
+        with self.lock:
+            self.manifest["done"].add(index)
+            self.transferred += length
+            self.completed += length
+            self.saveManifest()
+        self.reportProgress(False)
+
+    def reportProgress(self, final):
+        if self.onProgress is None:
+            return
+        now = time.time()
+        if not final and now - self.lastProgress < self.progressInterval:
+            return
+        self.lastProgress = now
+
+        elapsed = max(now - self.startTime, 1e-6)
+        throughput = self.transferred / elapsed
+        eta = None
+        if throughput > 0:
+            eta = (self.total - self.completed) / throughput
+        self.onProgress(self.completed, self.total, throughput, eta)
+
+    def remoteChecksum(self, result):
+        try:
+            output = self.session.runCommand(".", "sha256sum " + shellQuote(self.remotePath) + " 2>/dev/null")
+        except Exception:
+            return
+        fields = output.split()
+        if fields and len(fields[0]) == 64:
+            result["remote"] = fields[0].lower()
+
+    def localChecksum(self):
+        digest = hashlib.sha256()
+        with open(self.partPath, "rb") as partFile:
+            while True:
+                data = partFile.read(1024 * 1024)
+                if not data:
+                    break
+                digest.update(data)
+        return digest.hexdigest()
+
+    def discardPartial(self):
+        for path in (self.partPath, self.manifestPath):
+            if isfile(path):
+                os.remove(path)
+
+
+def formatDuration(seconds):
+    seconds = int(seconds)
+    text = "%d:%02d:%02d" % (seconds // 3600 % 24, seconds // 60 % 60, seconds % 60)
+    if seconds >= 86400:
+        text = str(seconds // 86400) + "-" + text
+    return text
+
+
+def formatTransferProgress(completed, total, throughput, eta):
+    text = "%d%% %.1f MB/s" % (100 * completed // max(total, 1), throughput / 1e6)
+    if eta is not None:
+        text += " ETA %d s" % eta
+    return text
+
+
+class RemoteListing(object):
+    # Directory listings read with SFTP listdir_attr (names, sizes and mtimes
+    # in one exchange, no shell) and cached per path for ttl seconds.
+    ttl = 60
+    maxPaths = 256
+
+    def __init__(self, session):
+        self.session = session
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cached(self, path):
+        with self.lock:
+            entry = self.cache.get(path)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self.cache[path]
+                return None
+            return entry[1]
+
+    def list(self, path, task=None, refresh=False):
+        if not refresh:
+            entries = self.cached(path)
+            if entries is not None:
+                return entries
+
+        entries = self.fetch(path, task)
+        with self.lock:
+            self.cache.pop(path, None)
+            self.cache[path] = (time.time(), entries)
+            while len(self.cache) > self.maxPaths:
+                self.cache.popitem(False)
+        return entries
+
+    def fetch(self, path, task=None):
+        # entries are (name, isDir, size, mtime), hidden files skipped like ls
+        span = taskSpan(task)
+        entries = []
+        with self.session.sftp(task) as sftp:
+            span.mark("channel open")
+            attributesList = sftp.listdir_attr(path)
+            span.mark("remote exec")
+            for attributes in attributesList:
+                name = attributes.filename
+                if name.startswith("."):
+                    continue
+                isDir = attributes.st_mode is not None and stat.S_ISDIR(attributes.st_mode)
+                entries.append((name, isDir, attributes.st_size, attributes.st_mtime))
+        entries.sort()
+        span.mark("parse")
+        return entries
+
+    def snapshot(self, limit=32):
+        # the most recently listed paths as {path: entries}
+        with self.lock:
+            return dict((path, entry[1]) for path, entry in list(self.cache.items())[-limit:])
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(path, None)
+
+    @staticmethod
+    def names(entries):
+        return [name + "/" if isDir else name for name, isDir, size, mtime in entries]
+
+
+class LogFollower(object):
+    # Tails a remote file over SFTP. Only bytes past the stored offset are
+    # read on each poll; a file that got shorter, or whose first bytes
+    # changed, was truncated or rotated and is read again from the start.
+    # SFTP stat has no inode, so the first bytes are compared whenever the
+    # file is opened: on growth and on an mtime change. The poll interval
+    # grows while the file stays idle and drops back as soon as it grows.
+    initialTail = 64 * 1024
+    maxRead = 4 * 1024 * 1024
+    headSize = 256
+    minimumInterval = 1.0
+    maximumInterval = 30.0
+    backoffFactor = 1.5
+
+    def __init__(self, session, remotePath):
+        self.session = session
+        self.remotePath = remotePath
+        self.offset = None
+        self.mtime = None
+        self.head = None
+        self.interval = self.minimumInterval
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def restart(self):
+        self.offset = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def poll(self, task=None):
+        # returns (text, truncated)
+        truncated = False
+        data = b""
+        with self.session.sftp(task) as sftp:
+            attributes = sftp.stat(self.remotePath)
+            size = attributes.st_size
+            if self.offset is None:
+                self.offset = max(0, size - self.initialTail)
+            elif size < self.offset:
+                truncated = True
+                self.restart()
+
+            if size > self.offset or attributes.st_mtime != self.mtime:
+                remoteFile = sftp.open(self.remotePath, "rb")
+                try:
+                    head = remoteFile.read(min(size, self.headSize))
+                    common = min(len(head), len(self.head or b""))
+                    if self.head is not None and head[:common] != self.head[:common] and not truncated:
+                        truncated = True
+                        self.restart()
+                    self.head = head
+
+                    if size > self.offset:
+                        remoteFile.seek(self.offset)
+                        data = remoteFile.read(min(size - self.offset, self.maxRead))
+                finally:
+                    remoteFile.close()
+                self.offset += len(data)
+            self.mtime = attributes.st_mtime
+
+        if data and self.offset < size:
+            self.interval = 0
+        elif data or truncated:
+            self.interval = self.minimumInterval
+        else:
+            self.interval = min(self.maximumInterval, max(self.minimumInterval, self.interval * self.backoffFactor))
+        return self.decoder.decode(data), truncated
+
+
+COMPRESSION_MODES = ("auto", "off", "ssh", "gzip", "both")
+
+
+class TrafficCounter(object):
+    # Bytes of one connection: received on the socket (wire) against those
+    # handed to the plugin after decoding, plus the measured round trip time
+    # and an average of the observed download bandwidth in bytes per second.
+    bandwidthMinimum = 256 * 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wire = 0
+        self.sent = 0
+        self.decoded = 0
+        self.rtt = None
+        self.bandwidth = None
+
+    def addWire(self, received, sent):
+        with self.lock:
+            self.wire += received
+            self.sent += sent
+
+    def addDecoded(self, size):
+        with self.lock:
+            self.decoded += size
+
+    def measureTransfer(self, wireBytes, seconds):
+        # short transfers mostly measure the latency
+        if wireBytes < self.bandwidthMinimum or seconds <= 0:
+            return
+        bandwidth = wireBytes / seconds
+        with self.lock:
+            if self.bandwidth is None:
+                self.bandwidth = bandwidth
+            else:
+                self.bandwidth = 0.7 * self.bandwidth + 0.3 * bandwidth
+
+    def describe(self):
+        text = "wire %.1f kB, decoded %.1f kB" % (self.wire / 1024.0, self.decoded / 1024.0)
+        if self.wire and self.decoded:
+            text += " (x%.1f)" % (float(self.decoded) / self.wire)
+        if self.rtt is not None:
+            text += ", rtt %.1f ms" % (self.rtt * 1000)
+        if self.bandwidth is not None:
+            text += ", %.1f MB/s" % (self.bandwidth / 1048576.0)
+        return text
+
+
+class CountingSocket(object):
+    # socket handed to paramiko that counts the raw bytes it moves
+    def __init__(self, sock, traffic):
+        self.sock = sock
+        self.traffic = traffic
+
+    def recv(self, size, *args):
+        data = self.sock.recv(size, *args)
+        self.traffic.addWire(len(data), 0)
+        return data
+
+    def send(self, data, *args):
+        sent = self.sock.send(data, *args)
+        self.traffic.addWire(0, sent)
+        return sent
+
+    def sendall(self, data, *args):
+        self.sock.sendall(data, *args)
+        self.traffic.addWire(0, len(data))
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def openSftp(client, traffic):
+    # SFTP session whose received packets count as decoded bytes, so
+    # listings and stats are on both sides of the wire/decoded ratio, not
+    # only file contents
+    sftp = client.open_sftp()
+    readPacket = sftp._read_packet
+
+    def countingReadPacket():
+        kind, data = readPacket()
+        # 4 bytes of length and 1 of type besides the data
+        traffic.addDecoded(len(data) + 5)
+        return kind, data
+
+    sftp._read_packet = countingReadPacket
+    return sftp
+
+
+class AgentError(Exception):
+    pass
+
+
+class RemoteAgent(object):
+    # Client side of the long-lived helper started on the login node. Requests
+    # and responses are single JSON lines matched by id, so several requests
+    # can be in flight on the one channel.
+    remotePath = ".slurm_watcher/agent.py"
+    startTimeout = 15
+
+    def __init__(self, client, traffic=None):
+        self.client = client
+        self.traffic = traffic or TrafficCounter()
+        self.channel = None
+        self.alive = False
+        self.nextId = 0
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+        self.pending = {}
+
+    def start(self):
+        # the helper is uploaded over its own SFTP channel, not the session's
+        # pool: start runs inside a reconnect that may hold the last pool slot
+        sftp = openSftp(self.client, self.traffic)
+        try:
+            try:
+                sftp.mkdir(".slurm_watcher")
+            except IOError:
+                pass
+            remoteFile = sftp.open(self.remotePath, "w")
+            try:
+                remoteFile.write(AGENT_SCRIPT)
+            finally:
+                remoteFile.close()
+        finally:
+            sftp.close()
+
+        self.channel = self.client.get_transport().open_session()
+        self.channel.exec_command("if command -v python3 >/dev/null 2>&1; then exec python3 -u " + self.remotePath +
+                                  "; else exec python -u " + self.remotePath + "; fi")
+        self.alive = True
+
+        reader = threading.Thread(target=self._read, name="slurm_watcher-agent-reader")
+        reader.daemon = True
+        reader.start()
+
+        self.request("ping", timeout=self.startTimeout)
+
+    def request(self, op, task=None, timeout=None, **params):
+        response = None
+        for response in self.stream(op, task, timeout, **params):
+            pass
+        return response
+
+    def stream(self, op, task=None, timeout=None, **params):
+        # yields every message answering the request: partial ones first,
+        # then the final response
+        if not self.alive:
+            raise AgentError("remote helper is not running")
+
+        with self.lock:
+            self.nextId += 1
+            requestId = self.nextId
+            messages = queue.Queue()
+            self.pending[requestId] = messages
+
+        params["id"] = requestId
+        params["op"] = op
+        try:
+            with self.writeLock:
+                self.channel.sendall((json.dumps(params) + "\n").encode("utf-8"))
+
+            if task is not None:
+                task.addCancelHook(lambda: self._abort(requestId))
+
+            while True:
+                try:
+                    response = messages.get(True, timeout)
+                except queue.Empty:
+                    raise AgentError("remote helper did not answer in time")
+                if task is not None:
+                    task.checkCancelled()
+
+                if response is None:
+                    raise AgentError("remote helper stopped")
+                if not response.get("ok", True):
+                    raise AgentError(response.get("error", "remote helper error"))
+
+                yield response
+                if not response.get("partial"):
+                    return
+        finally:
+            with self.lock:
+                self.pending.pop(requestId, None)
+
+    def _abort(self, requestId):
+        with self.lock:
+            messages = self.pending.pop(requestId, None)
+        if messages is None:
+            return
+        messages.put(None)
+        try:
+            with self.writeLock:
+                self.channel.sendall((json.dumps({"id": 0, "op": "abort", "target": requestId}) + "\n").encode("utf-8"))
+        except Exception:
+            pass
+
+    def _read(self):
+        stream = self.channel.makefile("r")
+        try:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    response, size = self.decode(line)
+                except (ValueError, zlib.error):
+                    continue
+                self.traffic.addDecoded(size)
+                with self.lock:
+                    messages = self.pending.get(response.get("id"))
+                if messages is not None:
+                    messages.put(response)
+        except Exception:
+            pass
+        finally:
+            self.alive = False
+            with self.lock:
+                pending = list(self.pending.values())
+            for messages in pending:
+                messages.put(None)
+
+    @staticmethod
+    def decode(line):
+        # the message and its size with packed fields expanded
+        response = json.loads(line)
+        size = len(line)
+        if "gz" in response:
+            packed = response.pop("gz")
+            text = zlib.decompress(base64.b64decode(packed)).decode("utf-8")
+            response.update(json.loads(text))
+            size += len(text) - len(packed)
+        return response, size
+
+    def close(self):
+        self.alive = False
+        if self.channel is not None:
+            self.channel.close()
+
+
+class RemoteSession(object):
+    # All remote operations of one connection. Uses the helper when it runs
+    # and falls back to one exec_command per operation otherwise.
+    #
+    # account["compression"] is one of COMPRESSION_MODES: "ssh" turns on zlib
+    # for the whole SSH transport, "gzip" has the helper pack large status
+    # and command outputs, "both" does both. "auto" packs helper outputs
+    # once the link looks slow: a round trip of slowRtt or more, or a
+    # measured bandwidth under fastBandwidth.
+    connectTimeout = 30
+    readSize = 1024 * 1024
+    slowRtt = 0.01
+    fastBandwidth = 25 * 1024 * 1024
+
+    def __init__(self, client, account, backend, useAgent=True):
+        self.client = client
+        self.account = account
+        self.key = ConnectionManager.accountKey(account)
+        self.backend = backend
+        self.useAgent = useAgent
+        self.compression = account.get("compression", "auto")
+        self.traffic = TrafficCounter()
+        self.agent = None
+        self.password = None
+        self.connectLock = threading.Lock()
+        self.sftpPool = SftpPool(self)
+        self.listing = RemoteListing(self)
+        # command: (version, keys, {key: text}) of the last status through the
+        # helper; statusVersion is that of the rows last yielded, if known
+        self.statusCache = {}
+        self.statusVersion = None
+
+    def connect(self, password, task=None):
+        span = taskSpan(task)
+        self.password = password
+        started = time.time()
+        sock = socket.create_connection((self.account["host"], self.account["port"]), self.connectTimeout)
+        self.traffic.rtt = time.time() - started
+        self.client.connect(self.account["host"], port=self.account["port"], username=self.account["login"],
+                            password=password, sock=CountingSocket(sock, self.traffic),
+                            compress=self.compression in ("ssh", "both"))
+        span.mark("ssh")
+        self.start()
+        span.mark("helper")
+
+    def reconnect(self):
+        with self.connectLock:
+            transport = self.client.get_transport()
+            if transport is not None and transport.is_active():
+                return
+            if self.agent is not None:
+                self.agent.close()
+                self.agent = None
+            self.client.close()
+            self.connect(self.password)
+
+    def start(self):
+        if not self.useAgent:
+            return
+        agent = RemoteAgent(self.client, self.traffic)
+        try:
+            agent.start()
+        except Exception:
+            agent.close()
+            return
+        self.agent = agent
+
+        # the helper ping is a round trip without the DNS lookup and TCP setup
+        started = time.time()
+        try:
+            agent.request("ping", timeout=agent.startTimeout)
+        except AgentError:
+            return
+        self.traffic.rtt = min(self.traffic.rtt or float("inf"), time.time() - started)
+
+    def compressPayloads(self):
+        if self.compression in ("gzip", "both"):
+            return True
+        if self.compression != "auto":
+            return False
+        if self.traffic.bandwidth is not None:
+            return self.traffic.bandwidth < self.fastBandwidth
+        return self.traffic.rtt is not None and self.traffic.rtt >= self.slowRtt
+
+    def agentRunning(self):
+        return self.agent is not None and self.agent.alive
+
+    def agentRequest(self, op, task, **params):
+        if not self.agentRunning():
+            return None
+        try:
+            return self.agent.request(op, task, **params)
+        except AgentError:
+            if self.agent.alive:
+                raise
+            return None
+
+    def execute(self, command, task=None):
+        stdin, stdout, stderr = self.client.exec_command(command)
+        if task is not None:
+            task.addCancelHook(stdout.channel.close)
+        return list(stdout.readlines())
+
+    def executeAndWait(self, command, task=None):
+        stdin, stdout, stderr = self.client.exec_command(command)
+        if task is not None:
+            task.addCancelHook(stdout.channel.close)
+        return stdout.channel.recv_exit_status()
+
+    def status(self, task=None):
+        status = OrderedDict()
+        for mainKey, row in self.iterStatus(task):
+            status.setdefault(mainKey, []).append(row)
+        return status
+
+    def iterStatus(self, task=None, knownVersion=None):
+        return self.backend.iterStatus(self, task, knownVersion)
+
+    def iterJobs(self, task=None, knownVersion=None):
+        # status rows tagged with the account they come from
+        for mainKey, row in self.iterStatus(task, knownVersion):
+            row["Cluster"] = self.key
+            yield (self.key, mainKey), row
+
+    def statusRecords(self, command, format, task=None, knownVersion=None):
+        # batches of status records (see statusRecords in AGENT_SCRIPT) in
+        # order, or None without the helper. The helper is told the version
+        # held here and sends only the records that changed since.
+        self.statusVersion = None
+        if not self.agentRunning():
+            return None
+        return self.iterStatusRecords(command, format, task, knownVersion)
+
+    def iterStatusRecords(self, command, format, task, knownVersion):
+        span = taskSpan(task)
+        cached = self.statusCache.get(command)
+        upserts = []
+        first = True
+        for response in self.agent.stream("status", task, command=command, format=format,
+                                          since=cached[0] if cached is not None else None,
+                                          compress=self.compressPayloads()):
+            if first:
+                span.mark("remote exec")
+                first = False
+                started = time.time()
+                wire = self.traffic.wire
+            if response.get("partial"):
+                span.addBytes(sum(len(text) for key, text in response["upserts"]))
+                upserts += response["upserts"]
+                if response["full"]:
+                    # nothing to merge with, rows are shown as they arrive
+                    yield [text for key, text in response["upserts"]]
+        span.mark("receive")
+        span.addBytes(sum(len(key) for key in (response.get("removed") or []) + (response.get("order") or [])))
+        self.traffic.measureTransfer(self.traffic.wire - wire, time.time() - started)
+
+        self.statusVersion = response["version"]
+        if response.get("notModified"):
+            if knownVersion == self.statusVersion:
+                raise StatusNotModified()
+            yield [cached[2][key] for key in cached[1]]
+            return
+
+        if response["full"]:
+            keys = [key for key, text in upserts]
+            texts = dict(upserts)
+        else:
+            texts = dict(cached[2])
+            for key in response["removed"]:
+                del texts[key]
+            added = [key for key, text in upserts if key not in texts]
+            texts.update(upserts)
+            keys = response["order"] or [key for key in cached[1] if key in texts] + added
+        self.statusCache[command] = (response["version"], keys, texts)
+
+        if not response["full"]:
+            if knownVersion == self.statusVersion:
+                raise StatusNotModified()
+            yield [texts[key] for key in keys]
+
+    def commandChunks(self, command, task=None):
+        # stdout of a remote shell command, decoded, as it arrives
+        for kind, text in self.commandStream(None, command, task):
+            if kind == "stdout":
+                yield text
+
+    def commandStream(self, directory, command, task=None):
+        # yields ("stdout", text) and ("stderr", text) as output arrives and
+        # ("exit", status) at the end
+        span = taskSpan(task)
+        if self.agentRunning():
+            received = False
+            try:
+                for response in self.agent.stream("exec", task, command=command, dir=directory,
+                                                  compress=self.compressPayloads()):
+                    if not received:
+                        span.mark("remote exec")
+                    received = True
+                    if not response.get("partial"):
+                        span.mark("receive")
+                        yield "exit", response.get("code")
+                    elif "data" in response:
+                        span.addBytes(len(response["data"]))
+                        yield "stdout", response["data"]
+                    else:
+                        yield "stderr", response["stderr"]
+                return
+            except AgentError:
+                if received or self.agent.alive:
+                    raise
+
+        if directory is not None:
+            command = "cd " + directory + " ; " + command
+        for item in self.executeStream(command, task):
+            yield item
+
+    def executeStream(self, command, task=None):
+        span = taskSpan(task)
+        stdin, stdout, stderr = self.client.exec_command(command)
+        channel = stdout.channel
+        if task is not None:
+            task.addCancelHook(channel.close)
+        span.mark("channel open")
+
+        decoders = {"stdout": codecs.getincrementaldecoder("utf-8")("replace"),
+                    "stderr": codecs.getincrementaldecoder("utf-8")("replace")}
+        firstData = True
+        while True:
+            received = False
+            if channel.recv_ready():
+                received = True
+                data = channel.recv(65536)
+                if firstData:
+                    span.mark("remote exec")
+                    firstData = False
+                span.addBytes(len(data))
+                self.traffic.addDecoded(len(data))
+                yield "stdout", decoders["stdout"].decode(data)
+            if channel.recv_stderr_ready():
+                received = True
+                data = channel.recv_stderr(65536)
+                self.traffic.addDecoded(len(data))
+                yield "stderr", decoders["stderr"].decode(data)
+            if received:
+                continue
+            if channel.closed or channel.exit_status_ready() and not channel.recv_ready() \
+                    and not channel.recv_stderr_ready():
+                break
+            time.sleep(0.01)
+
+        if task is not None:
+            task.checkCancelled()
+        span.mark("receive")
+        for kind in ("stdout", "stderr"):
+            yield kind, decoders[kind].decode(b"", True)
+        yield "exit", channel.recv_exit_status()
+
+    def listDir(self, path, task=None, refresh=False):
+        return RemoteListing.names(self.listing.list(path, task, refresh))
+
+    def runCommand(self, directory, command, task=None):
+        response = self.agentRequest("run", task, dir=directory, command=command)
+        if response is not None:
+            return response["output"]
+        return "".join(self.execute("cd " + directory + " ; " + command, task))
+
+    def cancelJob(self, jobID, task=None):
+        if self.agentRequest("cancel", task, jobID=str(jobID)) is None:
+            self.executeAndWait("scancel " + str(jobID), task)
+
+    def runAndWait(self, command, task=None):
+        response = self.agentRequest("run", task, dir=".", command=command)
+        if response is not None:
+            return response["code"]
+        return self.executeAndWait(command, task)
+
+    def forgetJob(self, jobID, task=None):
+        self.backend.forgetJob(self, jobID, task)
+
+    def sftp(self, task=None, bulk=False):
+        # bulk for file transfers, see SftpPool
+        return self.sftpPool.sftp(task, bulk)
+
+    def download(self, remotePath, localPath, task=None, onProgress=None):
+        return ParallelDownload(self, remotePath, localPath, onProgress).run(task)
+
+    def cacheKey(self, remotePath, cache, task=None):
+        # (key in cache, size) of the remote file as it is now
+        with self.sftp(task) as sftp:
+            attributes = sftp.stat(remotePath)
+        taskSpan(task).mark("stat")
+        return cache.key(self.key, remotePath, attributes.st_size, attributes.st_mtime), attributes.st_size
+
+    def cachedDownload(self, remotePath, cache, task=None, onProgress=None, key=None):
+        # local path of remotePath from cache (see DownloadCache), downloaded
+        # into it first when the remote size or mtime has no entry yet
+        span = taskSpan(task)
+        if key is None:
+            key = self.cacheKey(remotePath, cache, task)[0]
+
+        with cache.keyLock(key):
+            localPath = cache.lookup(key)
+            if localPath is not None:
+                span.mark("cache hit")
+                return localPath
+
+            localPath = self.download(remotePath, cache.entryPath(key, remotePath), task, onProgress)
+            cache.store(key, localPath)
+        return localPath
+
+    def readFile(self, remotePath, task=None, onProgress=None, decompress=False):
+        # contents of remotePath read over SFTP into memory, gunzipped as
+        # they arrive with decompress
+        span = taskSpan(task)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if decompress else None
+        parts = []
+        received = 0
+        wire = self.traffic.wire
+        startTime = lastProgress = time.time()
+        with self.sftp(task, bulk=True) as sftp:
+            remoteFile = sftp.open(remotePath, "rb")
+            try:
+                size = remoteFile.stat().st_size
+                remoteFile.prefetch(size)
+                span.mark("channel open")
+                while True:
+                    if task is not None:
+                        task.checkCancelled()
+                    data = remoteFile.read(self.readSize)
+                    if not data:
+                        break
+                    received += len(data)
+                    parts.append(decompressor.decompress(data) if decompressor is not None else data)
+
+                    now = time.time()
+                    if onProgress is not None and now - lastProgress >= ParallelDownload.progressInterval:
+                        lastProgress = now
+                        throughput = received / max(now - startTime, 1e-6)
+                        onProgress(received, size, throughput, (size - received) / throughput)
+            finally:
+                remoteFile.close()
+        if decompressor is not None:
+            parts.append(decompressor.flush())
+        span.addBytes(received)
+        span.mark("transfer")
+        self.traffic.measureTransfer(self.traffic.wire - wire, time.time() - startTime)
+        return b"".join(parts)
+
+    def close(self):
+        self.sftpPool.close()
+        if self.agent is not None:
+            self.agent.close()
+        self.client.close()
+
+
+class ConnectionManager(object):
+    # Open sessions keyed by account, in the order they were connected. Only
+    # touched from the Tk thread.
+    def __init__(self):
+        self.sessions = OrderedDict()
+
+    @staticmethod
+    def accountKey(account):
+        return account["login"] + "@" + account["host"] + ":" + str(account["port"])
+
+    def add(self, session):
+        self.sessions[session.key] = session
+
+    def get(self, key):
+        return self.sessions.get(key)
+
+    def remove(self, key):
+        return self.sessions.pop(key, None)
+
+    def keys(self):
+        return list(self.sessions.keys())
+
+    def values(self):
+        return list(self.sessions.values())
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, key):
+        return key in self.sessions
+
+
+def defaultConfigDir():
+    if platform.system() != "Linux":
+        return join(getenv("LOCALAPPDATA"), "slurm_watcher")
+    return expanduser("~/.slurm_watcher")
+
+
+def loadParamiko():
+    # importing paramiko (and its crypto backend) is a large part of the
+    # plugin start, so it waits until a connection is opened
+    global paramiko
+    if paramiko is None:
+        import paramiko as module
+        paramiko = module
+    return paramiko
+
+
+def newClient():
+    loadParamiko()
+    client = paramiko.client.SSHClient()
+    client.load_system_host_keys()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    return client
+
+
+def createSession(account, useAgent=True, forgotten=None):
+    # an unconnected session for an account entry of config.json
+    backend = createStatusBackend(account.get("backend", CalculationFlowBackend.name),
+                                  account.get("jobManagerDir", ""), forgotten)
+    sessionAccount = {"login": account["login"], "port": int(account["port"]), "host": account["host"],
+                      "compression": account.get("compression", "auto")}
+    return RemoteSession(newClient(), sessionAccount, backend, useAgent)
+
+
+def runParallel(func, items):
+    # func(item) for every item in its own thread, returns (item, result, error) tuples
+    results = [None] * len(items)
+
+    def run(index, item):
+        try:
+            results[index] = (item, func(item), None)
+        except Exception as e:
+            results[index] = (item, None, e)
+
+    threads = [threading.Thread(target=run, args=(index, item)) for index, item in enumerate(items)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class JobHistory(object):
+    # Job history in SQLite: the last known values of every job and one row
+    # per observed state change. A poll writes only the jobs whose values
+    # changed; lastSeen of unchanged jobs is refreshed at most once per
+    # seenResolution. Jobs not seen for keepDays are dropped by compaction.
+    seenResolution = 3600
+    compactInterval = 86400
+    finalStates = ("COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "PREEMPTED",
+                   "BOOT_FAIL", "DEADLINE")
+
+    def __init__(self, path, keepDays=180):
+        self.path = path
+        self.keepDays = keepDays
+        self.lock = threading.Lock()
+        self.known = None
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (cluster TEXT, jobID TEXT, path TEXT, script TEXT, status TEXT,
+                    comment TEXT, time TEXT, firstSeen REAL, lastSeen REAL, PRIMARY KEY (cluster, jobID));
+                CREATE INDEX IF NOT EXISTS jobsPath ON jobs (path);
+                CREATE INDEX IF NOT EXISTS jobsJobID ON jobs (jobID);
+                CREATE INDEX IF NOT EXISTS jobsLastSeen ON jobs (lastSeen);
+                CREATE TABLE IF NOT EXISTS transitions (cluster TEXT, jobID TEXT, status TEXT, timestamp REAL);
+                CREATE INDEX IF NOT EXISTS transitionsJob ON transitions (cluster, jobID, timestamp);
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL);
+            """)
+
+    def loadKnown(self):
+        # (cluster, jobID) -> [(path, script, status, comment), lastSeen, firstSeen]
+        if self.known is None:
+            self.known = {}
+            for row in self.connection.execute("SELECT cluster, jobID, path, script, status, comment, lastSeen, "
+                                               "firstSeen FROM jobs"):
+                self.known[(row[0], row[1])] = [tuple(row[2:6]), row[6], row[7]]
+        return self.known
+
+    def record(self, rows, now=None):
+        # returns the number of jobs written
+        now = now or time.time()
+        with self.lock:
+            known = self.loadKnown()
+            changed = []
+            transitions = []
+            seen = []
+            for row in rows:
+                key = (row["Cluster"], str(row["jobID"]))
+                values = (row["RunningDir"], row["Script file"], row["Status"], row["Comment"])
+                entry = known.get(key)
+                if entry is None or entry[0] != values:
+                    if entry is None or entry[0][2] != row["Status"]:
+                        transitions.append(key + (row["Status"], now))
+                    firstSeen = now if entry is None else entry[2]
+                    known[key] = [values, now, firstSeen]
+                    changed.append(key + values + (row["Time"], firstSeen, now))
+                elif now - entry[1] > self.seenResolution:
+                    entry[1] = now
+                    seen.append((row["Time"], now) + key)
+
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", changed)
+                self.connection.executemany("INSERT INTO transitions VALUES (?, ?, ?, ?)", transitions)
+                self.connection.executemany("UPDATE jobs SET time = ?, lastSeen = ? WHERE cluster = ? AND jobID = ?",
+                                            seen)
+
+            lastCompaction = self.connection.execute("SELECT value FROM meta WHERE name = 'compacted'").fetchone()
+            if lastCompaction is None or now - lastCompaction[0] > self.compactInterval:
+                self.compact(now)
+        return len(changed)
+
+    def compact(self, now=None):
+        # called with the lock held
+        now = now or time.time()
+        limit = now - self.keepDays * 86400
+        with self.connection:
+            self.connection.execute("DELETE FROM transitions WHERE EXISTS (SELECT 1 FROM jobs WHERE "
+                                    "jobs.cluster = transitions.cluster AND jobs.jobID = transitions.jobID AND "
+                                    "jobs.lastSeen < ?)", (limit,))
+            removed = self.connection.execute("DELETE FROM jobs WHERE lastSeen < ?", (limit,)).rowcount
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('compacted', ?)", (now,))
+        if removed:
+            self.known = None
+            self.connection.execute("VACUUM")
+
+    def where(self, cluster=None, pathPrefix=None, since=None, status=None, jobID=None):
+        conditions = []
+        parameters = []
+        if jobID is not None:
+            conditions.append("jobs.jobID = ?")
+            parameters.append(str(jobID))
+        if cluster is not None:
+            conditions.append("jobs.cluster = ?")
+            parameters.append(cluster)
+        if pathPrefix:
+            # the directory itself and everything below it, not /a/run10 for
+            # /a/run1; a range instead of LIKE so the path index is used
+            directory = pathPrefix.rstrip("/")
+            conditions.append("(jobs.path = ? OR (jobs.path >= ? AND jobs.path < ?))")
+            parameters += [directory, directory + "/", directory + u"/\uffff"]
+        if since is not None:
+            conditions.append("jobs.lastSeen >= ?")
+            parameters.append(since)
+        if status is not None:
+            conditions.append("jobs.status = ?")
+            parameters.append(status)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+    def jobs(self, cluster=None, pathPrefix=None, since=None, status=None, limit=None, jobID=None):
+        where, parameters = self.where(cluster, pathPrefix, since, status, jobID)
+        query = "SELECT cluster, jobID, path, script, status, time, comment, firstSeen, lastSeen FROM jobs" + where + \
+                " ORDER BY lastSeen DESC"
+        if limit is not None:
+            query += " LIMIT " + str(int(limit))
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        return [{"Cluster": row[0], "jobID": row[1], "RunningDir": row[2], "Script file": row[3], "Status": row[4],
+                 "Time": row[5], "Comment": row[6], "firstSeen": row[7], "lastSeen": row[8]} for row in rows]
+
+    def transitions(self, cluster, jobID):
+        with self.lock:
+            return self.connection.execute("SELECT status, timestamp FROM transitions WHERE cluster = ? AND jobID = ? "
+                                           "ORDER BY timestamp", (cluster, str(jobID))).fetchall()
+
+    def stateDurations(self, cluster=None, pathPrefix=None, since=None, status=None, jobID=None):
+        # (cluster, jobID) -> {state: seconds}, as precise as the polling was;
+        # a job still in a non final state counts up to its lastSeen
+        where, parameters = self.where(cluster, pathPrefix, since, status, jobID)
+        query = "SELECT transitions.cluster, transitions.jobID, transitions.status, transitions.timestamp, " \
+                "jobs.lastSeen FROM transitions JOIN jobs ON jobs.cluster = transitions.cluster AND " \
+                "jobs.jobID = transitions.jobID" + where + \
+                " ORDER BY transitions.cluster, transitions.jobID, transitions.timestamp"
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+
+        durations = OrderedDict()
+        for index, (clusterKey, jobID, state, timestamp, lastSeen) in enumerate(rows):
+            following = rows[index + 1] if index + 1 < len(rows) else None
+            if following is not None and following[:2] == (clusterKey, jobID):
+                end = following[3]
+            elif state in self.finalStates:
+                continue
+            else:
+                end = lastSeen
+            states = durations.setdefault((clusterKey, jobID), {})
+            states[state] = states.get(state, 0) + max(0, end - timestamp)
+        return durations
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class StatusSnapshot(object):
+    # Last known status, directory listings and directory, shown on start
+    # before any connection. Rows are stored column-wise and written with
+    # marshal, so loading thousands of jobs is one C-level read.
+    version = 1
+    fields = ("Cluster", "jobID", "RunningDir", "Script file", "Status", "Time", "Comment")
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, status, listings, currentDir, cluster):
+        # status is a list of (mainKey, rows), listings {cluster: {path: entries}}
+        groups = []
+        groupIndex = []
+        rows = []
+        for mainKey, groupRows in status:
+            groupIndex += [len(groups)] * len(groupRows)
+            groups.append(mainKey)
+            rows += groupRows
+
+        data = {"version": self.version, "saved": time.time(), "groups": groups, "groupIndex": groupIndex,
+                "columns": [[row.get(field, "") for row in rows] for field in self.fields],
+                "listings": listings, "currentDir": currentDir, "cluster": cluster}
+
+        temporaryPath = self.path + ".tmp"
+        with open(temporaryPath, "wb") as fp:
+            fp.write(marshal.dumps(data))
+        if hasattr(os, "replace"):
+            os.replace(temporaryPath, self.path)
+        else:
+            if isfile(self.path):
+                os.remove(self.path)
+            os.rename(temporaryPath, self.path)
+
+    def load(self):
+        # None when there is no snapshot or it was written by another version
+        try:
+            # one read, marshal.load on a file object reads item by item
+            with open(self.path, "rb") as fp:
+                data = marshal.loads(fp.read())
+        except Exception:
+            return None
+        if not isinstance(data, dict) or data.get("version") != self.version:
+            return None
+
+        groups = data["groups"]
+        status = OrderedDict((mainKey, []) for mainKey in groups)
+        fields = self.fields
+        for group, values in zip(data["groupIndex"], zip(*data["columns"])):
+            status[groups[group]].append(dict(zip(fields, values)))
+        data["status"] = status
+        return data
+
+
+class DownloadCache(object):
+    # Local copies of remote files. An entry is keyed by the sha1 of the
+    # account, remote path, size and mtime, so a file changed remotely gets a
+    # new entry and never hits an old copy. Each entry is a directory named
+    # by its key holding the file under its remote name, for loaders that go
+    # by name. index.json keeps the size and last use of every entry; the
+    # least recently used ones are removed once the total passes maxBytes.
+    # Removed entries are moved aside under the lock and deleted after it is
+    # released, so the lock is never held for a slow delete.
+    def __init__(self, directory, maxBytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.indexPath = join(directory, "index.json")
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.keyLocks = {}
+        self.entries = None
+        # (entries, bytes) as of the last load or save, read without the lock
+        self.totals = None
+
+    @staticmethod
+    def key(accountKey, remotePath, size, mtime):
+        text = json.dumps([accountKey, remotePath, size, mtime])
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def entryPath(self, key, remotePath):
+        entryDir = join(self.directory, key)
+        if not isdir(entryDir):
+            os.makedirs(entryDir)
+        return join(entryDir, posixpath.basename(remotePath))
+
+    def keyLock(self, key):
+        # one download per entry at a time
+        with self.lock:
+            return self.keyLocks.setdefault(key, threading.Lock())
+
+    def load(self):
+        # key -> [path, size, lastUsed]; entries whose file is gone are dropped
+        if self.entries is not None:
+            return self.entries
+        if not isdir(self.directory):
+            os.makedirs(self.directory)
+        try:
+            with open(self.indexPath, "r") as fp:
+                entries = json.load(fp)
+        except (IOError, OSError, ValueError):
+            entries = {}
+        self.entries = dict((key, entry) for key, entry in entries.items() if isfile(entry[0]))
+        self.updateTotals()
+        return self.entries
+
+    def updateTotals(self):
+        self.totals = (len(self.entries), sum(entry[1] for entry in self.entries.values()))
+
+    def save(self):
+        self.updateTotals()
+        temporaryPath = self.indexPath + ".tmp"
+        with open(temporaryPath, "w") as fp:
+            json.dump(self.entries, fp)
+        if hasattr(os, "replace"):
+            os.replace(temporaryPath, self.indexPath)
+        else:
+            if isfile(self.indexPath):
+                os.remove(self.indexPath)
+            os.rename(temporaryPath, self.indexPath)
+
+    def lookup(self, key):
+        # path of the entry, or None
+        with self.lock:
+            entry = self.load().get(key)
+            if entry is None:
+                return None
+            if not isfile(entry[0]):
+                del self.entries[key]
+                self.save()
+                return None
+            entry[2] = time.time()
+            self.save()
+            return entry[0]
+
+    def store(self, key, path):
+        with self.lock:
+            self.load()[key] = [path, os.path.getsize(path), time.time()]
+            removed = self.evict()
+            self.save()
+        self.remove(removed)
+
+    def evict(self):
+        # the newest entry stays even when it alone is over the budget;
+        # unfinished downloads count too and are removed oldest first.
+        # Returns the moved aside directories for remove().
+        partials = self.partials()
+        total = sum(entry[1] for entry in self.entries.values()) + sum(entry[1] for entry in partials.values())
+        candidates = list(self.entries.items()) + list(partials.items())
+        removed = []
+        for key, entry in sorted(candidates, key=lambda item: item[1][2]):
+            if total <= self.maxBytes or (key in self.entries and len(self.entries) == 1):
+                break
+            removed.append(self.detach(entry[0]))
+            total -= entry[1]
+            self.entries.pop(key, None)
+        return removed
+
+    def partials(self):
+        # key -> [path, size, lastUsed] of entry directories without an index
+        # entry: downloads that failed or were cancelled, with the .part and
+        # .part.json kept for a resume. Downloads running now are left out.
+        partials = {}
+        for key in listdir(self.directory):
+            entryDir = join(self.directory, key)
+            if key in self.entries or key.startswith(".") or not isdir(entryDir):
+                continue
+            lock = self.keyLocks.get(key)
+            if lock is not None and lock.locked():
+                continue
+            size = 0
+            lastUsed = os.path.getmtime(entryDir)
+            for name in listdir(entryDir):
+                status = os.stat(join(entryDir, name))
+                size += status.st_size
+                lastUsed = max(lastUsed, status.st_mtime)
+            partials[key] = [entryDir, size, lastUsed]
+        return partials
+
+    def detach(self, path):
+        # moves the whole entry directory, leftovers of earlier downloads
+        # included, into a hidden directory that remove() deletes
+        entryDir = path if isdir(path) else os.path.dirname(path)
+        removedDir = tempfile.mkdtemp(prefix=".removed-", dir=self.directory)
+        try:
+            os.rename(entryDir, join(removedDir, "entry"))
+        except OSError:
+            pass
+        return removedDir
+
+    @staticmethod
+    def remove(removedDirs):
+        for removedDir in removedDirs:
+            shutil.rmtree(removedDir, ignore_errors=True)
+
+    def usage(self):
+        # (entries, bytes), without waiting for a store or clear in progress
+        totals = self.totals
+        if totals is None:
+            with self.lock:
+                self.load()
+                totals = self.totals
+        return totals
+
+    def clear(self):
+        with self.lock:
+            entries = list(self.load().values()) + list(self.partials().values())
+            # left behind by a delete that was interrupted
+            removed = [join(self.directory, name) for name in listdir(self.directory) if name.startswith(".removed-")]
+            removed += [self.detach(entry[0]) for entry in entries]
+            self.entries = {}
+            self.save()
+        self.remove(removed)
+
+
+class SlurmWatcher(object):
+    # GUI independent access to the accounts saved in config.json. Calls block,
+    # operations on several clusters run in parallel. Jobs are addressed as
+    # "cluster/jobID" (cluster being login@host:port or just the host) or by
+    # the bare job ID when only one account is connected.
+    def __init__(self, configDir=None, useAgent=None):
+        self.configDir = configDir or defaultConfigDir()
+        self.configFile = join(self.configDir, "config.json")
+        self.state = self.loadState()
+        if useAgent is None:
+            useAgent = self.state.get("useRemoteHelper", 1) == 1
+        self.useAgent = useAgent
+        self.connections = ConnectionManager()
+        self.jobHistory = None
+
+    def history(self):
+        if self.jobHistory is None:
+            if not isdir(self.configDir):
+                mkdir(self.configDir)
+            self.jobHistory = JobHistory(join(self.configDir, "history.sqlite"))
+        return self.jobHistory
+
+    def loadState(self):
+        if not isfile(self.configFile):
+            return {}
+        with open(self.configFile, 'r') as fp:
+            return json.load(fp)
+
+    def accounts(self):
+        return self.state.get("accounts", [])
+
+    @staticmethod
+    def accountNames(account):
+        return (ConnectionManager.accountKey(account), account["login"] + "@" + account["host"], account["host"])
+
+    def findAccounts(self, names=None):
+        if not names:
+            return list(self.accounts())
+
+        found = []
+        for name in names:
+            matches = [account for account in self.accounts() if name in self.accountNames(account)]
+            if not matches:
+                raise ValueError("No account " + name + " in " + self.configFile)
+            found += [account for account in matches if account not in found]
+        return found
+
+    def openSession(self, account, password=None):
+        forgotten = self.state.get("forgottenJobs", {}).get(ConnectionManager.accountKey(account))
+        session = createSession(account, self.useAgent, forgotten)
+        try:
+            session.connect(password if password is not None else account.get("password") or None)
+        except Exception:
+            session.close()
+            raise
+        return session
+
+    def connect(self, accounts, passwordPrompt=None):
+        # returns {accountKey: error} of the accounts that could not be connected;
+        # passwordPrompt(accountKey) is asked, one account at a time, when the
+        # saved password or the SSH keys are rejected
+        failed = OrderedDict()
+        retry = []
+        for account, session, error in runParallel(self.openSession, accounts):
+            if error is None:
+                self.connections.add(session)
+            elif passwordPrompt is not None and isinstance(error, loadParamiko().AuthenticationException):
+                retry.append(account)
+            else:
+                failed[ConnectionManager.accountKey(account)] = error
+
+        for account in retry:
+            key = ConnectionManager.accountKey(account)
+            try:
+                self.connections.add(self.openSession(account, passwordPrompt(key)))
+            except Exception as e:
+                failed[key] = e
+        return failed
+
+    def status(self):
+        # returns (rows, {accountKey: error}), rows carry their "Cluster"
+        rows = []
+        failed = OrderedDict()
+        for session, jobs, error in runParallel(lambda session: [row for mainKey, row in session.iterJobs()],
+                                                self.connections.values()):
+            if error is None:
+                rows += jobs
+            else:
+                failed[session.key] = error
+        self.history().record(rows)
+        return rows, failed
+
+    def session(self, cluster=None):
+        if cluster is None:
+            if len(self.connections) != 1:
+                raise ValueError("Several accounts are connected, choose one with cluster/jobID or --account")
+            return self.connections.values()[0]
+
+        for session in self.connections.values():
+            if cluster in self.accountNames(session.account):
+                return session
+        raise ValueError("Not connected with " + cluster)
+
+    def splitJob(self, job):
+        cluster, separator, jobID = str(job).rpartition("/")
+        return self.session(cluster or None), jobID
+
+    def eachJob(self, jobs, action):
+        # clusters in parallel, the jobs of one cluster in order;
+        # returns {job: error} of the jobs that failed
+        groups = OrderedDict()
+        for job in jobs:
+            session, jobID = self.splitJob(job)
+            groups.setdefault(session.key, (session, []))[1].append((job, jobID))
+
+        def run(group):
+            session, clusterJobs = group
+            failed = []
+            for job, jobID in clusterJobs:
+                try:
+                    action(session, jobID)
+                except Exception as e:
+                    failed.append((job, e))
+            return failed
+
+        failed = OrderedDict()
+        for group, clusterFailed, error in runParallel(run, list(groups.values())):
+            if error is not None:
+                clusterFailed = [(job, error) for job, jobID in group[1]]
+            failed.update(clusterFailed)
+        return failed
+
+    def cancel(self, jobs):
+        return self.eachJob(jobs, lambda session, jobID: session.cancelJob(jobID))
+
+    def forget(self, jobs):
+        failed = self.eachJob(jobs, lambda session, jobID: session.forgetJob(jobID))
+        for session in self.connections.values():
+            if isinstance(session.backend, SlurmBackend):
+                self.saveForgotten(session)
+        return failed
+
+    def saveForgotten(self, session):
+        # re-read the file, the GUI may have changed it meanwhile
+        state = self.loadState()
+        state.setdefault("forgottenJobs", {})[session.key] = sorted(session.backend.forgotten)
+        if not isdir(self.configDir):
+            mkdir(self.configDir)
+        with open(self.configFile, 'w') as fp:
+            json.dump(state, fp)
+        self.state = state
+
+    def listDir(self, path, cluster=None):
+        return self.session(cluster).listDir(path)
+
+    def download(self, remotePath, localPath, cluster=None, onProgress=None):
+        return self.session(cluster).download(remotePath, localPath, None, onProgress)
+
+    def close(self):
+        for key in self.connections.keys():
+            self.connections.remove(key).close()
+        if self.jobHistory is not None:
+            self.jobHistory.close()
+
+
+class StatusPoller(object):
+    # Schedules automatic status refreshes with after(). The interval grows
+    # while polls bring no changes and shrinks while jobs change state, but
+    # never drops below minimumInterval so many open plugins cannot flood
+    # slurmctld. A small jitter keeps clients from polling in lockstep.
+    minimumInterval = 30
+    maximumInterval = 900
+    backoffFactor = 1.5
+    jitter = 0.1
+    transitionStates = ("CONFIGURING", "COMPLETING", "STAGE_OUT", "SIGNALING", "RESIZING", "REQUEUED")
+
+    def __init__(self, widget, requestPoll, onChange=None):
+        self.widget = widget
+        self.requestPoll = requestPoll
+        self.onChange = onChange
+        self.baseInterval = 60
+        self.interval = self.baseInterval
+        self.enabled = False
+        self.paused = True
+        self.inFlight = False
+        self.lastPollTime = None
+        self.lastLatency = None
+        self.afterId = None
+
+    def setBaseInterval(self, seconds):
+        self.baseInterval = min(self.maximumInterval, max(self.minimumInterval, seconds))
+        self.interval = self.baseInterval
+        self.reschedule()
+
+    def start(self):
+        self.enabled = True
+        self.interval = self.baseInterval
+        self.reschedule()
+
+    def stop(self):
+        self.enabled = False
+        self.reschedule()
+
+    def pause(self):
+        self.paused = True
+        self.reschedule()
+
+    def resume(self):
+        self.paused = False
+        self.inFlight = False
+        self.reschedule()
+
+    def reschedule(self):
+        if self.afterId is not None:
+            self.widget.after_cancel(self.afterId)
+            self.afterId = None
+
+        if self.enabled and not self.paused and not self.inFlight:
+            delay = self.interval
+            if self.lastPollTime is not None:
+                delay = max(0, self.interval - (time.time() - self.lastPollTime))
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            self.afterId = self.widget.after(int(delay * 1000), self._fire)
+
+        if self.onChange is not None:
+            self.onChange()
+
+    def _fire(self):
+        self.afterId = None
+        if self.requestPoll():
+            self.inFlight = True
+        self.reschedule()
+
+    def pollFinished(self, latency, changedNo, transitioning):
+        self.inFlight = False
+        self.lastPollTime = time.time()
+        self.lastLatency = latency
+
+        if changedNo or transitioning:
+            self.interval = max(self.minimumInterval, min(self.interval, self.baseInterval) / self.backoffFactor)
+        else:
+            self.interval = min(self.maximumInterval, self.interval * self.backoffFactor)
+        self.reschedule()
+
+    def pollCancelled(self):
+        # the poll will never report back, the next one is scheduled as usual
+        self.inFlight = False
+        self.reschedule()
+
+    def pollFailed(self):
+        self.inFlight = False
+        self.lastPollTime = time.time()
+        self.interval = min(self.maximumInterval, self.interval * self.backoffFactor)
+        self.reschedule()
+
+    def isTransitioning(self, status):
+        return status in self.transitionStates
+
+    def describe(self):
+        if self.enabled and not self.paused:
+            text = "Auto: every %d s" % self.interval
+        elif self.enabled:
+            text = "Auto: paused"
+        else:
+            text = "Auto refresh off"
+
+        if self.lastLatency is not None:
+            text += ", last %.2f s" % self.lastLatency
+        return text
+
+
+class CommandOutput(object):
+    # Text widget fed with command output in batches. Only the last maxLines
+    # lines are kept, older ones are dropped from the top.
+    def __init__(self, text, maxLines=5000):
+        self.text = text
+        self.maxLines = maxLines
+        self.text.tag_configure("stderr", foreground="red")
+
+    def clear(self):
+        self.text.delete("1.0", "end")
+
+    def append(self, chunks):
+        for kind, text in chunks:
+            if kind == "stderr":
+                self.text.insert("end", text, "stderr")
+            else:
+                self.text.insert("end", text)
+
+        linesNo = int(self.text.index("end-1c").split(".")[0])
+        if linesNo > self.maxLines:
+            self.text.delete("1.0", "%d.0" % (linesNo - self.maxLines + 1))
+        self.text.see("end")
+
+
+class FilterTerm(object):
+    def __init__(self, column, value, negate, regex):
+        self.column = column
+        self.value = value
+        self.negate = negate
+        self.regex = regex
+        self.pattern = None
+        if regex:
+            # without a field the text is every field joined by newlines, so
+            # ^ and $ match at the start and end of each field
+            flags = re.IGNORECASE if column is not None else re.IGNORECASE | re.MULTILINE
+            try:
+                self.pattern = re.compile(value, flags)
+            except re.error:
+                # unfinished pattern while typing, match it literally for now
+                self.pattern = re.compile(re.escape(value), flags)
+
+    def select(self, candidates, texts):
+        # candidates is None for all rows
+        if candidates is None:
+            candidates = range(len(texts))
+        value = self.value
+        if self.regex:
+            search = self.pattern.search
+            if self.negate:
+                return [index for index in candidates if search(texts[index]) is None]
+            return [index for index in candidates if search(texts[index]) is not None]
+        if self.negate:
+            return [index for index in candidates if value not in texts[index]]
+        return [index for index in candidates if value in texts[index]]
+
+    def implies(self, other):
+        # rows matching self are a subset of rows matching other
+        if self.column != other.column or self.negate != other.negate or self.regex or other.regex:
+            return self.column == other.column and self.negate == other.negate and self.regex == other.regex \
+                   and self.value == other.value
+        if self.negate:
+            return self.value in other.value
+        return other.value in self.value
+
+
+class JobFilter(object):
+    # Search index over the job table. Every row keeps its lowercased fields,
+    # computed once per status refresh, and a query that only narrows the
+    # previous one is evaluated on the previous matches. Queries are terms
+    # joined by AND: "status:running path:/scratch -comment:old id:~^12\d+$"
+    # with an optional field prefix, "-" for negation and "~" for a regex.
+    # Column lists are only built for the fields a query uses, and rows of a
+    # status still streaming in are added with upsert() without a rebuild.
+    fields = {"cluster": 0, "id": 1, "jobid": 1, "path": 2, "dir": 2, "script": 3, "status": 4, "time": 5,
+              "comment": 6}
+    termPattern = re.compile(r'(-?)(?:(\w+):)?(~?"[^"]*"?|\S*)')
+
+    def __init__(self):
+        self.keyedRows = []
+        self.texts = []
+        self.columns = {}
+        self.positions = None
+        self.cache = {}
+        self.lastTerms = None
+        self.lastMatches = None
+
+    @staticmethod
+    def rowTexts(values):
+        # lowercased fields followed by all of them joined by newlines
+        fields = tuple([str(value).lower() for value in values])
+        return fields + ("\n".join(fields),)
+
+    def setRows(self, keyedRows):
+        cache = self.cache
+        newCache = {}
+        texts = []
+        append = texts.append
+        for key, values in keyedRows:
+            cached = cache.get(key)
+            if cached is None or cached[0] != values:
+                cached = (values, self.rowTexts(values))
+            newCache[key] = cached
+            append(cached[1])
+
+        self.keyedRows = list(keyedRows)
+        self.texts = texts
+        self.columns = {}
+        self.positions = None
+        self.cache = newCache
+        self.lastTerms = None
+        self.lastMatches = None
+
+    def column(self, index):
+        # texts of one field, -1 for the joined ones; a column-wise list
+        # keeps each term a single list scan
+        column = self.columns.get(index)
+        if column is None:
+            column = self.columns[index] = [texts[index] for texts in self.texts]
+        return column
+
+    def upsert(self, keyedRows):
+        # updates rows in place and appends new ones, returns the rows whose
+        # values changed
+        if self.positions is None:
+            self.positions = dict(zip(map(operator.itemgetter(0), self.keyedRows), itertools.count()))
+        positions = self.positions
+        changed = []
+        for key, values in keyedRows:
+            cached = self.cache.get(key)
+            if cached is not None and cached[0] == values:
+                continue
+            texts = self.rowTexts(values)
+            self.cache[key] = (values, texts)
+            index = positions.get(key)
+            if index is None:
+                positions[key] = len(self.keyedRows)
+                self.keyedRows.append((key, values))
+                self.texts.append(texts)
+                for columnIndex, column in self.columns.items():
+                    column.append(texts[columnIndex])
+            else:
+                self.keyedRows[index] = (key, values)
+                self.texts[index] = texts
+                for columnIndex, column in self.columns.items():
+                    column[index] = texts[columnIndex]
+            changed.append((key, values))
+
+        if changed:
+            self.lastTerms = None
+            self.lastMatches = None
+        return changed
+
+    def matching(self, query, keyedRows):
+        # the rows of keyedRows, all in the index, that match query
+        terms = self.parse(query)
+        if not terms:
+            return keyedRows
+        candidates = [self.positions[key] for key, values in keyedRows]
+        for term in terms:
+            columnIndex = -1 if term.column is None else term.column
+            texts = dict((index, self.texts[index][columnIndex]) for index in candidates)
+            candidates = term.select(candidates, texts)
+        return [self.keyedRows[index] for index in candidates]
+
+    @classmethod
+    def parse(cls, query):
+        terms = []
+        for negate, field, value in cls.termPattern.findall(query.strip()):
+            column = cls.fields.get(field.lower())
+            if field and column is None:
+                # unknown prefix, e.g. a time like 1:20:00, is part of the value
+                value = field + ":" + value
+            regex = value[:1] == "~"
+            if regex:
+                value = value[1:].strip('"')
+            else:
+                value = value.strip('"').lower()
+            if value:
+                terms.append(FilterTerm(column, value, negate == "-", regex))
+        return terms
+
+    def narrows(self, terms):
+        if self.lastTerms is None:
+            return False
+        for old in self.lastTerms:
+            if not any(term.implies(old) for term in terms):
+                return False
+        return True
+
+    def filter(self, query):
+        terms = self.parse(query)
+        if not terms or not self.keyedRows:
+            matches = None
+        else:
+            matches = self.lastMatches if self.narrows(terms) else None
+            for term in terms:
+                matches = term.select(matches, self.column(-1 if term.column is None else term.column))
+
+        self.lastTerms = terms
+        self.lastMatches = matches
+        if matches is None:
+            return self.keyedRows
+        keyedRows = self.keyedRows
+        return [keyedRows[index] for index in matches]
+
+
+class JobSorter(object):
+    # Sort order of the job table. Sort keys are parsed once per row and
+    # column and reused while the value in that column stays the same, so
+    # re-sorting after a refresh or a header click is a plain key sort.
+    numberPattern = re.compile(r"(\d+)")
+    jobIdPattern = re.compile(r"(\d+)(?:_(\d+))?")
+
+    def __init__(self):
+        self.column = None
+        self.reverse = False
+        self.cache = {}
+        # job IDs and run times are sorted largest first on the first click
+        self.descendingColumns = (1, 5)
+        self.keyFunctions = (self.naturalKey, self.jobIdKey, self.naturalKey, self.naturalKey, self.textKey,
+                             self.timeKey, self.naturalKey)
+
+    @classmethod
+    def naturalKey(cls, text):
+        parts = cls.numberPattern.split(str(text).lower())
+        return tuple(int(part) if index % 2 else part for index, part in enumerate(parts))
+
+    @classmethod
+    def jobIdKey(cls, text):
+        # 123_4 sorts after 123 and before 123_10, non numeric IDs go last
+        match = cls.jobIdPattern.match(str(text))
+        if match is None:
+            return (1, 0, 0, str(text))
+        taskId = match.group(2)
+        return (0, int(match.group(1)), int(taskId) if taskId else -1, str(text))
+
+    @staticmethod
+    def timeKey(text):
+        # Slurm times are [days-][hours:]minutes:seconds, a bare number is minutes
+        text = str(text).strip()
+        days = 0
+        if "-" in text:
+            dayPart, text = text.split("-", 1)
+            try:
+                days = int(dayPart)
+            except ValueError:
+                return -1
+        try:
+            parts = [int(part) for part in text.split(":")]
+        except ValueError:
+            return -1
+        if len(parts) == 1:
+            parts = [parts[0], 0]
+        seconds = 0
+        for part in parts[-3:]:
+            seconds = seconds * 60 + part
+        return days * 86400 + seconds
+
+    @staticmethod
+    def textKey(text):
+        return str(text).lower()
+
+    def toggle(self, column):
+        if column == self.column:
+            self.reverse = not self.reverse
+        else:
+            self.column = column
+            self.reverse = column in self.descendingColumns
+
+    def sortKey(self, key, values):
+        # cache is {key: {column: (value, sort key)}}
+        columnKeys = self.cache.get(key)
+        if columnKeys is None:
+            columnKeys = self.cache[key] = {}
+        value = values[self.column]
+        cached = columnKeys.get(self.column)
+        if cached is None or cached[0] != value:
+            cached = columnKeys[self.column] = (value, self.keyFunctions[self.column](value))
+        return cached[1]
+
+    def sort(self, keyedRows):
+        if self.column is None:
+            return keyedRows
+
+        # sortKey inlined, this runs for every row on each refresh
+        column = self.column
+        cache = self.cache
+        keyFunction = self.keyFunctions[column]
+        keys = []
+        append = keys.append
+        for key, values in keyedRows:
+            columnKeys = cache.get(key)
+            if columnKeys is None:
+                columnKeys = cache[key] = {}
+            value = values[column]
+            cached = columnKeys.get(column)
+            if cached is None or cached[0] != value:
+                cached = columnKeys[column] = (value, keyFunction(value))
+            append(cached[1])
+        if len(self.cache) > 2 * len(keyedRows):
+            present = set(key for key, values in keyedRows)
+            self.cache = dict((key, cached) for key, cached in self.cache.items() if key in present)
+
+        order = sorted(range(len(keyedRows)), key=keys.__getitem__, reverse=self.reverse)
+        return [keyedRows[index] for index in order]
+
+
+class JobTable(object):
+    headers = ("Cluster", "ID", "Path", "Script", "Status", "Time", "Comment")
+
+    # Model of the job table. Only the rows in view exist as Treeview items,
+    # the scrollbar, wheel and arrow keys move that window over the model, so
+    # the widget stays small however many jobs are loaded. Items use the job
+    # key as iid, so the selection survives refreshes and scrolling.
+    def __init__(self, tree, scrollbar):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.rows = {}
+        self.order = []
+        self.offset = 0
+        self.windowSize = int(tree.cget("height"))
+        self.shown = []
+        self.shownValues = {}
+        self.focusKey = None
+        self.tags = ()
+
+        tree.tag_configure("stale", foreground="gray")
+        scrollbar.configure(command=self.scroll)
+        tree.bind("<<TreeviewSelect>>", self.selectionChanged)
+        tree.bind("<MouseWheel>", self.wheel)
+        tree.bind("<Button-4>", lambda event: self.scroll("scroll", -3, "units"))
+        tree.bind("<Button-5>", lambda event: self.scroll("scroll", 3, "units"))
+        tree.bind("<Up>", lambda event: self.moveFocus(-1))
+        tree.bind("<Down>", lambda event: self.moveFocus(1))
+        tree.bind("<Prior>", lambda event: self.moveFocus(-self.windowSize))
+        tree.bind("<Next>", lambda event: self.moveFocus(self.windowSize))
+
+    @staticmethod
+    def rowKey(row):
+        return row["Cluster"] + "/" + str(row["jobID"])
+
+    @staticmethod
+    def tableRow(row):
+        return (row["Cluster"], row["jobID"], row["RunningDir"], row["Script file"], row["Status"], row["Time"],
+                row["Comment"])
+
+    tableRowGetter = operator.itemgetter("Cluster", "jobID", "RunningDir", "Script file", "Status", "Time",
+                                         "Comment")
+
+    @classmethod
+    def keyedRows(cls, rows):
+        # (rowKey, tableRow) of every row
+        return [(values[0] + "/" + str(values[1]), values) for values in map(cls.tableRowGetter, rows)]
+
+    def update(self, keyedRows):
+        newRows = {}
+        newOrder = []
+        for key, values in keyedRows:
+            if key in newRows:
+                continue
+            newRows[key] = values
+            newOrder.append(key)
+
+        # a scrolled view stays on the row that was at its top
+        anchor = self.order[self.offset] if 0 < self.offset < len(self.order) else None
+        self.rows = newRows
+        self.order = newOrder
+        if anchor in newRows:
+            self.offset = newOrder.index(anchor)
+        self.render()
+
+    def patch(self, changed, matching, sorter):
+        # applies changed rows without rebuilding the model: those in
+        # matching are updated or added, the others leave the table. New rows
+        # and rows whose sort value changed are merged into the order of
+        # sorter, or go last when the table is not sorted.
+        rows = self.rows
+        column = sorter.column
+        anchor = self.order[self.offset] if 0 < self.offset < len(self.order) else None
+        matchingKeys = set(key for key, values in matching)
+
+        leaving = set()
+        for key, values in changed:
+            old = rows.get(key)
+            if old is not None and (key not in matchingKeys or column is not None and old[column] != values[column]):
+                leaving.add(key)
+        if leaving:
+            self.order = [key for key in self.order if key not in leaving]
+            for key in leaving:
+                del rows[key]
+
+        added = []
+        for key, values in matching:
+            if key not in rows:
+                added.append(key)
+            rows[key] = values
+        if added and column is None:
+            self.order.extend(added)
+        elif added:
+            self.order = self.merged(added, sorter)
+
+        if anchor in rows:
+            self.offset = self.order.index(anchor)
+        self.render()
+
+    def merged(self, added, sorter):
+        # the order with the added keys inserted after rows of equal sort
+        # value; only the added keys are sorted, the rest is sliced
+        rows = self.rows
+        order = self.order
+        sortKey = sorter.sortKey
+        reverse = sorter.reverse
+        added = sorted(added, key=lambda key: sortKey(key, rows[key]), reverse=reverse)
+
+        merged = []
+        start = 0
+        for key in added:
+            value = sortKey(key, rows[key])
+            low, high = start, len(order)
+            while low < high:
+                middle = (low + high) // 2
+                middleValue = sortKey(order[middle], rows[order[middle]])
+                if (middleValue < value) if reverse else (value < middleValue):
+                    high = middle
+                else:
+                    low = middle + 1
+            merged.extend(order[start:low])
+            merged.append(key)
+            start = low
+        merged.extend(order[start:])
+        return merged
+
+    def render(self):
+        tree = self.tree
+        self.offset = max(0, min(self.offset, len(self.order) - self.windowSize))
+        keys = self.order[self.offset:self.offset + self.windowSize]
+        rows = self.rows
+
+        visible = set(keys)
+        removed = [key for key in self.shown if key not in visible]
+        if removed:
+            tree.delete(*removed)
+
+        shownValues = {}
+        for index, key in enumerate(keys):
+            values = rows[key]
+            oldValues = self.shownValues.get(key)
+            if oldValues is None:
+                tree.insert('', index, iid=key, values=values, tags=self.tags)
+            elif oldValues != values:
+                tree.item(key, values=values)
+            shownValues[key] = values
+
+        if list(tree.get_children()) != keys:
+            for index, key in enumerate(keys):
+                tree.move(key, '', index)
+
+        self.shown = keys
+        self.shownValues = shownValues
+
+        if self.focusKey in shownValues:
+            tree.focus(self.focusKey)
+            if tuple(tree.selection()) != (self.focusKey,):
+                tree.selection_set(self.focusKey)
+
+        total = len(self.order)
+        if total:
+            self.scrollbar.set(float(self.offset) / total, min(1.0, float(self.offset + self.windowSize) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def setStale(self, stale):
+        # rows restored from a snapshot are grayed out until the first refresh
+        tags = ("stale",) if stale else ()
+        if tags == self.tags:
+            return
+        self.tags = tags
+        for key in self.shown:
+            self.tree.item(key, tags=tags)
+
+    def scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.offset = int(round(float(amount) * len(self.order)))
+        else:
+            amount = int(amount)
+            if unit == "pages":
+                amount *= self.windowSize
+            self.offset += amount
+        self.render()
+        return "break"
+
+    def wheel(self, event):
+        return self.scroll("scroll", -3 if event.delta > 0 else 3, "units")
+
+    def moveFocus(self, delta):
+        if not self.order:
+            return "break"
+        if self.focusKey in self.rows:
+            index = self.order.index(self.focusKey) + delta
+        else:
+            index = self.offset
+        index = max(0, min(index, len(self.order) - 1))
+
+        self.focusKey = self.order[index]
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.windowSize:
+            self.offset = index - self.windowSize + 1
+        self.render()
+        return "break"
+
+    def selectionChanged(self, event=None):
+        # items scrolled out of the window drop their selection, the model keeps it
+        selection = self.tree.selection()
+        if selection:
+            self.focusKey = selection[0]
+        elif self.focusKey in self.shownValues:
+            self.focusKey = None
+
+    def focus(self):
+        if self.focusKey in self.rows:
+            return self.focusKey
+        return ""
+
+    def remove(self, key):
+        if key not in self.rows:
+            return
+        del self.rows[key]
+        self.order.remove(key)
+        self.render()
+
+    def values(self, key):
+        return self.rows.get(key)
+
+
+class PhaseTimer(object):
+    # Wall time spent in the named phases of a longer operation
+    def __init__(self):
+        self.started = time.time()
+        self.last = self.started
+        self.phases = []
+
+    def mark(self, name):
+        now = time.time()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def total(self):
+        return self.last - self.started
+
+    def describe(self):
+        return "%.1f ms (" % (self.total() * 1000) + ", ".join(
+            "%s %.1f ms" % (name, seconds * 1000) for name, seconds in self.phases) + ")"
+
+
+class PerfSpan(PhaseTimer):
+    # One timed run of an operation. Time spent in measure() blocks is taken
+    # out of the mark() that follows, so a parse nested in a receive loop is
+    # not counted twice; add() records time spent elsewhere, e.g. rendering
+    # on the Tk thread while the worker still receives.
+    def __init__(self, recorder, operation, detail):
+        PhaseTimer.__init__(self)
+        self.recorder = recorder
+        self.operation = operation
+        self.detail = detail
+        self.bytes = 0
+        self.nested = 0.0
+
+    def mark(self, name):
+        now = time.time()
+        self.phases.append((name, now - self.last - self.nested))
+        self.last = now
+        self.nested = 0.0
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def measure(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.phases.append((name, elapsed))
+            self.nested += elapsed
+
+    def addBytes(self, count):
+        self.bytes += count
+
+    def finish(self, error=None):
+        phases = OrderedDict()
+        for name, seconds in self.phases:
+            phases[name] = phases.get(name, 0.0) + seconds
+        self.recorder.add({"operation": self.operation, "detail": self.detail, "start": self.started,
+                           "total": time.time() - self.started, "phases": phases, "bytes": self.bytes,
+                           "error": None if error is None else str(error)})
+
+
+class NullSpan(object):
+    # handed out while recording is off, every call does nothing
+    def mark(self, name):
+        pass
+
+    def add(self, name, seconds):
+        pass
+
+    def measure(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def addBytes(self, count):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def taskSpan(task):
+    return task.span if task is not None else NULL_SPAN
+
+
+class PerfRecorder(object):
+    # Timings of user operations, the last `capacity` runs in a ring buffer.
+    # Off by default; while off start() returns NULL_SPAN, so the hot paths
+    # only pay for a few no-op calls.
+    csvFields = ("start", "operation", "detail", "total", "bytes", "error")
+
+    def __init__(self, capacity=2000):
+        self.enabled = False
+        self.records = deque(maxlen=capacity)
+
+    def start(self, operation, detail=""):
+        if not self.enabled:
+            return NULL_SPAN
+        return PerfSpan(self, operation, detail)
+
+    def add(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+    @staticmethod
+    def percentile(values, fraction):
+        # nearest rank
+        ordered = sorted(values)
+        return ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)]
+
+    def summary(self):
+        # per operation: count, errors, p50/p95/max of the total, p50 of
+        # every phase (over the runs that had it) and of the bytes received
+        groups = OrderedDict()
+        for record in list(self.records):
+            groups.setdefault(record["operation"], []).append(record)
+
+        summary = OrderedDict()
+        for operation, records in groups.items():
+            totals = [record["total"] for record in records]
+            phases = OrderedDict()
+            for record in records:
+                for name, seconds in record["phases"].items():
+                    phases.setdefault(name, []).append(seconds)
+            summary[operation] = {"count": len(records),
+                                  "errors": len([record for record in records if record["error"]]),
+                                  "p50": self.percentile(totals, 0.5), "p95": self.percentile(totals, 0.95),
+                                  "max": max(totals),
+                                  "phases": OrderedDict((name, self.percentile(times, 0.5))
+                                                        for name, times in phases.items()),
+                                  "bytes": self.percentile([record["bytes"] for record in records], 0.5)}
+        return summary
+
+    def exportJson(self, path, extra=None):
+        data = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "summary": self.summary(),
+                "records": list(self.records)}
+        data.update(extra or {})
+        with open(path, 'w') as fp:
+            json.dump(data, fp, indent=1)
+
+    def exportCsv(self, path):
+        # one line per run, a column per phase name
+        records = list(self.records)
+        phaseNames = []
+        for record in records:
+            phaseNames += [name for name in record["phases"] if name not in phaseNames]
+
+        def field(value):
+            if value is None:
+                return ""
+            if isinstance(value, float):
+                return "%.6f" % value
+            text = str(value)
+            if any(char in text for char in ",\"\n"):
+                text = '"' + text.replace('"', '""') + '"'
+            return text
+
+        with open(path, 'w') as fp:
+            fp.write(",".join(self.csvFields + tuple(phaseNames)) + "\n")
+            for record in records:
+                values = [record[name] for name in self.csvFields] + [record["phases"].get(name)
+                                                                      for name in phaseNames]
+                fp.write(",".join(field(value) for value in values) + "\n")
 
 
 class JobStatusGUI:
-    def __init__(self, notebook):
+    def __init__(self, notebook, startupTimer=None):
+        self.startupTimer = startupTimer or PhaseTimer()
         self.ntbk = notebook
 
         self.savePassword = False
@@ -79,23 +3271,36 @@ class JobStatusGUI:
         self.jobMonitor = ttk.Frame(self.ntbk)
         self.loginData = ttk.Frame(self.ntbk)
         self.localCommander = ttk.Frame(self.ntbk)
+        self.diagnostics = ttk.Frame(self.ntbk)
 
         self.ntbk.add(self.jobMonitor, text="Job status")
         self.ntbk.add(self.loginData, text="Login data")
         self.ntbk.add(self.localCommander, text="Local commander")
+        self.ntbk.add(self.diagnostics, text="Diagnostics")
 
         self.ntbk.grid(column=0, row=0, columnspan=20)
 
-        self.treeHeaders = ["ID", "Path", "Script", "Status", "Time", "Comment"]
-        self.treeHeaders2width = {"ID": 90, "Path": 500, "Script": 140, "Status": 80, "Time": 100, "Comment": 200}
+        # only the job status tab is built now, the others on first view
+        self.tabBuilders = {str(self.loginData): self.gridLoginData, str(self.localCommander): self.gridLocalCommander,
+                            str(self.diagnostics): self.gridDiagnostics}
+        self.ntbk.bind("<<NotebookTabChanged>>", self.buildSelectedTab)
+
+        self.treeHeaders = list(JobTable.headers)
+        self.treeHeaders2width = {"Cluster": 160, "ID": 90, "Path": 400, "Script": 140, "Status": 80, "Time": 100, "Comment": 200}
 
-        self.client = paramiko.client.SSHClient()
-        self.client.load_system_host_keys()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.connections = ConnectionManager()
+        self.session = None
+        self.useRemoteHelper = Tkinter.IntVar(value=1)
+        self.statusBackend = Tkinter.StringVar(value=CalculationFlowBackend.name)
+        self.compression = Tkinter.StringVar(value="auto")
+        self.forgottenJobs = {}
+        self.autoRefresh = Tkinter.IntVar(value=0)
+        self.loadInMemory = Tkinter.IntVar(value=0)
 
         self.accounts = []
 
         self.connected = False
+        self.connecting = set()
         self.currentSelectionTree = None
 
         self.customButtonsNo = 18
@@ -114,43 +3319,98 @@ class JobStatusGUI:
         self.localCommanderButtonsData = []
         self.currentLocalDir = ""
 
-        self.actualStatus = {}
+        self.commandTask = None
+        self.outputFlushInterval = 0.1
+        self.follower = None
+        self.followAfterId = None
+        self.hoveredJob = None
+        self.prefetchAfterId = None
+        self.prefetchDelay = 150
+
+        self.actualStatus = OrderedDict()
+        # accountKey: helper status version of the rows in actualStatus
+        self.statusVersions = {}
+        self.incomingStatus = None
+        self.statusBatchSize = 2000
+        self.statusFlushInterval = 0.25
+        # streamed rows wait here until the next table update, at most one
+        # per statusFlushInterval
+        self.pendingStatusRows = []
+        self.statusFlushAfterId = None
+        self.lastStatusFlush = 0
+        self.perf = PerfRecorder()
+        self.perfEnabled = Tkinter.IntVar(value=0)
+        self.jobFilter = JobFilter()
+        self.jobSorter = JobSorter()
+        self.jobRows = []
+        self.filterAfterId = None
+        self.filterDelay = 150
         self.currentDir = ""
-
+        self.snapshotListings = {}
+        self.snapshotCluster = None
+        # (cluster, directory) written by the last saveSnapshot
+        self.snapshotDir = None
+        self.staleSince = None
+        self.tabTimes = []
+
+        self.startupTimer.mark("setup")
         self.grid()
+        self.startupTimer.mark("job tab")
 
-        self.scrDir = expanduser("~/.slurm_watcher")
-        if platform.system() != "Linux":
-            localAppDataDir = getenv("LOCALAPPDATA")
-            self.scrDir = join(localAppDataDir, "slurm_watcher")
+        self.executor = RemoteExecutor(self.jobMonitor, 8)
+        self.executor.addActivityListener(self.refreshBusyIndicator)
+        self.statusPoller = StatusPoller(self.jobMonitor, self.pollStatus, self.refreshPollInfo)
+
+        self.scrDir = defaultConfigDir()
 
         self.configFile = join(self.scrDir, "config.json")
         self.currentLocalDir = os.getcwd()
-        self.localCurrentDirEntry.configure(state="normal")
-        self.localCurrentDirEntry.delete(0, "end")
-        self.localCurrentDirEntry.insert(0, self.currentLocalDir)
-        self.localCurrentDirEntry.configure(state="readonly")
 
         if not isdir(self.scrDir):
             mkdir(self.scrDir)
 
+        self.history = JobHistory(join(self.scrDir, "history.sqlite"))
+        self.historyDays = 30
+        self.snapshot = StatusSnapshot(join(self.scrDir, "snapshot.marshal"))
+        self.downloadCache = DownloadCache(join(self.scrDir, "downloads"))
+        self.memoryLoadLimit = 512 * 1048576
+        self.startupTimer.mark("history")
+
         if isfile(self.configFile):
             with open(self.configFile, 'r') as fp:
                 state = json.load(fp)
                 self.loadState(state)
         else:
-            self.pathList.insert("end", self.currentLocalDir)
             state = self.getState()
             with open(self.configFile, 'w') as fp:
                 json.dump(state, fp)
+        self.startupTimer.mark("config")
+
+        self.loadSnapshot()
+        self.startupTimer.mark("snapshot")
+
+    def tabBuilt(self, tab):
+        return str(tab) not in self.tabBuilders
+
+    def buildSelectedTab(self, event=None):
+        builder = self.tabBuilders.pop(str(self.ntbk.select()), None)
+        if builder is not None:
+            timer = PhaseTimer()
+            builder()
+            timer.mark(builder.__name__)
+            self.tabTimes.append(timer.phases[0])
 
     def gridJobMonitor(self):
         self.tree_data = ttk.Treeview(self.jobMonitor, columns=self.treeHeaders, show="headings", heigh=15)
-        for header in self.treeHeaders:
-            self.tree_data.heading(header, text=header)
+        for index, header in enumerate(self.treeHeaders):
+            self.tree_data.heading(header, text=header, command=lambda column=index: self.sortJobs(column))
             self.tree_data.column(header, width=self.treeHeaders2width[header])
         self.tree_data.grid(row=0, column=0, columnspan=20, rowspan=11)
         self.tree_data.bind("<Button-1>", self.setDir)
+        self.tree_data.bind("<Motion>", self.prefetchJobDir)
+        jobScrollbar = ttk.Scrollbar(self.jobMonitor, orient="vertical")
+        jobScrollbar.grid(row=0, column=20, rowspan=11, sticky="ns")
+        self.jobTable = JobTable(self.tree_data, jobScrollbar)
 
         columnNo = 21
         getStatusButton = Tkinter.Button(self.jobMonitor, text="Get status", width=15, command=self.getStatus)
@@ -164,10 +3424,15 @@ class JobStatusGUI:
 
         self.filterEntry = Tkinter.Entry(self.jobMonitor, width=7)
         self.filterEntry.grid(row=3, column=columnNo)
+        self.filterEntry.bind("<KeyRelease>", self.scheduleFilter)
+        self.filterEntry.bind("<Return>", lambda event: self.applyFilter())
 
-        filterButton = Tkinter.Button(self.jobMonitor, width=5, text="*", command=self.filterJobs)
+        filterButton = Tkinter.Button(self.jobMonitor, width=5, text="*", command=self.applyFilter)
         filterButton.grid(row=3, column=columnNo + 1)
 
+        historyButton = Tkinter.Button(self.jobMonitor, text="History", width=15, command=self.showJobHistory)
+        historyButton.grid(row=4, column=columnNo, columnspan=2)
+
         directoryViewLabel = Tkinter.Label(self.jobMonitor, text="Directory contains:")
         directoryViewLabel.grid(row=11, column=0, columnspan=2)
 
@@ -181,8 +3446,15 @@ class JobStatusGUI:
         downloadButton = Tkinter.Button(self.jobMonitor, text="Download", width=20, command=self.downloadFile)
         downloadButton.grid(row=13, column=2)
 
-        toPymolButton = Tkinter.Button(self.jobMonitor, text="to Pymol", width=20, command=self.downloadAndLoadToPymol)
-        toPymolButton.grid(row=14, column=2)
+        toPymolFrame = Tkinter.Frame(self.jobMonitor)
+        toPymolFrame.grid(row=14, column=2)
+
+        toPymolButton = Tkinter.Button(toPymolFrame, text="to Pymol", width=9, command=self.downloadAndLoadToPymol)
+        toPymolButton.pack(side="left")
+
+        loadInMemoryCheck = Tkinter.Checkbutton(toPymolFrame, text="in memory", variable=self.loadInMemory,
+                                                command=self.saveConfig)
+        loadInMemoryCheck.pack(side="left")
 
         saveCommandsButton = Tkinter.Button(self.jobMonitor, text="Save buttons", width=20, command=self.saveButtons)
         saveCommandsButton.grid(row=15, column=2)
@@ -190,11 +3462,41 @@ class JobStatusGUI:
         loadCommandsButton = Tkinter.Button(self.jobMonitor, text="Load buttons", width=20, command=self.loadButtons)
         loadCommandsButton.grid(row=16, column=2)
 
+        cancelOperationsButton = Tkinter.Button(self.jobMonitor, text="Cancel operations", width=20,
+                                                command=self.cancelOperations)
+        cancelOperationsButton.grid(row=17, column=2)
+
+        self.busyLabel = Tkinter.Label(self.jobMonitor, text="Idle", width=20, wraplength=150, justify="left")
+        self.busyLabel.grid(row=18, column=2)
+
+        pollFrame = Tkinter.Frame(self.jobMonitor)
+        pollFrame.grid(row=19, column=2)
+
+        autoRefreshCheck = Tkinter.Checkbutton(pollFrame, text="Auto refresh", variable=self.autoRefresh,
+                                               command=self.toggleAutoRefresh)
+        autoRefreshCheck.pack(side="left")
+
+        self.pollIntervalEntry = Tkinter.Entry(pollFrame, width=4)
+        self.pollIntervalEntry.pack(side="left")
+        self.pollIntervalEntry.insert(0, "60")
+        self.pollIntervalEntry.bind("<Return>", self.setPollInterval)
+        self.pollIntervalEntry.bind("<FocusOut>", self.setPollInterval)
+
+        self.pollInfoLabel = Tkinter.Label(self.jobMonitor, text="Auto refresh off", width=20)
+        self.pollInfoLabel.grid(row=11, column=2)
+
         outputLabel = Tkinter.Label(self.jobMonitor, text="Command output")
-        outputLabel.grid(row=11, column=3, columnspan=4)
+        outputLabel.grid(row=11, column=3, columnspan=2)
+
+        self.followButton = Tkinter.Button(self.jobMonitor, text="Follow", command=self.toggleFollow)
+        self.followButton.grid(row=11, column=5)
+
+        stopCommandButton = Tkinter.Button(self.jobMonitor, text="Stop command", command=self.stopCommand)
+        stopCommandButton.grid(row=11, column=6)
 
         self.outputText = Tkinter.Text(self.jobMonitor, width=80, height=16)
         self.outputText.grid(row=12, column=3, columnspan=4, rowspan=8)
+        self.commandOutput = CommandOutput(self.outputText)
         #        self.outputText.configure(state = "disabled")
 
         rowActual = 20
@@ -303,12 +3605,100 @@ class JobStatusGUI:
             fileSelection = self.directoryViewList.get(fileSelection)
             command2execute = command2execute.replace("$1", fileSelection)
 
-        stdin, stdout, stderr = self.client.exec_command("cd " + dir2go + " ; " + command2execute)
+        session = self.session
+
+        def execute(task):
+            batch = []
+            lastFlush = time.time()
+            for kind, text in session.commandStream(dir2go, command2execute, task):
+                if kind == "exit":
+                    if text:
+                        batch.append(("stderr", "\n[exit status " + str(text) + "]\n"))
+                elif text:
+                    batch.append((kind, text))
+                if batch and time.time() - lastFlush > self.outputFlushInterval:
+                    task.post(self.commandOutput.append, batch)
+                    batch = []
+                    lastFlush = time.time()
+            if batch:
+                task.post(self.commandOutput.append, batch)
+
+        self.stopFollow()
+        self.commandOutput.clear()
+        self.commandTask = self.executor.submit(self.customButtonsData[buttonInd].get("text", "command"), execute,
+                                                key="command", span=self.perf.start("command", command2execute))
+
+    def stopCommand(self):
+        self.stopFollow()
+        if self.commandTask is not None:
+            self.commandTask.cancel()
+            self.commandTask = None
+            self.refreshBusyIndicator()
+
+    def toggleFollow(self):
+        if self.follower is not None:
+            self.stopFollow()
+            return
+
+        if not self.connected:
+            tkMessageBox.showwarning(title="Cannot follow",
+                                     message="You have to connect to host before following a file")
+            return
+
+        fileSelection = self.directoryViewList.curselection()
+        if not fileSelection or self.currentDir == "":
+            tkMessageBox.showwarning(title="Cannot follow", message="Please select file to follow")
+            return
+
+        fileSelection = self.directoryViewList.get(fileSelection)
+        if fileSelection[-1] == "/":
+            tkMessageBox.showwarning(title="Cannot follow", message="This is a directory")
+            return
+
+        if self.commandTask is not None:
+            self.commandTask.cancel()
+            self.commandTask = None
+
+        self.follower = LogFollower(self.session, self.currentDir + "/" + fileSelection)
+        self.followButton.configure(text="Unfollow")
+        self.commandOutput.clear()
+        self.pollFollowedFile()
 
-        output = "".join(list(stdout.readlines()))
+    def pollFollowedFile(self):
+        follower = self.follower
+        self.followAfterId = None
+        if follower is None:
+            return
 
-        self.outputText.delete("1.0", "end")
-        self.outputText.insert("end", output)
+        def followed(result):
+            if self.follower is not follower:
+                return
+            text, truncated = result
+            chunks = []
+            if truncated:
+                chunks.append(("stderr", "\n[file truncated, reading from the start]\n"))
+            if text:
+                chunks.append(("stdout", text))
+            if chunks:
+                self.commandOutput.append(chunks)
+            self.followAfterId = self.outputText.after(int(follower.interval * 1000), self.pollFollowedFile)
+
+        def followFailed(error):
+            if self.follower is follower:
+                self.stopFollow()
+                tkMessageBox.showwarning(title="Cannot follow", message=str(error))
+
+        self.executor.submit("follow " + posixpath.basename(follower.remotePath), follower.poll, followed,
+                             followFailed, key="follow")
+
+    def stopFollow(self):
+        if self.follower is None:
+            return
+        self.follower = None
+        if self.followAfterId is not None:
+            self.outputText.after_cancel(self.followAfterId)
+            self.followAfterId = None
+        self.followButton.configure(text="Follow")
 
     def customButtonCommandLocal(self, buttonInd):
         if buttonInd >= len(self.customButtonsLocalData):
@@ -438,25 +3828,85 @@ class JobStatusGUI:
             info = self.tree_data.item(item, 'values')
             self.currentSelectionTree = info
 
-            if self.connected:
-                dir2print = info[1]
-                self.currentDir = dir2print
+            session = self.connections.get(info[0])
+            if session is not None:
+                self.session = session
+                dir2print = info[2]
+                self.setCurrentDir(dir2print)
+
+                self.directoryViewList.delete(0, "end")
+                self.outputText.delete("1.0", "end")
+                self.listRemoteDir(dir2print, None)
+            elif not self.connected and info[2] in self.snapshotListings.get(info[0], {}):
+                # not connected yet, the listing saved last time is shown
+                self.setCurrentDir(info[2])
+                self.snapshotCluster = info[0]
+                self.showDirectoryListing(info[2], RemoteListing.names(self.snapshotListings[info[0]][info[2]]), None)
+
+    def setCurrentDir(self, path):
+        self.currentDir = path
+        self.currentDirEntry.configure(state="normal")
+        self.currentDirEntry.delete(0, "end")
+        self.currentDirEntry.insert(0, path)
+        self.currentDirEntry.configure(state="readonly")
 
-                self.currentDirEntry.configure(state="normal")
-                self.currentDirEntry.delete(0, "end")
-                self.currentDirEntry.insert(0, self.currentDir)
-                self.currentDirEntry.configure(state="readonly")
+    def listRemoteDir(self, dir2print, fileSelection, refresh=False):
+        session = self.session
 
-                stdin, stdout, stderr = self.client.exec_command("ls -p " + dir2print)
-                filesList = list(stdout.readlines())
+        if not refresh:
+            entries = session.listing.cached(dir2print)
+            if entries is not None:
+                span = self.perf.start("list dir", dir2print)
+                span.mark("cache")
+                self.showDirectoryListing(dir2print, RemoteListing.names(entries), fileSelection)
+                span.mark("render")
+                span.finish()
+                return
 
-                self.directoryViewList.delete(0, "end")
-                for filename in filesList:
-                    self.directoryViewList.insert("end", filename.strip())
+        def listDir(task):
+            return session.listDir(dir2print, task, refresh)
 
-                self.directoryViewList.insert("end", "../")
+        self.executor.submit("ls " + dir2print, listDir,
+                             lambda filesList: self.showDirectoryListing(dir2print, filesList, fileSelection),
+                             key="ls", span=self.perf.start("list dir", dir2print))
 
-                self.outputText.delete("1.0", "end")
+    def prefetchJobDir(self, event):
+        item = self.tree_data.identify_row(event.y)
+        if not item or item == self.hoveredJob:
+            return
+        self.hoveredJob = item
+
+        if self.prefetchAfterId is not None:
+            self.tree_data.after_cancel(self.prefetchAfterId)
+        self.prefetchAfterId = self.tree_data.after(self.prefetchDelay, lambda: self.prefetchDir(item))
+
+    def prefetchDir(self, item):
+        self.prefetchAfterId = None
+        values = self.jobTable.values(item)
+        if not self.connected or values is None:
+            return
+
+        session = self.connections.get(values[0])
+        path = values[2]
+        if session is None or session.listing.cached(path) is not None:
+            return
+
+        self.executor.submit("prefetch " + path, lambda task: session.listing.list(path, task), key="prefetch")
+
+    def showDirectoryListing(self, dir2print, filesList, fileSelection):
+        if dir2print != self.currentDir:
+            return
+
+        self.directoryViewList.delete(0, "end")
+        for filename in filesList:
+            self.directoryViewList.insert("end", filename)
+        self.directoryViewList.insert("end", "../")
+
+        if fileSelection:
+            self.directoryViewList.see(fileSelection)
+
+        if self.session is not None and (self.session.key, dir2print) != self.snapshotDir:
+            self.saveSnapshot()
 
     def enterAndSetDir(self, event):
         dirSelection = self.directoryViewList.curselection()
@@ -470,105 +3920,404 @@ class JobStatusGUI:
             tkMessageBox.showwarning(title="Cannot enter directory!", message="This is not a directory")
             return
 
-        self.currentDir = normpath(join(self.currentDir, dirSelection))
+        self.currentDir = posixpath.normpath(posixpath.join(self.currentDir, dirSelection))
         self.currentDirEntry.configure(state="normal")
         self.currentDirEntry.delete(0, "end")
         self.currentDirEntry.insert(0, self.currentDir)
         self.currentDirEntry.configure(state="readonly")
-        self.refreshDirectoryView()
+
+        if self.connected:
+            self.outputText.delete("1.0", "end")
+            self.listRemoteDir(self.currentDir, None)
 
     def getStatus(self):
         if not self.connected:
             tkMessageBox.showwarning(title="Cannot get status!",
                                      message="You have to be connected with host to get actual status")
+            return
 
-        jobManagerDir = self.jobManagerDirEntry.get()
-        if jobManagerDir[-1] != "/":
-            jobManagerDir += "/"
+        self.requestStatus(True)
 
-        command = " python " + jobManagerDir + "squeuePy.py -json"
+    def pollStatus(self):
+        if not self.connected:
+            return False
+
+        self.requestStatus(False)
+        return True
+
+    def requestStatus(self, manual):
+        # every cluster is polled by its own task, so a refresh takes as long
+        # as the slowest cluster; rows of all of them stream into one table
+        startTime = time.time()
+        incoming = OrderedDict()
+        pending = set(self.connections.keys())
+        failed = []
+        versions = dict(self.statusVersions)
+
+        def fetchStatus(session):
+            knownVersion = self.statusVersions.get(session.key)
+
+            def fetch(task):
+                batch = []
+                lastFlush = time.time()
+                try:
+                    for item in session.iterJobs(task, knownVersion):
+                        batch.append(item)
+                        if len(batch) >= self.statusBatchSize or time.time() - lastFlush > self.statusFlushInterval:
+                            task.post(self.statusRowsArrived, incoming, batch)
+                            batch = []
+                            lastFlush = time.time()
+                except StatusNotModified:
+                    return knownVersion, False
+                if batch:
+                    task.post(self.statusRowsArrived, incoming, batch)
+                return session.statusVersion, True
+
+            return fetch
+
+        def keepRows(key):
+            # the last known rows of a cluster that was not polled or did not change
+            if self.incomingStatus is incoming:
+                for mainKey in self.actualStatus:
+                    if mainKey[0] == key:
+                        incoming[mainKey] = self.actualStatus[mainKey]
+
+        def clusterFinished(key, version=None, modified=True):
+            pending.discard(key)
+            versions[key] = version
+            if not modified:
+                keepRows(key)
+            if pending or self.incomingStatus is not incoming:
+                return
+            if len(failed) == len(self.connections):
+                self.incomingStatus = None
+                self.filterJobs()
+                self.statusPoller.pollFailed()
+            else:
+                self.statusVersions = versions
+                self.showStatus(incoming, time.time() - startTime)
+
+        def clusterFailed(key, error):
+            keepRows(key)
+            failed.append(key)
+            clusterFinished(key, versions.get(key))
+            if manual:
+                tkMessageBox.showwarning(title="Cannot get status!", message=key + ":\n" + str(error))
+
+        self.incomingStatus = incoming
+        for session in self.connections.values():
+            self.executor.submit("status " + session.account["host"], fetchStatus(session),
+                                 lambda result, key=session.key: clusterFinished(key, *result),
+                                 lambda error, key=session.key: clusterFailed(key, error),
+                                 key="status:" + session.key, span=self.perf.start("status", session.key))
+
+    def dropIncomingStatus(self):
+        if self.incomingStatus is not None:
+            self.incomingStatus = None
+            self.filterJobs()
+
+    def statusRowsArrived(self, incoming, batch):
+        if self.incomingStatus is not incoming:
+            return
 
-        stdin, stdout, stderr = self.client.exec_command(command)
+        for mainKey, row in batch:
+            if mainKey not in incoming:
+                incoming[mainKey] = []
+            incoming[mainKey].append(row)
+            self.pendingStatusRows.append(row)
+
+        if self.statusFlushAfterId is None:
+            delay = max(0, self.lastStatusFlush + self.statusFlushInterval - time.time())
+            self.statusFlushAfterId = self.jobMonitor.after(int(delay * 1000), self.flushStatusRows)
+
+    def flushStatusRows(self):
+        # only the rows received since the last flush go into the model, the
+        # search index and the table; the refresh ends with one filterJobs
+        self.statusFlushAfterId = None
+        self.lastStatusFlush = time.time()
+        rows = self.pendingStatusRows
+        self.pendingStatusRows = []
+        if self.incomingStatus is None or not rows:
+            return
 
-        result = list(stdout.readlines())
-        result = " ".join(result)
-        result = result.replace("'", '"')
-        status = json.loads(result)
+        span = self.perf.start("status rows")
+        keyedRows = JobTable.keyedRows(rows)
+        changed = self.jobFilter.upsert(keyedRows)
+        span.mark("index")
+        matching = self.jobFilter.matching(self.filterEntry.get(), changed)
+        span.mark("filter")
+        self.jobTable.patch(changed, matching, self.jobSorter)
+        span.mark("render")
+        span.finish()
+
+    def cancelStatusFlush(self):
+        if self.statusFlushAfterId is not None:
+            self.jobMonitor.after_cancel(self.statusFlushAfterId)
+            self.statusFlushAfterId = None
+        self.pendingStatusRows = []
+
+    def statusRows(self):
+        # while a refresh streams in, rows not received yet keep their old values
+        if self.incomingStatus is None:
+            for mainKey in self.actualStatus:
+                for row in self.actualStatus[mainKey]:
+                    yield row
+            return
 
-        self.actualStatus = status
+        received = set()
+        for mainKey in self.incomingStatus:
+            for row in self.incomingStatus[mainKey]:
+                received.add(JobTable.rowKey(row))
+                yield row
 
-        self.tree_data.delete(*self.tree_data.get_children())
-        self.directoryViewList.delete(0, "end")
-        self.outputText.delete("1.0", "end")
+        for mainKey in self.actualStatus:
+            for row in self.actualStatus[mainKey]:
+                if JobTable.rowKey(row) not in received:
+                    yield row
+
+    def showStatus(self, status, latency=None):
+        if self.incomingStatus is status:
+            self.incomingStatus = None
 
+        previousStatus = {}
+        for mainKey in self.actualStatus:
+            for row in self.actualStatus[mainKey]:
+                previousStatus[JobTable.rowKey(row)] = row["Status"]
+
+        changedNo = 0
+        transitioning = False
         for mainKey in status:
-            resultList = status[mainKey]
-            for row in resultList:
-                tableRow = (
-                    row["jobID"], row["RunningDir"], row["Script file"], row["Status"], row["Time"], row["Comment"])
-                self.tree_data.insert('', "end", values=tableRow)
+            for row in status[mainKey]:
+                if previousStatus.get(JobTable.rowKey(row)) != row["Status"]:
+                    changedNo += 1
+                if self.statusPoller.isTransitioning(row["Status"]):
+                    transitioning = True
+
+        # a poll that brought nothing new does not rewrite the snapshot
+        statusChanged = status != self.actualStatus
+        self.actualStatus = status
+        self.filterJobs()
+
+        rows = [row for mainKey in status for row in status[mainKey]]
+        self.executor.submit("history", lambda task: self.history.record(rows))
+
+        if self.staleSince is not None:
+            self.staleSince = None
+            self.jobTable.setStale(False)
+            self.refreshPollInfo()
+        if statusChanged:
+            self.saveSnapshot()
+
+        if latency is not None:
+            self.statusPoller.pollFinished(latency, changedNo, transitioning)
+
+    def showJobHistory(self):
+        # state changes of the selected job and the recent jobs in its
+        # directory, or in the current directory when no job is selected;
+        # queried on a worker, a poll being recorded holds the history lock
+        values = self.jobTable.values(self.jobTable.focus())
+        if values is not None:
+            cluster, jobID, path = values[0], values[1], values[2]
+        elif self.currentDir:
+            cluster, jobID, path = None, None, self.currentDir
+        else:
+            tkMessageBox.showwarning(title="Cannot show history", message="Please select job")
+            return
 
-    def filterJobs(self):
-        filterKey = self.filterEntry.get()
+        history = self.history
+        days = self.historyDays
+
+        def query(task):
+            lines = []
+            if jobID is not None:
+                lines.append("History of " + cluster + "/" + jobID + ":")
+                for state, timestamp in history.transitions(cluster, jobID):
+                    lines.append("  " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + "  " + state)
+                durations = history.stateDurations(cluster, jobID=jobID).get((cluster, jobID), {})
+                for state in sorted(durations):
+                    lines.append("  " + state + ": " + formatDuration(durations[state]))
+                lines.append("")
+
+            jobs = history.jobs(cluster, path, time.time() - days * 86400, limit=200)
+            lines.append("Jobs in " + path + " during the last " + str(days) + " days:")
+            for job in jobs:
+                lines.append("  " + time.strftime("%Y-%m-%d %H:%M", time.localtime(job["lastSeen"])) + "  " +
+                             job["Cluster"] + "/" + job["jobID"] + "  " + job["Status"] + "  " + job["RunningDir"])
+            return lines
+
+        self.executor.submit("history " + path, query, self.showHistoryLines, key="showHistory")
+
+    def showHistoryLines(self, lines):
+        self.stopFollow()
+        self.commandOutput.clear()
+        self.commandOutput.append([("stdout", "\n".join(lines) + "\n")])
+
+    def toggleAutoRefresh(self):
+        self.applyPollSettings()
+        self.saveConfig()
+
+    def setPollInterval(self, event=None):
+        self.applyPollSettings()
+        self.saveConfig()
+
+    def applyPollSettings(self):
+        try:
+            seconds = int(self.pollIntervalEntry.get())
+        except ValueError:
+            seconds = self.statusPoller.baseInterval
 
-        self.tree_data.delete(*self.tree_data.get_children())
-        self.directoryViewList.delete(0, "end")
-        self.outputText.delete("1.0", "end")
+        self.statusPoller.setBaseInterval(seconds)
+        self.pollIntervalEntry.delete(0, "end")
+        self.pollIntervalEntry.insert(0, str(self.statusPoller.baseInterval))
 
-        for mainKey in self.actualStatus:
-            resultList = self.actualStatus[mainKey]
-            for row in resultList:
-                stringRow = row["jobID"] + row["RunningDir"] + row["Script file"] + row["Comment"]
-                if filterKey in stringRow:
-                    tableRow = (
-                        row["jobID"], row["RunningDir"], row["Script file"], row["Status"], row["Time"], row["Comment"])
-                    self.tree_data.insert('', "end", values=tableRow)
+        if self.autoRefresh.get():
+            self.statusPoller.start()
+        else:
+            self.statusPoller.stop()
+
+    def refreshPollInfo(self):
+        text = self.statusPoller.describe()
+        if self.staleSince is not None:
+            text = "Status from " + time.strftime("%Y-%m-%d %H:%M", time.localtime(self.staleSince)) + "\n" + text
+        self.pollInfoLabel.configure(text=text)
+
+    def loadSnapshot(self):
+        # the last known state is shown grayed out until fresh data arrives
+        data = self.snapshot.load()
+        if data is None:
+            return
+
+        self.actualStatus = data["status"]
+        self.snapshotListings = data["listings"]
+        self.snapshotCluster = data["cluster"]
+        self.snapshotDir = (data["cluster"], data["currentDir"])
+        self.staleSince = data["saved"]
+        self.jobTable.setStale(True)
+        self.filterJobs()
+        self.refreshPollInfo()
+
+        listing = self.snapshotListings.get(self.snapshotCluster, {}).get(data["currentDir"])
+        if listing is not None:
+            self.setCurrentDir(data["currentDir"])
+            self.showDirectoryListing(self.currentDir, RemoteListing.names(listing), None)
+
+    def saveSnapshot(self):
+        # listings of clusters not connected this time are kept
+        listings = dict(self.snapshotListings)
+        for session in self.connections.values():
+            listings[session.key] = session.listing.snapshot()
+        status = list(self.actualStatus.items())
+        cluster = self.session.key if self.session is not None else self.snapshotCluster
+        currentDir = self.currentDir
+        self.snapshotDir = (cluster, currentDir)
+
+        self.executor.submit("snapshot", lambda task: self.snapshot.save(status, listings, currentDir, cluster),
+                             key="snapshot")
+
+    def filterJobs(self):
+        # rows changed, the search index is rebuilt before filtering; rows
+        # streamed in but not flushed yet are part of statusRows
+        span = self.perf.start("filterJobs")
+        self.cancelStatusFlush()
+        self.jobRows = JobTable.keyedRows(self.statusRows())
+        self.jobFilter.setRows(self.jobSorter.sort(self.jobRows))
+        span.mark("index")
+        self.applyFilter(span)
+        span.finish()
+
+    def sortJobs(self, column):
+        self.jobSorter.toggle(column)
+        self.refreshSortHeadings()
+        self.jobTable.offset = 0
+        if self.incomingStatus is not None:
+            # jobRows does not have the rows streamed in since the last filterJobs
+            self.filterJobs()
+        else:
+            self.jobFilter.setRows(self.jobSorter.sort(self.jobRows))
+            self.applyFilter()
+        self.saveConfig()
+
+    def refreshSortHeadings(self):
+        for index, header in enumerate(self.treeHeaders):
+            text = header
+            if index == self.jobSorter.column:
+                text += u" \u25bc" if self.jobSorter.reverse else u" \u25b2"
+            self.tree_data.heading(header, text=text)
+
+    def scheduleFilter(self, event=None):
+        if self.filterAfterId is not None:
+            self.filterEntry.after_cancel(self.filterAfterId)
+        self.filterAfterId = self.filterEntry.after(self.filterDelay, self.applyFilter)
+
+    def applyFilter(self, span=NULL_SPAN):
+        if self.filterAfterId is not None:
+            self.filterEntry.after_cancel(self.filterAfterId)
+            self.filterAfterId = None
+        keyedRows = self.jobFilter.filter(self.filterEntry.get())
+        span.mark("filter")
+        self.jobTable.update(keyedRows)
+        span.mark("render")
 
     def scancel(self):
         if not self.connected:
             tkMessageBox.showwarning(title="Cannot scancel!",
                                      message="You have to be connected with host to cancel job")
+            return
 
-        currentSel = self.tree_data.focus()
+        currentSel = self.jobTable.focus()
         if currentSel == "":
             tkMessageBox.showwarning(title="Cannot execute", message="Please select job")
             return
 
-        jobID = self.tree_data.item(currentSel)["values"][0]
-
-        jobManagerDir = self.jobManagerDirEntry.get()
-        if jobManagerDir[-1] != "/":
-            jobManagerDir += "/"
-
-        command = "scancel " + str(jobID)
+        values = self.jobTable.values(currentSel)
+        session = self.connections.get(values[0])
+        if session is None:
+            tkMessageBox.showwarning(title="Cannot scancel!", message="Not connected with " + values[0])
+            return
+        jobID = values[1]
 
-        stdin, stdout, stderr = self.client.exec_command(command)
+        self.executor.submit("scancel " + str(jobID), lambda task: session.cancelJob(jobID, task))
 
     def sremovePy(self):
         if not self.connected:
             tkMessageBox.showwarning(title="Cannot forget!", message="You have to be connected with host to forget job")
+            return
 
-        currentSel = self.tree_data.focus()
+        currentSel = self.jobTable.focus()
         if currentSel == "":
             tkMessageBox.showwarning(title="Cannot execute", message="Please select job")
             return
 
-        jobID = self.tree_data.item(currentSel)["values"][0]
-
-        jobManagerDir = self.jobManagerDirEntry.get()
-        if jobManagerDir[-1] != "/":
-            jobManagerDir += "/"
-
-        command = " python " + jobManagerDir + "sremove.py " + str(jobID)
-
-        stdin, stdout, stderr = self.client.exec_command(command)
-
-        item2forget = self.tree_data.selection()[0]
-        self.tree_data.delete(item2forget)
+        values = self.jobTable.values(currentSel)
+        session = self.connections.get(values[0])
+        if session is None:
+            tkMessageBox.showwarning(title="Cannot forget!", message="Not connected with " + values[0])
+            return
+        jobID = values[1]
+
+        self.executor.submit("forget " + str(jobID), lambda task: session.forgetJob(jobID, task),
+                             lambda result: self.jobForgotten(session, currentSel))
+
+    def jobForgotten(self, session, item2forget):
+        # the rows shown no longer match the helper's version
+        self.statusVersions.pop(session.key, None)
+        if isinstance(session.backend, SlurmBackend):
+            self.forgottenJobs[session.key] = sorted(session.backend.forgotten)
+            self.saveConfig()
+        self.forgetTreeItem(item2forget)
+
+    def forgetTreeItem(self, item2forget):
+        for status in (self.actualStatus, self.incomingStatus):
+            if status is None:
+                continue
+            for mainKey in status:
+                status[mainKey] = [row for row in status[mainKey] if JobTable.rowKey(row) != item2forget]
+        self.jobTable.remove(item2forget)
 
     def refreshDirectoryView(self):
         if not self.connected:
             tkMessageBox.showwarning(title="Cannot execute!", message="You have to be connected with host")
+            return
 
         #        currentSel = self.tree_data.focus()
         #        if currentSel == "" :
@@ -584,18 +4333,8 @@ class JobStatusGUI:
             dir2print = self.currentDir
             fileSelection = self.directoryViewList.curselection()
 
-            stdin, stdout, stderr = self.client.exec_command("ls -p " + dir2print)
-            filesList = list(stdout.readlines())
-
-            self.directoryViewList.delete(0, "end")
-
-            for filename in filesList:
-                self.directoryViewList.insert("end", filename.strip())
-            self.directoryViewList.insert("end", "../")
-            if fileSelection:
-                self.directoryViewList.see(fileSelection)
-
             self.outputText.delete("1.0", "end")
+            self.listRemoteDir(dir2print, fileSelection, True)
 
     def downloadFile(self):
         if not self.connected:
@@ -622,12 +4361,22 @@ class JobStatusGUI:
         fullPath = dir2go +"/" +  fileSelection
         path2save = join(self.currentLocalDir, fileSelection)
 
-        lastDir = getcwd()
-        sftp = self.client.open_sftp()
-        chdir(self.currentLocalDir)
-        sftp.get(fullPath, path2save)
-        chdir(lastDir)
-        sftp.close()
+        self.executor.submit("download " + fileSelection, self.downloadRunner(fullPath, path2save),
+                             span=self.perf.start("download", fullPath))
+
+    def downloadRunner(self, fullPath, path2save=None):
+        # without path2save the file goes through the download cache
+        session = self.session
+
+        def download(task):
+            def progress(completed, total, throughput, eta):
+                task.post(self.setTaskDetail, task, formatTransferProgress(completed, total, throughput, eta))
+
+            if path2save is None:
+                return session.cachedDownload(fullPath, self.downloadCache, task, progress)
+            return session.download(fullPath, path2save, task, progress)
+
+        return download
 
     def downloadAndLoadToPymol(self):
         if not self.connected:
@@ -652,15 +4401,35 @@ class JobStatusGUI:
         #fullPath = join(dir2go, fileSelection)
         #fast fix to work on windows
         fullPath = dir2go +"/" + fileSelection
-        path2save = join(self.currentLocalDir, fileSelection)
 
-        lastDir = getcwd()
-        sftp = self.client.open_sftp()
-        chdir(self.currentLocalDir)
-        sftp.get(fullPath, path2save)
-        chdir(lastDir)
-        sftp.close()
-        cmd.load(path2save)
+        self.executor.submit("download " + fileSelection, self.pymolLoadRunner(fullPath, fileSelection),
+                             self.loadIntoPymol, span=self.perf.start("download", fullPath))
+
+    def pymolLoadRunner(self, fullPath, fileName):
+        # a cached copy is loaded from disk; otherwise, in memory mode, files
+        # of a load_raw format up to memoryLoadLimit are read into memory
+        # and never written locally, the rest goes through the cache
+        session = self.session
+        cache = self.downloadCache
+        inMemory = self.loadInMemory.get() == 1 and memoryLoadFormat(fileName)[1] is not None
+
+        def load(task):
+            def progress(completed, total, throughput, eta):
+                task.post(self.setTaskDetail, task, formatTransferProgress(completed, total, throughput, eta))
+
+            key, size = session.cacheKey(fullPath, cache, task)
+            if inMemory and size <= self.memoryLoadLimit and cache.lookup(key) is None:
+                return fileName, session.readFile(fullPath, task, progress, fileName.endswith(".gz"))
+            return session.cachedDownload(fullPath, cache, task, progress, key)
+
+        return load
+
+    def loadIntoPymol(self, result):
+        # a local path or (file name, contents) from pymolLoadRunner
+        if isinstance(result, tuple):
+            loadFromMemory(*result)
+        else:
+            cmd.load(result)
 
     def gridLoginData(self):
         loginLabel = Tkinter.Label(self.loginData, text="login")
@@ -708,6 +4477,24 @@ class JobStatusGUI:
 
         self.statusEntry.insert(0, "Disconnected")
         self.statusEntry.configure(state="readonly")
+
+        remoteHelperCheck = Tkinter.Checkbutton(self.loginData, text="Use remote helper",
+                                                variable=self.useRemoteHelper, command=self.saveConfig)
+        remoteHelperCheck.grid(row=7, column=0, columnspan=2)
+
+        backendLabel = Tkinter.Label(self.loginData, text="Status backend")
+        backendLabel.grid(row=8, column=0)
+
+        self.backendMenu = Tkinter.OptionMenu(self.loginData, self.statusBackend, *STATUS_BACKENDS)
+        self.backendMenu.configure(width=16)
+        self.backendMenu.grid(row=8, column=1)
+
+        compressionLabel = Tkinter.Label(self.loginData, text="Compression")
+        compressionLabel.grid(row=9, column=0)
+
+        self.compressionMenu = Tkinter.OptionMenu(self.loginData, self.compression, *COMPRESSION_MODES)
+        self.compressionMenu.configure(width=16)
+        self.compressionMenu.grid(row=9, column=1)
         #
         #        downloadLabel = Tkinter.Label(self.loginData, text = "Download dir")
         #        downloadLabel.grid(row = 7, column = 0)
@@ -720,25 +4507,29 @@ class JobStatusGUI:
         #        self.downloadEntry.configure(state = "readonly")
         #
         accountsLabel = Tkinter.Label(self.loginData, text="Accounts:")
-        accountsLabel.grid(row=9, column=0, columnspan=5)
+        accountsLabel.grid(row=10, column=0, columnspan=5)
 
-        treeHeaders = ["Host", "Login", "Port", "Password", "JobManager dir"]
-        treeHeaders2width = {"Host": 200, "Login": 200, "Port": 80, "Password": 200, "JobManager dir": 200}
+        treeHeaders = ["Host", "Login", "Port", "Password", "JobManager dir", "Backend", "Compression"]
+        treeHeaders2width = {"Host": 200, "Login": 200, "Port": 80, "Password": 200, "JobManager dir": 200,
+                             "Backend": 120, "Compression": 100}
         self.tree_data_accounts = ttk.Treeview(self.loginData, columns=treeHeaders, show="headings", heigh=15)
         for header in treeHeaders:
             self.tree_data_accounts.heading(header, text=header)
             self.tree_data_accounts.column(header, width=treeHeaders2width[header])
-        self.tree_data_accounts.grid(row=10, column=0, columnspan=5, rowspan=15)
+        self.tree_data_accounts.grid(row=11, column=0, columnspan=5, rowspan=15)
         self.tree_data_accounts.bind("<Button-1>", self.selectAccount)
 
-    def selectAccount(self, event):
-        if self.connected:
-            return
+        for account in self.accounts:
+            tableRow = (account["host"], account["login"], account["port"], account["password"],
+                        account["jobManagerDir"], account["backend"], account["compression"])
+            self.tree_data_accounts.insert('', "end", values=tableRow)
 
+    def selectAccount(self, event):
         item = self.tree_data_accounts.identify_row(event.y)
 
         if item:
             accountData = self.tree_data_accounts.item(item, 'values')
+            self.setLoginEntriesState(False)
 
             self.loginEntry.delete(0, "end")
             self.loginEntry.insert(0, accountData[1])
@@ -755,6 +4546,25 @@ class JobStatusGUI:
             self.jobManagerDirEntry.delete(0, "end")
             self.jobManagerDirEntry.insert(0, accountData[4])
 
+            if len(accountData) > 5:
+                self.statusBackend.set(accountData[5])
+            if len(accountData) > 6:
+                self.compression.set(accountData[6])
+
+            self.setLoginEntriesState(self.entriesAccountKey() in self.connections)
+
+    def entriesAccountKey(self):
+        return ConnectionManager.accountKey({"login": self.loginEntry.get(), "host": self.hostEntry.get(),
+                                             "port": self.portEntry.get()})
+
+    def setLoginEntriesState(self, connected):
+        # entries of a connected account are locked until it is disconnected
+        state = "readonly" if connected else "normal"
+        for entry in (self.loginEntry, self.hostEntry, self.portEntry, self.passwordEntry, self.jobManagerDirEntry):
+            entry.configure(state=state)
+        self.backendMenu.configure(state="disabled" if connected else "normal")
+        self.compressionMenu.configure(state="disabled" if connected else "normal")
+
     # def changeDownloadDir(self):
     #     newDir = tkFileDialog.askdirectory()
     #     if not newDir:
@@ -765,68 +4575,187 @@ class JobStatusGUI:
     #     self.downloadEntry.insert("end", newDir)
     #     self.downloadEntry.configure(state="readonly")
 
-    def connect(self):
-        if self.connected:
-            return
+    def setStatusEntry(self, text):
+        self.statusEntry.configure(state="normal")
+        self.statusEntry.delete(0, "end")
+        self.statusEntry.insert(0, text)
+        self.statusEntry.configure(state="readonly")
+
+    def refreshConnectionStatus(self):
+        sessions = self.connections.values()
+        if not sessions:
+            self.setStatusEntry("Connecting..." if self.connecting else "Disconnected")
+        elif len(sessions) > 1:
+            self.setStatusEntry("Connected to %d hosts" % len(sessions))
+        elif sessions[0].agentRunning():
+            self.setStatusEntry("Connected (helper)")
+        else:
+            self.setStatusEntry("Connected")
 
+    def connect(self):
         host = self.hostEntry.get()
         login = self.loginEntry.get()
         port = int(self.portEntry.get())
         password = self.passwordEntry.get()
+        jmDir = self.jobManagerDirEntry.get()
+        account = {"login": login, "port": port, "host": host, "jobManagerDir": jmDir,
+                   "backend": self.statusBackend.get(), "compression": self.compression.get()}
+        key = ConnectionManager.accountKey(account)
+        if key in self.connections or key in self.connecting:
+            return
 
-        try:
-            self.client.connect(host, port=port, username=login, password=password)
+        session = createSession(account, self.useRemoteHelper.get() == 1, self.forgottenJobs.get(key))
+
+        def openConnection(task):
+            task.addCancelHook(session.client.close)
+            session.connect(password, task)
+            return session
+
+        self.connecting.add(key)
+        self.refreshConnectionStatus()
+        self.executor.submit("connect " + host, openConnection,
+                             lambda result: self.connectionOpened(session, host, login, port, password, jmDir),
+                             lambda error: self.connectionFailed(session, error), key="connect:" + key,
+                             span=self.perf.start("connect", key))
+
+    def connectionFailed(self, session, error):
+        self.connecting.discard(session.key)
+        self.refreshConnectionStatus()
+        tkMessageBox.showwarning(title="Connection error!",
+                                 message="Cannot connect to " + session.account["host"] +
+                                         "! Please check login, password and internet connection")
+
+    def connectionOpened(self, session, host, login, port, password, jmDir):
+        self.connecting.discard(session.key)
+        self.connections.add(session)
+        if self.session is None:
+            self.session = session
+            if self.currentDir and self.snapshotCluster == session.key:
+                self.listRemoteDir(self.currentDir, None, True)
+            elif self.currentDir:
+                # the restored directory belongs to another cluster
+                self.setCurrentDir("")
+                self.directoryViewList.delete(0, "end")
+        self.connected = True
+        self.refreshConnectionStatus()
 
-            self.statusEntry.configure(state="normal")
-            self.statusEntry.delete(0, "end")
-            self.statusEntry.insert(0, "Connected")
-            self.statusEntry.configure(state="readonly")
-            self.connected = True
+        if self.staleSince is not None:
+            # snapshot rows on screen, refresh them right away
+            self.requestStatus(False)
 
-            self.loginEntry.configure(state="readonly")
-            self.hostEntry.configure(state="readonly")
-            self.portEntry.configure(state="readonly")
+        if self.entriesAccountKey() == session.key:
             if not self.savePassword:
                 self.passwordEntry.delete(0, "end")
+            self.setLoginEntriesState(True)
 
-            self.passwordEntry.configure(state="readonly")
-            self.jobManagerDirEntry.configure(state="readonly")
-
-            jmDir = self.jobManagerDirEntry.get()
-            accountDict = {"login": login, "password": "", "port": int(port), "host": host,
-                           "jobManagerDir": jmDir}
+        backendName = session.backend.name
+        accountDict = {"login": login, "password": "", "port": int(port), "host": host,
+                       "jobManagerDir": jmDir, "backend": backendName, "compression": session.compression}
 
-            if self.savePassword:
-                accountDict["password"] = password
+        if self.savePassword:
+            accountDict["password"] = password
 
-            if accountDict not in self.accounts:
-                self.accounts.append(accountDict)
-                tableRow = (host, login, port, password, jmDir)
-                self.tree_data_accounts.insert('', "end", values=tableRow)
+        if accountDict not in self.accounts:
+            self.accounts.append(accountDict)
+            tableRow = (host, login, port, password, jmDir, backendName, session.compression)
+            self.tree_data_accounts.insert('', "end", values=tableRow)
 
-                state = self.getState()
-                with open(self.configFile, 'w') as fp:
-                    json.dump(state, fp)
+            state = self.getState()
+            with open(self.configFile, 'w') as fp:
+                json.dump(state, fp)
 
-        except Exception:
-            tkMessageBox.showwarning(title="Connection error!",
-                                     message="Cannot connect to host! Please check login, password and internet connection")
+        if len(self.connections) == 1:
+            self.statusPoller.resume()
 
     def disconnect(self):
-        if self.connected:
-            self.client.close()
+        # disconnects the account shown in the login entries, others stay open
+        session = self.connections.remove(self.entriesAccountKey())
+        if session is None:
+            return
+
+        # a refresh in flight waits for every cluster, so it is restarted
+        # below for the clusters that stay connected
+        restartStatus = self.incomingStatus is not None
+        for key in [session.key] + self.connections.keys():
+            self.executor.cancelKeyed("status:" + key)
+        self.dropIncomingStatus()
+
+        if self.session is session:
+            self.stopFollow()
+            for key in ("command", "ls", "follow"):
+                self.executor.cancelKeyed(key)
+            self.session = None
+            self.setCurrentDir("")
+            self.directoryViewList.delete(0, "end")
 
-            self.statusEntry.configure(state="normal")
-            self.statusEntry.delete(0, "end")
-            self.statusEntry.insert(0, "Disconnected")
-            self.statusEntry.configure(state="readonly")
-            self.connected = False
+        for mainKey in list(self.actualStatus.keys()):
+            if mainKey[0] == session.key:
+                del self.actualStatus[mainKey]
+        self.statusVersions.pop(session.key, None)
+        self.filterJobs()
 
-            self.loginEntry.configure(state="normal")
-            self.hostEntry.configure(state="normal")
-            self.portEntry.configure(state="normal")
-            self.passwordEntry.configure(state="normal")
-            self.jobManagerDirEntry.configure(state="normal")
+        self.executor.submit("disconnect " + session.account["host"], lambda task: session.close())
+
+        self.connected = len(self.connections) > 0
+        if self.connected:
+            self.statusPoller.resume()
+            if restartStatus:
+                self.requestStatus(False)
+        else:
+            self.statusPoller.pause()
+
+        self.refreshConnectionStatus()
+        self.setLoginEntriesState(False)
+
+    def cancelOperations(self):
+        self.stopFollow()
+        self.executor.cancelAll()
+        self.dropIncomingStatus()
+        if self.statusPoller.inFlight:
+            # cancelled status tasks never finish the poll
+            self.statusPoller.pollCancelled()
+        if self.connecting:
+            self.connecting.clear()
+            self.refreshConnectionStatus()
+
+    def close(self):
+        # the window is closing: nothing may keep polling, scheduling or
+        # holding a connection after it is gone
+        self.statusPoller.stop()
+        self.stopFollow()
+        self.cancelStatusFlush()
+        for afterId in (self.filterAfterId, self.prefetchAfterId):
+            if afterId is not None:
+                self.jobMonitor.after_cancel(afterId)
+        self.executor.shutdown()
+
+        sessions = self.connections.values()
+        for session in sessions:
+            self.connections.remove(session.key)
+
+        def closeSessions():
+            for session in sessions:
+                try:
+                    session.close()
+                except Exception:
+                    pass
+
+        # closing waits for the network, the window goes away right now
+        closer = threading.Thread(target=closeSessions, name="slurm_watcher-close")
+        closer.daemon = True
+        closer.start()
+        self.ntbk.winfo_toplevel().destroy()
+
+    def setTaskDetail(self, task, detail):
+        task.detail = detail
+        self.refreshBusyIndicator()
+
+    def refreshBusyIndicator(self):
+        names = [(task.name + " " + task.detail).strip() for task in self.executor.activeTasks()]
+        if names:
+            self.busyLabel.configure(text="Working: " + ", ".join(names), fg="red")
+        else:
+            self.busyLabel.configure(text="Idle", fg="black")
 
     def getState(self):
         state = {}
@@ -841,6 +4770,15 @@ class JobStatusGUI:
         state["customButtonsLocal"] = self.customButtonsLocalData
         state["localPaths"] = self.localPaths
         state["localCommanderCustomButtons"] = self.localCommanderButtonsData
+        state["useRemoteHelper"] = self.useRemoteHelper.get()
+        state["outputMaxLines"] = self.commandOutput.maxLines
+        state["forgottenJobs"] = self.forgottenJobs
+        state["autoRefresh"] = self.autoRefresh.get()
+        state["pollInterval"] = self.pollIntervalEntry.get()
+        state["jobSort"] = [self.jobSorter.column, self.jobSorter.reverse]
+        state["recordTimings"] = self.perfEnabled.get()
+        state["downloadCacheMB"] = self.downloadCache.maxBytes // 1048576
+        state["loadInMemory"] = self.loadInMemory.get()
         # state["downloadDir"] = self.downloadEntry.get()
 
         return state
@@ -851,11 +4789,18 @@ class JobStatusGUI:
         for account in self.accounts:
             if not self.savePassword:
                 account["password"] = ""
-
-            tableRow = (
-                account["host"], account["login"], account["port"], account["password"], account["jobManagerDir"])
-
-            self.tree_data_accounts.insert('', "end", values=tableRow)
+            if "backend" not in account:
+                account["backend"] = CalculationFlowBackend.name
+            if "compression" not in account:
+                account["compression"] = "auto"
+
+        # tabs built before the state was loaded show the new values too
+        if self.tabBuilt(self.loginData):
+            self.tree_data_accounts.delete(*self.tree_data_accounts.get_children())
+            for account in self.accounts:
+                tableRow = (account["host"], account["login"], account["port"], account["password"],
+                            account["jobManagerDir"], account["backend"], account["compression"])
+                self.tree_data_accounts.insert('', "end", values=tableRow)
 
         if "customButtons" in state:
             self.customButtonsData = state["customButtons"]
@@ -876,21 +4821,60 @@ class JobStatusGUI:
             cwd = getcwd()
             if cwd not in self.localPaths:
                 self.localPaths.insert(0, cwd)
-
             self.currentLocalDir = cwd
-            self.localCurrentDirEntry.configure(state="normal")
-            self.localCurrentDirEntry.delete(0, "end")
-            self.localCurrentDirEntry.insert(0, self.currentLocalDir)
-            self.localCurrentDirEntry.configure(state="readonly")
-            self.refreshLocalCommanderDir()
-            self.pathList.delete(0, "end")
 
-            for path in self.localPaths:
-                self.pathList.insert("end", path)
+            if self.tabBuilt(self.localCommander):
+                self.localCurrentDirEntry.configure(state="normal")
+                self.localCurrentDirEntry.delete(0, "end")
+                self.localCurrentDirEntry.insert(0, self.currentLocalDir)
+                self.localCurrentDirEntry.configure(state="readonly")
+                self.refreshLocalCommanderDir()
+                self.pathList.delete(0, "end")
+
+                for path in self.localPaths:
+                    self.pathList.insert("end", path)
 
         if "localCommanderCustomButtons" in state:
             self.localCommanderButtonsData = state["localCommanderCustomButtons"]
-            self.refreshCustomButtonsLocalCommander()
+            if self.tabBuilt(self.localCommander):
+                self.refreshCustomButtonsLocalCommander()
+
+        if "useRemoteHelper" in state:
+            self.useRemoteHelper.set(state["useRemoteHelper"])
+
+        if "outputMaxLines" in state:
+            self.commandOutput.maxLines = state["outputMaxLines"]
+
+        if "forgottenJobs" in state:
+            self.forgottenJobs = state["forgottenJobs"]
+
+        if "pollInterval" in state:
+            self.pollIntervalEntry.delete(0, "end")
+            self.pollIntervalEntry.insert(0, state["pollInterval"])
+
+        if "autoRefresh" in state:
+            self.autoRefresh.set(state["autoRefresh"])
+
+        if "jobSort" in state:
+            self.jobSorter.column, self.jobSorter.reverse = state["jobSort"]
+            self.refreshSortHeadings()
+
+        if "downloadCacheMB" in state:
+            self.downloadCache.maxBytes = int(state["downloadCacheMB"]) * 1048576
+
+        if "loadInMemory" in state:
+            self.loadInMemory.set(state["loadInMemory"])
+
+        if "recordTimings" in state:
+            self.perfEnabled.set(state["recordTimings"])
+            self.perf.enabled = self.perfEnabled.get() == 1
+
+        self.applyPollSettings()
+
+    def saveConfig(self):
+        state = self.getState()
+        with open(self.configFile, 'w') as fp:
+            json.dump(state, fp)
 
     def refreshCustomButtons(self):
         for i, data in enumerate(self.customButtonsData):
@@ -1030,7 +5014,6 @@ class JobStatusGUI:
             newButton.grid(row=rowActual, column=colActual)
             newButton.bind("<Button-3>", lambda e, arg=i: self.customButtonLocalCommanderSet(e, arg))
             self.localCommanderButtons.append(newButton)
-            self.localCommanderButtonsData.append({})
             colActual += 1
             if colActual >= self.localCommanderButtonsPerRow:
                 colActual = 0
@@ -1043,13 +5026,147 @@ class JobStatusGUI:
 
         self.localCurrentDirEntry = Tkinter.Entry(self.localCommander, width=110)
         self.localCurrentDirEntry.grid(row=rowActual, column=1, columnspan=5)
-
+        self.localCurrentDirEntry.insert(0, self.currentLocalDir)
         self.localCurrentDirEntry.configure(state="readonly")
 
+        for path in self.localPaths or [self.currentLocalDir]:
+            self.pathList.insert("end", path)
+        self.refreshCustomButtonsLocalCommander()
+        self.refreshLocalCommanderDir()
+
+    def gridDiagnostics(self):
+        recordCheck = Tkinter.Checkbutton(self.diagnostics, text="Record timings", variable=self.perfEnabled,
+                                          command=self.toggleTimings)
+        recordCheck.grid(row=0, column=0)
+
+        refreshButton = Tkinter.Button(self.diagnostics, text="Refresh", width=15, command=self.refreshDiagnostics)
+        refreshButton.grid(row=0, column=1)
+
+        clearButton = Tkinter.Button(self.diagnostics, text="Clear", width=15, command=self.clearTimings)
+        clearButton.grid(row=0, column=2)
+
+        exportJsonButton = Tkinter.Button(self.diagnostics, text="Export JSON", width=15,
+                                          command=lambda: self.exportTimings(".json"))
+        exportJsonButton.grid(row=0, column=3)
+
+        exportCsvButton = Tkinter.Button(self.diagnostics, text="Export CSV", width=15,
+                                         command=lambda: self.exportTimings(".csv"))
+        exportCsvButton.grid(row=0, column=4)
+
+        clearCacheButton = Tkinter.Button(self.diagnostics, text="Clear download cache", width=20,
+                                          command=self.clearDownloadCache)
+        clearCacheButton.grid(row=0, column=5)
+
+        treeHeaders = ["Operation", "Count", "Errors", "p50 [ms]", "p95 [ms]", "Max [ms]", "Bytes", "Phases p50 [ms]"]
+        treeHeaders2width = {"Operation": 110, "Count": 60, "Errors": 60, "p50 [ms]": 80, "p95 [ms]": 80,
+                             "Max [ms]": 80, "Bytes": 90, "Phases p50 [ms]": 800}
+        self.tree_data_timings = ttk.Treeview(self.diagnostics, columns=treeHeaders, show="headings", heigh=20)
+        for header in treeHeaders:
+            self.tree_data_timings.heading(header, text=header)
+            self.tree_data_timings.column(header, width=treeHeaders2width[header])
+        self.tree_data_timings.grid(row=1, column=0, columnspan=10, rowspan=20)
+
+        self.startupLabel = Tkinter.Label(self.diagnostics, justify="left", anchor="w")
+        self.startupLabel.grid(row=21, column=0, columnspan=10, sticky="w")
+
+        # the panel is refreshed every time its tab is shown
+        self.ntbk.bind("<<NotebookTabChanged>>", self.diagnosticsShown, add="+")
+        self.refreshDiagnostics()
+
+    def diagnosticsShown(self, event=None):
+        if str(self.ntbk.select()) == str(self.diagnostics):
+            self.refreshDiagnostics()
+
+    def refreshDiagnostics(self):
+        self.tree_data_timings.delete(*self.tree_data_timings.get_children())
+        for operation, summary in self.perf.summary().items():
+            phases = ", ".join("%s %.1f" % (name, seconds * 1000) for name, seconds in summary["phases"].items())
+            tableRow = (operation, summary["count"], summary["errors"], "%.1f" % (summary["p50"] * 1000),
+                        "%.1f" % (summary["p95"] * 1000), "%.1f" % (summary["max"] * 1000), summary["bytes"], phases)
+            self.tree_data_timings.insert('', "end", values=tableRow)
+
+        text = "Start: " + self.startupTimer.describe()
+        if self.tabTimes:
+            text += "\nTabs built: " + ", ".join("%s %.1f ms" % (name, seconds * 1000)
+                                                 for name, seconds in self.tabTimes)
+        for session in self.connections.values():
+            mode = session.compression
+            if mode == "auto":
+                mode += ", helper outputs " + ("packed" if session.compressPayloads() else "plain")
+            text += "\n" + session.key + " (" + mode + "): " + session.traffic.describe()
+        entriesNo, cacheBytes = self.downloadCache.usage()
+        text += "\nDownload cache: %d files, %.1f of %.0f MB" % (entriesNo, cacheBytes / 1048576.0,
+                                                                 self.downloadCache.maxBytes / 1048576.0)
+        self.startupLabel.configure(text=text)
+
+    def toggleTimings(self):
+        self.perf.enabled = self.perfEnabled.get() == 1
+        self.saveConfig()
+
+    def clearTimings(self):
+        self.perf.clear()
+        self.refreshDiagnostics()
+
+    def clearDownloadCache(self):
+        # deleting up to the whole budget takes a while
+        cache = self.downloadCache
+        self.executor.submit("clear download cache", lambda task: cache.clear(),
+                             lambda result: self.refreshDiagnostics())
+
+    def exportTimings(self, extension):
+        if extension == ".csv":
+            fileTypes = (("CSV files", "*.csv"), ("all files", "*.*"))
+        else:
+            fileTypes = (("Json files", "*.json"), ("all files", "*.*"))
+        path = tkFileDialog.asksaveasfilename(defaultextension=extension, filetypes=fileTypes,
+                                              initialfile="slurm_watcher_timings" + extension)
+
+        if path == () or path == "":
+            return
+
+        if extension == ".csv":
+            self.perf.exportCsv(path)
+        else:
+            self.perf.exportJson(path, {"startup": self.startupTimer.phases, "tabs": self.tabTimes})
+
     def grid(self):
         self.gridJobMonitor()
-        self.gridLoginData()
-        self.gridLocalCommander()
+
+
+# load_raw formats of PyMOL by file extension, used for loads from memory
+MEMORY_LOAD_FORMATS = {"pdb": "pdb", "ent": "pdb", "pqr": "pqr", "cif": "cif", "mmcif": "cif", "mol": "mol",
+                       "mol2": "mol2", "sdf": "sdf", "mae": "mae", "xyz": "xyz"}
+
+
+def memoryLoadFormat(fileName):
+    # (object name, load_raw format or None) of a file, .gz suffix ignored
+    if fileName.endswith(".gz"):
+        fileName = fileName[:-3]
+    objectName, extension = os.path.splitext(fileName)
+    return objectName, MEMORY_LOAD_FORMATS.get(extension[1:].lower())
+
+
+def loadFromMemory(fileName, data):
+    # data is the decompressed file; formats load_raw does not take go
+    # through a temporary file that is removed right after loading
+    objectName, format = memoryLoadFormat(fileName)
+    if format is not None:
+        content = data if isinstance(data, str) else data.decode("utf-8", "replace")
+        try:
+            result = cmd.load_raw(content, format, objectName)
+            if not (isinstance(result, int) and result < 0):
+                return
+        except Exception:
+            pass
+
+    suffix = os.path.splitext(fileName[:-3] if fileName.endswith(".gz") else fileName)[1]
+    fd, temporaryPath = tempfile.mkstemp(suffix=suffix, prefix="slurm_watcher_")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        cmd.load(temporaryPath, objectName)
+    finally:
+        os.remove(temporaryPath)
 
 
 def __init_plugin__(self=None):
@@ -1063,17 +5180,234 @@ def fetchdialog(simulation=False):
         app = plugins.get_pmgapp()
         root = plugins.get_tk_root()
 
+    startupTimer = PhaseTimer()
     self = Tkinter.Toplevel(root)
     self.title('Slurm watcher')
     self.minsize(1390, 780)
     self.resizable(0, 0)
 
     nb = ttk.Notebook(self, height=780, width=1390)
-    guiJobStatus = JobStatusGUI(nb)
+    startupTimer.mark("window")
+    guiJobStatus = JobStatusGUI(nb, startupTimer)
+    self.protocol("WM_DELETE_WINDOW", guiJobStatus.close)
 
     if simulation:
         self.mainloop()
 
 
+def reportErrors(failed):
+    for name, error in failed.items():
+        sys.stderr.write("slurm_watcher: " + name + ": " + str(error) + "\n")
+
+
+def printJobs(rows):
+    lines = [JobTable.headers] + [tuple(str(value) for value in JobTable.tableRow(row)) for row in rows]
+    widths = [max(len(line[column]) for line in lines) for column in range(len(JobTable.headers))]
+    for line in lines:
+        sys.stdout.write("  ".join(value.ljust(width) for value, width in zip(line, widths)).rstrip() + "\n")
+
+
+def cliStatus(watcher, args):
+    rows, failed = watcher.status()
+    reportErrors(failed)
+    if args.json:
+        json.dump(rows, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+    else:
+        printJobs(rows)
+    return 1 if failed else 0
+
+
+def cliCancel(watcher, args):
+    failed = watcher.cancel(args.jobs)
+    reportErrors(failed)
+    return 1 if failed else 0
+
+
+def cliForget(watcher, args):
+    failed = watcher.forget(args.jobs)
+    reportErrors(failed)
+    return 1 if failed else 0
+
+
+def cliList(watcher, args):
+    for name in watcher.listDir(args.path):
+        sys.stdout.write(name + "\n")
+    return 0
+
+
+def cliGet(watcher, args):
+    localPath = args.local or posixpath.basename(args.remote)
+    if isdir(localPath):
+        localPath = join(localPath, posixpath.basename(args.remote))
+
+    def progress(completed, total, throughput, eta):
+        sys.stderr.write("\r" + formatTransferProgress(completed, total, throughput, eta))
+
+    watcher.download(args.remote, localPath, None, progress if sys.stderr.isatty() else None)
+    if sys.stderr.isatty():
+        sys.stderr.write("\n")
+    return 0
+
+
+def cliWatch(watcher, args):
+    # prints status changes until interrupted, rows of clusters that could
+    # not be polled keep their last known state
+    interval = max(StatusPoller.minimumInterval, args.interval)
+    previous = OrderedDict()
+    while True:
+        rows, failed = watcher.status()
+        reportErrors(failed)
+        current = OrderedDict((JobTable.rowKey(row), row) for row in rows)
+        for key, row in previous.items():
+            if row["Cluster"] in failed:
+                current.setdefault(key, row)
+
+        events = []
+        for key, row in current.items():
+            old = previous.get(key)
+            if old is None or old["Status"] != row["Status"]:
+                events.append((key, old["Status"] if old else None, row["Status"], row))
+        for key, row in previous.items():
+            if key not in current:
+                events.append((key, row["Status"], None, row))
+
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        for key, old, new, row in events:
+            if args.json:
+                sys.stdout.write(json.dumps({"time": now, "job": key, "from": old, "to": new, "row": row}) + "\n")
+            else:
+                sys.stdout.write(now + "  " + key + "  " + str(old or "-") + " -> " + str(new or "gone") + "  " +
+                                 row["RunningDir"] + "\n")
+        sys.stdout.flush()
+
+        previous = current
+        time.sleep(interval)
+
+
+def cliHistory(watcher, args):
+    history = watcher.history()
+    if args.job:
+        cluster, separator, jobID = args.job.rpartition("/")
+        matches = [job for job in history.jobs(jobID=jobID)
+                   if not cluster or cluster in SlurmWatcher.accountNames(parseAccountKey(job["Cluster"]))]
+        for job in matches:
+            for state, timestamp in history.transitions(job["Cluster"], job["jobID"]):
+                transition = {"Cluster": job["Cluster"], "jobID": job["jobID"], "Status": state, "timestamp": timestamp}
+                if args.json:
+                    sys.stdout.write(json.dumps(transition) + "\n")
+                else:
+                    sys.stdout.write(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + "  " +
+                                     job["Cluster"] + "/" + job["jobID"] + "  " + state + "\n")
+        return 0 if matches else 1
+
+    since = time.time() - args.days * 86400 if args.days else None
+    jobs = history.jobs(args.cluster, args.path, since, args.status, args.limit)
+    durations = history.stateDurations(args.cluster, args.path, since, args.status)
+    for job in jobs:
+        job["durations"] = durations.get((job["Cluster"], job["jobID"]), {})
+    if args.json:
+        json.dump(jobs, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+        return 0
+
+    printJobs(jobs)
+    if args.state:
+        total = sum(job["durations"].get(args.state, 0) for job in jobs)
+        sys.stdout.write("\n" + args.state + ": " + formatDuration(total) + " in " + str(len(jobs)) + " jobs\n")
+    return 0
+
+
+def parseAccountKey(key):
+    login, separator, address = key.partition("@")
+    host, separator, port = address.rpartition(":")
+    return {"login": login, "host": host, "port": port}
+
+
+def main(argv=None):
+    import argparse
+    import getpass
+
+    parser = argparse.ArgumentParser(prog="slurm_watcher",
+                                     description="Jobs and files of the accounts saved by the Slurm watcher plugin. "
+                                                 "Run without arguments to open the GUI.")
+    parser.add_argument("--config", default=defaultConfigDir(), help="directory with config.json (%(default)s)")
+    parser.add_argument("-a", "--account", action="append",
+                        help="login@host:port, login@host or host; repeat for several, all accounts by default")
+    parser.add_argument("--no-helper", action="store_true", help="do not start the remote helper")
+    commands = parser.add_subparsers(dest="command")
+
+    statusParser = commands.add_parser("status", help="print the jobs of all accounts")
+    statusParser.add_argument("--json", action="store_true")
+    statusParser.set_defaults(handler=cliStatus)
+
+    cancelParser = commands.add_parser("cancel", help="cancel jobs")
+    cancelParser.add_argument("jobs", nargs="+", help="jobID, or cluster/jobID with several accounts")
+    cancelParser.set_defaults(handler=cliCancel)
+
+    forgetParser = commands.add_parser("forget", help="remove jobs from the status")
+    forgetParser.add_argument("jobs", nargs="+", help="jobID, or cluster/jobID with several accounts")
+    forgetParser.set_defaults(handler=cliForget)
+
+    listParser = commands.add_parser("ls", help="list a remote directory")
+    listParser.add_argument("path")
+    listParser.set_defaults(handler=cliList, singleAccount=True)
+
+    getParser = commands.add_parser("get", help="download a remote file")
+    getParser.add_argument("remote")
+    getParser.add_argument("local", nargs="?")
+    getParser.set_defaults(handler=cliGet, singleAccount=True)
+
+    watchParser = commands.add_parser("watch", help="print job status changes until interrupted")
+    watchParser.add_argument("--interval", type=int, default=60, help="seconds between polls (%(default)s)")
+    watchParser.add_argument("--json", action="store_true", help="one JSON object per change")
+    watchParser.set_defaults(handler=cliWatch)
+
+    historyParser = commands.add_parser("history", help="query the local job history, no connection needed")
+    historyParser.add_argument("job", nargs="?", help="print the state changes of this job")
+    historyParser.add_argument("--path", help="jobs running in this directory or below")
+    historyParser.add_argument("--days", type=float, help="jobs seen during the last days")
+    historyParser.add_argument("--cluster", help="login@host:port")
+    historyParser.add_argument("--status", help="jobs whose last known state is this")
+    historyParser.add_argument("--state", help="print the total time spent in this state, e.g. PENDING")
+    historyParser.add_argument("--limit", type=int)
+    historyParser.add_argument("--json", action="store_true")
+    historyParser.set_defaults(handler=cliHistory, offline=True)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("a command is required")
+
+    watcher = SlurmWatcher(args.config, False if args.no_helper else None)
+    try:
+        if getattr(args, "offline", False):
+            return args.handler(watcher, args)
+
+        accounts = watcher.findAccounts(args.account)
+        if not accounts:
+            raise ValueError("No accounts in " + watcher.configFile + ", connect once from the plugin")
+        if getattr(args, "singleAccount", False) and len(accounts) != 1:
+            raise ValueError(args.command + " needs a single account, choose one with --account")
+
+        passwordPrompt = None
+        if sys.stdin.isatty():
+            passwordPrompt = lambda key: getpass.getpass(key + " password: ")
+
+        failed = watcher.connect(accounts, passwordPrompt)
+        reportErrors(failed)
+        if not len(watcher.connections):
+            return 1
+        return args.handler(watcher, args) or (1 if failed else 0)
+    except ValueError as e:
+        sys.stderr.write("slurm_watcher: " + str(e) + "\n")
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        watcher.close()
+
+
 if __name__ == "__main__":
+    if HEADLESS:
+        sys.exit(main())
     fetchdialog(True)